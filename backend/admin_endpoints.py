@@ -1,6 +1,8 @@
 import psycopg2
 from flask import jsonify, g
 from datetime import datetime
+from database import after_commit
+from occupancy import room_occupancy
 
 # Flag to indicate if the database is available
 DB_AVAILABLE = False
@@ -174,6 +176,7 @@ def delete_exam(exam_id):
         # Delete the exam
         cursor.execute("DELETE FROM exams WHERE id = %s", (exam_id,))
         conn.commit()
+        after_commit(lambda: room_occupancy.remove_booking(exam_id))
         
         return jsonify({"message": "Exam deleted successfully"}), 200
         
@@ -5,15 +5,21 @@ from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 from werkzeug.security import check_password_hash
-from database import get_db_connection
+from database import get_db_connection, get_pool_stats, init_request_connections, after_commit
 from mock_data import MOCK_EXAMS, MOCK_USERS
-from auth import token_required, admin_required, sec_required
+from auth import token_required, admin_required, sec_required, invalidate_user_principal, principal_cache, verifier_stats, ADMIN_TOKEN_ISSUER
+from occupancy import room_occupancy
+from room_ranking import group_headcounts
+from teacher_availability import teacher_availability
+from class_timetable import class_timetable
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000", "supports_credentials": True}})
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_default_secret_key')
+# One pooled connection and one transaction per request, shared by auth and handlers
+init_request_connections(app)
 
 # --- Database Check ---
 def is_db_connected():
@@ -28,6 +34,15 @@ def is_db_connected():
 DB_AVAILABLE = is_db_connected()
 if not DB_AVAILABLE:
     print("WARNING: Database connection failed. Using mock data.")
+else:
+    # Build the room occupancy index up front so the first availability lookup is served from memory
+    try:
+        room_occupancy.refresh_if_stale(get_db_connection)
+        group_headcounts.refresh_if_stale(get_db_connection)
+        teacher_availability.refresh_if_stale(get_db_connection)
+        class_timetable.refresh_if_stale(get_db_connection)
+    except Exception as e:
+        print(f"Could not build the room occupancy index: {e}")
 
 # --- API Endpoints ---
 
@@ -57,6 +72,7 @@ def login():
 
     if password_hash and check_password_hash(password_hash, password):
         token = jwt.encode({
+            'iss': ADMIN_TOKEN_ISSUER,
             'user_id': str(user_id),
             'role': role_name,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
@@ -110,7 +126,8 @@ def sync_user():
             )
             new_user_record = cursor.fetchone()
             conn.commit()
-            
+            after_commit(lambda: group_headcounts.set_member(user_id, new_user_record[1], new_user_record[4]))
+
             columns = [desc[0] for desc in cursor.description]
             user_data = dict(zip(columns, new_user_record))
             return jsonify(user_data), 201
@@ -185,6 +202,9 @@ def update_user_details():
         cursor.execute(query, tuple(params))
         updated_user = cursor.fetchone()
         conn.commit()
+        after_commit(lambda: invalidate_user_principal(user_id))
+        if updated_user:
+            after_commit(lambda: group_headcounts.set_member(user_id, role_res[0], updated_user[3]))
 
         if not updated_user:
             return jsonify({'message': 'User not found or update failed'}), 404
@@ -273,12 +293,16 @@ def admin_update_user(user_id):
             return jsonify({'message': 'No fields to update'}), 400
 
         params.append(user_id)
-        query = f"UPDATE users SET {', '.join(query_parts)} WHERE id = %s"
+        query = f"UPDATE users SET {', '.join(query_parts)} WHERE id = %s RETURNING role, student_group"
         print(f"[DEBUG] admin_update_user: SQL Query: {query}") # Debug log
         print(f"[DEBUG] admin_update_user: SQL Params: {params}") # Debug log
         
         cursor.execute(query, tuple(params))
+        role, student_group = cursor.fetchone()
         conn.commit()
+        # Role or group may have changed: drop cached principals of this user
+        after_commit(lambda: invalidate_user_principal(user_id))
+        after_commit(lambda: group_headcounts.set_member(user_id, role, student_group))
 
         return jsonify({'message': f'User {user_id} updated successfully'}), 200
 
@@ -323,7 +347,7 @@ def get_exams():
 
 # Import the SG endpoints from the separate file
 import sg_endpoints
-from sg_endpoints import get_sg_exams, get_available_rooms, propose_exam_schedule, reschedule_exam
+from sg_endpoints import get_sg_exams, get_available_rooms, propose_exam_schedule, reschedule_exam, get_availability_grid, find_exam_slots, get_room_allocation, propose_exam_schedules
 
 # Import the SEC endpoints
 import sec_endpoints
@@ -342,11 +366,31 @@ def route_get_sg_exams():
 def route_get_available_rooms():
     return get_available_rooms()
 
+@app.route('/api/sg/availability-grid', methods=['GET'])
+@token_required
+def route_get_availability_grid():
+    return get_availability_grid()
+
+@app.route('/api/sg/exams/<int:exam_id>/slots', methods=['GET'])
+@token_required
+def route_find_exam_slots(exam_id):
+    return find_exam_slots(exam_id)
+
+@app.route('/api/sg/exams/<int:exam_id>/room-allocation', methods=['GET'])
+@token_required
+def route_get_room_allocation(exam_id):
+    return get_room_allocation(exam_id)
+
 @app.route('/api/sg/exams/<int:exam_id>/propose', methods=['PUT'])
 @token_required
 def route_propose_exam_schedule(exam_id):
     return propose_exam_schedule(exam_id)
 
+@app.route('/api/sg/exams/propose', methods=['POST'])
+@token_required
+def route_propose_exam_schedules():
+    return propose_exam_schedules()
+
 @app.route('/api/sg/exams/<int:exam_id>/reschedule', methods=['PUT'])
 @token_required
 def route_reschedule_exam(exam_id):
@@ -455,7 +499,7 @@ def propose_exam_date():
 
 # Import the CD endpoints from the separate file
 import cd_endpoints
-from cd_endpoints import get_teacher_exams, review_exam_proposal, confirm_exam
+from cd_endpoints import get_teacher_exams, review_exam_proposal, confirm_exam, review_exams, get_teacher_availability, import_teacher_availability
 
 # Set DB_AVAILABLE in the cd_endpoints module
 cd_endpoints.DB_AVAILABLE = DB_AVAILABLE
@@ -476,6 +520,21 @@ def route_review_exam_proposal(exam_id):
 def route_confirm_exam(exam_id):
     return confirm_exam(exam_id)
 
+@app.route('/api/cd/exams/review', methods=['POST'])
+@token_required
+def route_review_exams():
+    return review_exams()
+
+@app.route('/api/cd/availability', methods=['GET'])
+@token_required
+def route_get_teacher_availability():
+    return get_teacher_availability()
+
+@app.route('/api/cd/availability', methods=['PUT'])
+@token_required
+def route_import_teacher_availability():
+    return import_teacher_availability()
+
 
 # --- STUDENT Role Endpoints ---
 
@@ -538,16 +597,40 @@ def route_delete_exam(exam_id):
 def route_change_admin_password():
     return change_admin_password()
 
+@app.route('/api/admin/db-pool', methods=['GET'])
+@admin_required
+def route_get_db_pool_stats():
+    """Connection pool counters for monitoring"""
+    stats = get_pool_stats()
+    if stats is None:
+        return jsonify({"error": "Database pool not initialized"}), 503
+    return jsonify(stats), 200
+
+@app.route('/api/admin/auth-stats', methods=['GET'])
+@admin_required
+def route_get_auth_stats():
+    """Verified-token cache and per-verifier latency counters for monitoring"""
+    return jsonify({
+        'principal_cache': principal_cache.stats(),
+        'verifiers': verifier_stats.snapshot(),
+    }), 200
+
+@app.route('/api/admin/occupancy-stats', methods=['GET'])
+@admin_required
+def route_get_occupancy_stats():
+    """Size and age of the in-memory room occupancy index"""
+    return jsonify(room_occupancy.stats()), 200
+
 # --- SEC Role Endpoints ---
 
 # ... (rest of the code remains the same)
 # Import the SEC endpoints from the separate file
 import sec_endpoints
-from sec_endpoints import create_exam, get_all_exams, export_exams_excel, manage_exam_periods, get_exam_periods as sec_get_exam_periods, get_sec_disciplines, get_sec_teachers
+from sec_endpoints import create_exam, get_all_exams, export_exams_excel, manage_exam_periods, get_exam_periods as sec_get_exam_periods, get_sec_disciplines, get_sec_teachers, solve_timetable, simulate_schedule, get_schedule_conflicts, get_schedule_score, generate_seating_plans, get_seating_plan, plan_invigilators, apply_invigilators, import_class_timetable, get_student_conflicts, get_enrollments, update_enrollments
 
 # Import PDF export functionality
 import pdf_export
-from pdf_export import export_exams_pdf
+from pdf_export import export_exams_pdf, export_door_sheets
 
 # Set DB_AVAILABLE in the pdf_export module
 pdf_export.DB_AVAILABLE = DB_AVAILABLE
@@ -574,6 +657,11 @@ def route_export_exams_excel():
 def route_export_exams_pdf():
     return export_exams_pdf()
 
+@app.route('/api/sec/seating/door-sheets', methods=['GET'])
+@sec_required
+def route_export_door_sheets():
+    return export_door_sheets()
+
 @app.route('/api/sec/exam-periods', methods=['POST'])
 @token_required
 def route_manage_exam_periods():
@@ -584,6 +672,66 @@ def route_manage_exam_periods():
 def route_get_exam_periods():
     return sec_get_exam_periods()
 
+@app.route('/api/sec/timetable/solve', methods=['POST'])
+@token_required
+def route_solve_timetable():
+    return solve_timetable()
+
+@app.route('/api/sec/simulate', methods=['POST'])
+@token_required
+def route_simulate_schedule():
+    return simulate_schedule()
+
+@app.route('/api/sec/conflicts', methods=['GET'])
+@token_required
+def route_get_schedule_conflicts():
+    return get_schedule_conflicts()
+
+@app.route('/api/sec/schedule-score', methods=['GET'])
+@token_required
+def route_get_schedule_score():
+    return get_schedule_score()
+
+@app.route('/api/sec/seating/generate', methods=['POST'])
+@token_required
+def route_generate_seating_plans():
+    return generate_seating_plans()
+
+@app.route('/api/sec/exams/<int:exam_id>/seating', methods=['GET'])
+@token_required
+def route_get_seating_plan(exam_id):
+    return get_seating_plan(exam_id)
+
+@app.route('/api/sec/invigilators/plan', methods=['POST'])
+@token_required
+def route_plan_invigilators():
+    return plan_invigilators()
+
+@app.route('/api/sec/invigilators/apply', methods=['POST'])
+@token_required
+def route_apply_invigilators():
+    return apply_invigilators()
+
+@app.route('/api/sec/class-timetable', methods=['PUT'])
+@token_required
+def route_import_class_timetable():
+    return import_class_timetable()
+
+@app.route('/api/sec/student-conflicts', methods=['GET'])
+@token_required
+def route_get_student_conflicts():
+    return get_student_conflicts()
+
+@app.route('/api/sec/enrollments', methods=['GET'])
+@token_required
+def route_get_enrollments():
+    return get_enrollments()
+
+@app.route('/api/sec/enrollments', methods=['POST'])
+@token_required
+def route_update_enrollments():
+    return update_enrollments()
+
 @app.route('/api/sec/approved-exams', methods=['GET'])
 @token_required
 def get_approved_exams():
@@ -680,22 +828,20 @@ def assign_discipline():
         if not cursor.fetchone():
             return jsonify({"error": "No group leader found for this student group"}), 404
             
-        # Check if an exam already exists for this discipline and group
-        cursor.execute(
-            "SELECT id FROM exams WHERE discipline_id = %s AND student_group = %s",
-            (discipline_id, student_group)
-        )
-        if cursor.fetchone():
-            return jsonify({"error": "An exam already exists for this discipline and group"}), 409
-            
-        # Create the exam
+        # Create the exam; the (discipline_id, student_group) unique constraint
+        # rejects duplicates atomically instead of a separate existence check
         cursor.execute(
             """INSERT INTO exams 
             (discipline_id, exam_type, student_group, main_teacher_id, second_teacher_id, status, created_by) 
-            VALUES (%s, %s, %s, %s, %s, 'DRAFT', %s) RETURNING id""",
+            VALUES (%s, %s, %s, %s, %s, 'DRAFT', %s)
+            ON CONFLICT ON CONSTRAINT exams_discipline_group_key DO NOTHING
+            RETURNING id""",
             (discipline_id, exam_type, student_group, main_teacher_id, second_teacher_id, g.current_user.get('id'))
         )
-        exam_id = cursor.fetchone()[0]
+        inserted = cursor.fetchone()
+        if not inserted:
+            return jsonify({"error": "An exam already exists for this discipline and group"}), 409
+        exam_id = inserted[0]
         conn.commit()
         
         return jsonify({
@@ -1073,6 +1219,7 @@ def add_room():
         )
         new_id = cursor.fetchone()[0]
         conn.commit()
+        after_commit(room_occupancy.invalidate)
         return jsonify({'message': 'Room added successfully', 'id': new_id}), 201
     except Exception as e:
         conn.rollback()
@@ -1100,6 +1247,7 @@ def update_room(room_id):
             (name, data.get('short_name'), data.get('building_name'), capacity, room_id)
         )
         conn.commit()
+        after_commit(room_occupancy.invalidate)
         if cursor.rowcount == 0:
             return jsonify({'error': 'Room not found'}), 404
         return jsonify({'message': 'Room updated successfully'})
@@ -1119,6 +1267,7 @@ def delete_room(room_id):
     try:
         cursor.execute("DELETE FROM rooms WHERE id = %s", (room_id,))
         conn.commit()
+        after_commit(room_occupancy.invalidate)
         if cursor.rowcount == 0:
             return jsonify({'error': 'Room not found'}), 404
         return jsonify({'message': 'Room deleted successfully'})
@@ -1,158 +1,401 @@
 import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 import jwt
 import logging # <--- ADDED THIS LINE
 from flask import request, jsonify, g, current_app
 from database import get_db_connection
 
+
+class PrincipalCache:
+    """
+    In-process LRU cache of verified tokens, keyed by a SHA-256 digest of the raw token.
+
+    Each entry holds the decoded claims and the DB-backed principal and expires after
+    `ttl` seconds or at the token's `exp`, whichever comes first. Entries are indexed by
+    user id so that role/group changes can drop every cached token of that user; a
+    per-user generation counter stops a lookup that raced with such a change from
+    re-caching the stale row.
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # digest -> (expires_at, claims, user)
+        self._by_user = {}  # user_id -> set of digests
+        self._generations = {}  # user_id -> invalidation counter
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def get(self, digest):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, claims, user = entry
+            if expires_at <= now:
+                self._drop(digest)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._hits += 1
+            return claims, dict(user)
+
+    def generation(self, user_id):
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, digest, claims, user, generation):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if claims.get('exp'):
+            expires_at = min(expires_at, float(claims['exp']))
+        user_id = str(user['id'])
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (expires_at, claims, dict(user))
+            self._by_user.setdefault(user_id, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for digest in self._by_user.pop(user_id, set()):
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        user_id = str(entry[2]['id'])
+        digests = self._by_user.get(user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+principal_cache = PrincipalCache(
+    max_size=int(os.environ.get('AUTH_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('AUTH_CACHE_TTL', 60)),
+)
+
+
+def invalidate_user_principal(user_id):
+    """Drops cached principals of a user whose role, group or profile changed."""
+    principal_cache.invalidate_user(str(user_id))
+
+
+def _extract_token():
+    logging.debug(f"Incoming request headers: {request.headers}")
+    if 'authorization' in request.headers:
+        auth_header = request.headers['authorization']
+        if auth_header.startswith('Bearer '):
+            return auth_header.split(' ')[1]
+        logging.debug(f"Authorization header present but does not start with 'Bearer ': {auth_header}")
+    else:
+        logging.debug("Authorization header is missing from request.")
+    return None
+
+
+# Issuer stamped on tokens minted by /api/login, so they can be routed without trial decoding
+ADMIN_TOKEN_ISSUER = 'fiesc-exam-scheduler'
+
+ASYMMETRIC_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512')
+
+
+class VerifierStats:
+    """Per-verifier call counters and latency, exposed for monitoring."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, elapsed_ms, ok):
+        with self._lock:
+            entry = self._stats.setdefault(name, {'calls': 0, 'failures': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            entry['calls'] += 1
+            if not ok:
+                entry['failures'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    'calls': entry['calls'],
+                    'failures': entry['failures'],
+                    'avg_ms': round(entry['total_ms'] / entry['calls'], 3) if entry['calls'] else 0.0,
+                    'max_ms': round(entry['max_ms'], 3),
+                }
+                for name, entry in self._stats.items()
+            }
+
+
+verifier_stats = VerifierStats()
+
+
+class LocalJWKS:
+    """
+    Supabase asymmetric signing keys read from a local JWKS file (SUPABASE_JWKS_FILE).
+    The parsed key set is cached and only reloaded when the file's mtime changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._mtime = None
+        self._keys = {}
+
+    def get_key(self, kid):
+        path = os.environ.get('SUPABASE_JWKS_FILE')
+        if not path:
+            raise ValueError("SUPABASE_JWKS_FILE is not set in the environment.")
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            if path != self._path or mtime != self._mtime:
+                with open(path, 'r', encoding='utf-8') as f:
+                    key_set = jwt.PyJWKSet.from_json(f.read())
+                self._keys = {key.key_id: key for key in key_set.keys}
+                self._path = path
+                self._mtime = mtime
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key id: {kid}")
+        return key
+
+
+local_jwks = LocalJWKS()
+
+
+def _verify_admin(token, header):
+    return jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
+
+
+def _verify_supabase_hs256(token, header):
+    jwt_secret = os.environ.get('SUPABASE_JWT_SECRET')
+    if not jwt_secret:
+        raise ValueError("SUPABASE_JWT_SECRET is not set in the environment.")
+    return jwt.decode(token, jwt_secret, algorithms=['HS256'], audience='authenticated')
+
+
+def _verify_supabase_jwks(token, header):
+    key = local_jwks.get_key(header.get('kid'))
+    return jwt.decode(token, key.key, algorithms=[header['alg']], audience='authenticated')
+
+
+VERIFIERS = {
+    'admin': _verify_admin,
+    'supabase_hs256': _verify_supabase_hs256,
+    'supabase_jwks': _verify_supabase_jwks,
+}
+
+
+def _route_token(header, unverified):
+    """Picks exactly one verifier from the unverified header and claims."""
+    alg = header.get('alg')
+    if alg in ASYMMETRIC_ALGORITHMS and header.get('kid'):
+        return 'supabase_jwks'
+    if alg != 'HS256':
+        return None
+    if unverified.get('iss') == ADMIN_TOKEN_ISSUER:
+        return 'admin'
+    audience = unverified.get('aud')
+    audiences = audience if isinstance(audience, list) else [audience]
+    if 'authenticated' in audiences or str(unverified.get('iss', '')).endswith('/auth/v1'):
+        return 'supabase_hs256'
+    # Admin tokens issued before the issuer claim was added only carry user_id
+    if unverified.get('user_id') and not unverified.get('sub'):
+        return 'admin'
+    return 'supabase_hs256'
+
+
+def _decode_token(token):
+    """
+    Verifies the JWT and returns (claims, None) or (None, error_response).
+    claims holds the user_id, email, role and full_name carried by the token.
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+        unverified = jwt.decode(token, options={'verify_signature': False})
+    except jwt.PyJWTError:
+        return None, (jsonify({'message': 'Token is invalid!'}), 401)
+
+    verifier_name = _route_token(header, unverified)
+    if verifier_name is None:
+        return None, (jsonify({'message': 'Token is invalid!'}), 401)
+
+    started = time.perf_counter()
+    ok = False
+    try:
+        data = VERIFIERS[verifier_name](token, header)
+        ok = True
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'message': 'Token has expired!'}), 401)
+    except (jwt.InvalidTokenError, jwt.PyJWTError):
+        return None, (jsonify({'message': 'Token is invalid!'}), 401)
+    except (ValueError, OSError) as e:
+        print(f"JWT Validation error: {e}")
+        return None, (jsonify({'message': 'Server configuration error.'}), 500)
+    finally:
+        verifier_stats.record(verifier_name, (time.perf_counter() - started) * 1000, ok)
+
+    if verifier_name == 'admin':
+        return {
+            'user_id': data.get('user_id'),  # Admin token uses 'user_id'
+            'email': data.get('email'),
+            'role': data.get('role'),
+            'full_name': None,
+            'exp': data.get('exp'),
+        }, None
+
+    # Robustly extract user details from Supabase token
+    user_meta = data.get('user_metadata', {})
+    email = data.get('email')
+    full_name = user_meta.get('full_name') or user_meta.get('name')
+
+    # Provide a fallback for full_name if it's not in the token
+    if not full_name and email:
+        full_name = email.split('@')[0].replace('.', ' ').title()
+
+    return {
+        'user_id': data.get('sub'),
+        'email': email,
+        'role': user_meta.get('role'),
+        'full_name': full_name,
+        'exp': data.get('exp'),
+    }, None
+
+
+def _load_principal(claims):
+    """
+    Builds g.current_user from the database, which holds the most up-to-date role.
+    Returns (user, error_response, cacheable).
+    """
+    user_id = claims['user_id']
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT role, full_name, email, student_group, year_of_study FROM users WHERE id = %s", (user_id,))
+        db_user = cursor.fetchone()
+        logging.debug(f"token_required: Fetched db_user for user_id {user_id}: {db_user}")
+    except Exception as e:
+        print(f"[ERROR] Database error in token_required: {e}")
+        return None, (jsonify({'message': 'Server error during authentication'}), 500), False
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+    if db_user:
+        # Use the role from the database, which is the most up-to-date
+        db_role, full_name, db_email, student_group, year_of_study = db_user
+        print(f"[DEBUG] User {user_id} authenticated with role: {db_role} (token had: {claims['role']})")
+        return {
+            'id': user_id,
+            'role': db_role,  # Use role from database, not token
+            'email': claims['email'] or db_email,
+            'full_name': full_name,
+            'student_group': student_group,
+            'year_of_study': year_of_study
+        }, None, True
+
+    # Determine if this is a sync request where we want to create the user if missing
+    if request.path == '/api/auth/sync' and request.method == 'POST':
+        # Special case for sync endpoint - allow even if user not in DB
+        # We'll create the user in the sync endpoint, so this principal is never cached
+        print(f"[INFO] User {user_id} not found but allowing sync request")
+        return {
+            'id': user_id,
+            'role': claims['role'] or 'STUDENT',  # Default to STUDENT if no role
+            'email': claims['email'],
+            'full_name': claims['full_name']
+        }, None, False
+
+    print(f"[ERROR] User {user_id} not found in database")
+    return None, (jsonify({'message': 'User not found in database'}), 401), False
+
+
+def _authenticate():
+    token = _extract_token()
+    if not token:
+        return None, (jsonify({'message': 'Token is missing!'}), 401)
+
+    # Polling dashboards resend the same token: skip verification and the users lookup
+    digest = PrincipalCache.digest(token)
+    cached = principal_cache.get(digest)
+    if cached is not None:
+        return cached[1], None
+
+    claims, error = _decode_token(token)
+    if error:
+        return None, error
+
+    if not claims['user_id']:
+        return None, (jsonify({'message': 'Invalid token: missing user ID'}), 401)
+
+    generation = principal_cache.generation(str(claims['user_id']))
+    user, error, cacheable = _load_principal(claims)
+    if cacheable:
+        principal_cache.put(digest, claims, user, generation)
+    return user, error
+
+
+def authenticate():
+    """
+    Resolves the principal of the current request as (user, None) or (None, error_response).
+
+    The outcome is memoized on flask.g, so routes that stack token_required and the
+    role guards (or call handlers that are themselves decorated) verify the token and
+    query `users` only once per request.
+    """
+    result = g.get('_auth_result')
+    if result is None:
+        result = _authenticate()
+        g._auth_result = result
+    return result
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        logging.debug(f"Incoming request headers: {request.headers}")
-        if 'authorization' in request.headers:
-            auth_header = request.headers['authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-                #logging.debug(f"Extracted token: {token}")
-            else:
-                logging.debug(f"Authorization header present but does not start with 'Bearer ': {auth_header}")
-        else:
-            logging.debug("Authorization header is missing from request.")
-
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        user_id = None
-        email = None
-        token_role = None
-        
-        # Attempt 1: Decode with app's SECRET_KEY (for admin users)
-        try:
-            secret_key = current_app.config['SECRET_KEY']
-            data = jwt.decode(token, secret_key, algorithms=['HS256'])
-            user_id = data.get('user_id')  # Admin token uses 'user_id'
-            token_role = data.get('role')
-            email = data.get('email')
-            if user_id:
-                # Successfully decoded admin token
-                pass
-            else:
-                # If we don't have a user_id, this might not be an admin token
-                raise jwt.PyJWTError("Not an admin token")
-        except jwt.PyJWTError:
-            # If it fails, it might be a Supabase token. Pass to the next try block.
-            try:
-                jwt_secret = os.environ.get('SUPABASE_JWT_SECRET')
-                if not jwt_secret:
-                    raise ValueError("SUPABASE_JWT_SECRET is not set in the environment.")
-                
-                data = jwt.decode(token, jwt_secret, algorithms=['HS256'], audience='authenticated')
-
-                # Robustly extract user details from Supabase token
-                user_meta = data.get('user_metadata', {})
-                user_id = data.get('sub')
-                email = data.get('email')
-                token_role = user_meta.get('role')
-                full_name = user_meta.get('full_name') or user_meta.get('name')
-
-                # Provide a fallback for full_name if it's not in the token
-                if not full_name and email:
-                    full_name = email.split('@')[0].replace('.', ' ').title()
-                    
-            except jwt.ExpiredSignatureError:
-                return jsonify({'message': 'Token has expired!'}), 401
-            except (jwt.InvalidTokenError, jwt.PyJWTError):
-                return jsonify({'message': 'Token is invalid!'}), 401
-            except ValueError as e:
-                print(f"JWT Validation error: {e}")
-                return jsonify({'message': 'Server configuration error.'}), 500
-        
-        if not user_id:
-            return jsonify({'message': 'Invalid token: missing user ID'}), 401
-            
-        # Always fetch the current role from the database to ensure we have the most up-to-date role
-        try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT role, full_name, email, student_group, year_of_study FROM users WHERE id = %s", (user_id,))
-            db_user = cursor.fetchone()
-            logging.debug(f"token_required: Fetched db_user for user_id {user_id}: {db_user}")
-            if db_user:
-                # Determine if this is a sync request where we want to create the user if missing
-                is_sync_request = request.path == '/api/auth/sync' and request.method == 'POST'
-                
-                if db_user:
-                    # Use the role from the database, which is the most up-to-date
-                    db_role, full_name, db_email, student_group, year_of_study = db_user
-                    
-                    g.current_user = {
-                        'id': user_id,
-                        'role': db_role,  # Use role from database, not token
-                        'email': email or db_email,
-                        'full_name': full_name,
-                        'student_group': student_group,
-                        'year_of_study': year_of_study
-                    }
-                    
-                    # Log the role for debugging
-                    print(f"[DEBUG] User {user_id} authenticated with role: {db_role} (token had: {token_role})")
-                    
-                    return f(*args, **kwargs)
-                elif is_sync_request:
-                    # Special case for sync endpoint - allow even if user not in DB
-                    # We'll create the user in the sync endpoint
-                    print(f"[INFO] User {user_id} not found but allowing sync request")
-                    
-                    g.current_user = {
-                        'id': user_id,
-                        'role': token_role or 'STUDENT',  # Default to STUDENT if no role
-                        'email': email,
-                        'full_name': full_name
-                    }
-                    
-                    return f(*args, **kwargs)
-                else:
-                    # User not found in database
-                    print(f"[ERROR] User {user_id} not found in database")
-                    return jsonify({'message': 'User not found in database'}), 401
-                    
-                g.current_user = {
-                    'id': user_id,
-                    'role': db_role,  # Use role from database, not token
-                    'email': email or db_email,
-                    'full_name': full_name
-                }
-                
-                # Log the role for debugging
-                print(f"[DEBUG] User {user_id} authenticated with role: {db_role} (token had: {token_role})")
-                
-                return f(*args, **kwargs)
-            elif is_sync_request:
-                # Special case for sync endpoint - allow even if user not in DB
-                # We'll create the user in the sync endpoint
-                print(f"[INFO] User {user_id} not found but allowing sync request")
-                
-                g.current_user = {
-                    'id': user_id,
-                    'role': token_role or 'STUDENT',  # Default to STUDENT if no role
-                    'email': email,
-                    'full_name': full_name
-                }
-                
-                return f(*args, **kwargs)
-            else:
-                # User not found in database
-                print(f"[ERROR] User {user_id} not found in database")
-                return jsonify({'message': 'User not found in database'}), 401
-                
-        except Exception as e:
-            print(f"[ERROR] Database error in token_required: {e}")
-            return jsonify({'message': 'Server error during authentication'}), 500
-        finally:
-            if 'conn' in locals() and conn:
-                cursor.close()
-                conn.close()
+        user, error = authenticate()
+        if error:
+            return error
+        g.current_user = user
+        return f(*args, **kwargs)
 
     return decorated
 
@@ -4,7 +4,12 @@ These endpoints will be imported into the main app.py file.
 """
 
 from flask import jsonify, request, g
-from database import get_db_connection
+from datetime import datetime
+from database import get_db_connection, after_commit
+from conflicts import find_conflicts, load_index, exam_interval
+from occupancy import room_occupancy, DAY_START_HOUR
+from teacher_availability import teacher_availability, unavailable_teachers, parse_blocked, blocked_ranges, pack, exam_hours
+from class_timetable import class_timetable, class_conflicts
 from auth import token_required, cd_required
 # Import DB_AVAILABLE from app.py when this module is imported
 DB_AVAILABLE = None
@@ -100,13 +105,14 @@ def review_exam_proposal(exam_id):
         
         # Check if exam exists and teacher is assigned to it
         cursor.execute(
-            """SELECT status FROM exams 
+            """SELECT status, id, duration, main_teacher_id, second_teacher_id, student_group FROM exams 
             WHERE id = %s AND (main_teacher_id = %s OR second_teacher_id = %s)""",
             (exam_id, teacher_id, teacher_id)
         )
         exam = cursor.fetchone()
         if not exam:
             return jsonify({"error": "Exam not found or you are not assigned to this exam"}), 404
+        exam_dict = dict(zip([desc[0] for desc in cursor.description], exam))
             
         # Check if exam is in a state that can be reviewed
         status = exam[0]
@@ -132,6 +138,19 @@ def review_exam_proposal(exam_id):
             if not (8 <= int(alt_hour) <= 18):
                 return jsonify({"error": "Alternate hour must be between 8 and 18"}), 400
                 
+            # The group leader picks the room again later, but the teachers and the group
+            # must be free for the whole duration of the alternate slot
+            teacher_availability.refresh_if_stale(get_db_connection)
+            class_timetable.refresh_if_stale(get_db_connection)
+            conflicts = unavailable_teachers(exam_dict, alt_date, alt_hour)
+            conflicts += class_conflicts(exam_dict, alt_date, alt_hour)
+            conflicts += find_conflicts(cursor, exam_dict, alt_date, alt_hour)
+            if conflicts:
+                return jsonify({
+                    "error": "The alternate date and time conflict with other exams",
+                    "conflicts": conflicts
+                }), 409
+                
             # Update with alternate proposal
             cursor.execute(
                 """
@@ -142,6 +161,7 @@ def review_exam_proposal(exam_id):
                 (alt_date, alt_hour, exam_id)
             )
             conn.commit()
+            after_commit(lambda: room_occupancy.remove_booking(exam_id))
             
             return jsonify({
                 "message": "Alternate exam schedule proposed",
@@ -161,6 +181,8 @@ def review_exam_proposal(exam_id):
                 (new_status, exam_id)
             )
             conn.commit()
+            if new_status != 'ACCEPTED':
+                after_commit(lambda: room_occupancy.remove_booking(exam_id))
         
         return jsonify({
             "message": f"Exam {action.lower()}ed successfully",
@@ -231,3 +253,311 @@ def confirm_exam(exam_id):
         if conn:
             cursor.close()
             conn.close()
+
+# Most reviews one batch request may carry
+MAX_BATCH_REVIEWS = 200
+
+# Status each review action needs and the status it sets
+REVIEW_TRANSITIONS = {
+    'ACCEPT': ('PROPOSED', 'ACCEPTED'),
+    'REJECT': ('PROPOSED', 'REJECTED'),
+    'CANCEL': ('PROPOSED', 'CANCELLED'),
+    'ALTERNATE': ('PROPOSED', 'REJECTED'),
+    'CONFIRM': ('ACCEPTED', 'CONFIRMED'),
+}
+
+def _review_failure(exam_id, error, code, conflicts=None):
+    failure = {"exam_id": exam_id, "ok": False, "code": code, "error": error}
+    if conflicts:
+        failure["conflicts"] = conflicts
+    return failure
+
+@cd_required
+def review_exams():
+    """
+    Teacher reviews several exams at once: reviews is a list of {exam_id, action} with
+    the actions of review_exam_proposal (ACCEPT, REJECT, ALTERNATE with alternate_date
+    and alternate_hour, CANCEL) plus CONFIRM. Assignment and status are checked for the
+    whole list in one query and each action is applied with one UPDATE, in one
+    transaction; every review gets a result.
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    teacher_id = g.current_user.get('id')
+    data = request.get_json(silent=True) or {}
+    reviews = data.get('reviews')
+    if not isinstance(reviews, list) or not reviews:
+        return jsonify({"error": "reviews must be a non-empty list"}), 400
+    if len(reviews) > MAX_BATCH_REVIEWS:
+        return jsonify({"error": f"At most {MAX_BATCH_REVIEWS} reviews can be sent at once"}), 400
+        
+    results = [None] * len(reviews)
+    items, seen = [], set()
+    for position, review in enumerate(reviews):
+        review = review if isinstance(review, dict) else {}
+        exam_id, action = review.get('exam_id'), review.get('action')
+        if not isinstance(exam_id, int):
+            results[position] = _review_failure(exam_id, "exam_id must be an exam id", 400)
+            continue
+        if exam_id in seen:
+            results[position] = _review_failure(exam_id, "The exam is reviewed more than once in the batch", 400)
+            continue
+        seen.add(exam_id)
+        if action not in REVIEW_TRANSITIONS:
+            results[position] = _review_failure(exam_id, "Invalid action. Must be 'ACCEPT', 'REJECT', 'ALTERNATE', 'CANCEL' or 'CONFIRM'", 400)
+            continue
+        item = {'position': position, 'exam_id': exam_id, 'action': action}
+        if action == 'ALTERNATE':
+            try:
+                item['date'] = datetime.strptime(review.get('alternate_date'), '%Y-%m-%d').date()
+                item['hour'] = int(review.get('alternate_hour'))
+            except (TypeError, ValueError):
+                results[position] = _review_failure(exam_id, "Alternate date and hour are required for ALTERNATE action", 400)
+                continue
+            if not (8 <= item['hour'] <= 18):
+                results[position] = _review_failure(exam_id, "Alternate hour must be between 8 and 18", 400)
+                continue
+        items.append(item)
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """SELECT id, status, duration, main_teacher_id, second_teacher_id, student_group FROM exams
+            WHERE id = ANY(%s::int[]) AND (main_teacher_id = %s OR second_teacher_id = %s)""",
+            ([item['exam_id'] for item in items], teacher_id, teacher_id)
+        )
+        columns = [desc[0] for desc in cursor.description]
+        exams = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+        
+        valid = []
+        for item in items:
+            exam = exams.get(item['exam_id'])
+            if not exam:
+                results[item['position']] = _review_failure(item['exam_id'], "Exam not found or you are not assigned to this exam", 404)
+            elif exam['status'] != REVIEW_TRANSITIONS[item['action']][0]:
+                verb = 'confirm' if item['action'] == 'CONFIRM' else 'review'
+                results[item['position']] = _review_failure(item['exam_id'], f"Cannot {verb} exam in {exam['status']} status", 400)
+            else:
+                valid.append(dict(item, exam=exam))
+                
+        # Alternate slots must leave the teachers and the group free, also against the other
+        # alternates of the batch; exams the batch rejects or cancels no longer count
+        alternates = [item for item in valid if item['action'] == 'ALTERNATE']
+        if alternates:
+            teacher_availability.refresh_if_stale(get_db_connection)
+            class_timetable.refresh_if_stale(get_db_connection)
+            released = [item['exam_id'] for item in valid if REVIEW_TRANSITIONS[item['action']][1] in ('REJECTED', 'CANCELLED')]
+            index = load_index(cursor, [item['date'] for item in alternates], released)
+            for item in alternates:
+                exam = item['exam']
+                conflicts = unavailable_teachers(exam, item['date'], item['hour'])
+                conflicts += class_conflicts(exam, item['date'], item['hour'])
+                start, end = exam_interval(item['date'], item['hour'], exam['duration'])
+                conflicts += index.conflicts(
+                    start, end,
+                    teacher_ids=(exam['main_teacher_id'], exam['second_teacher_id']),
+                    student_group=exam['student_group'],
+                )
+                if conflicts:
+                    results[item['position']] = _review_failure(
+                        item['exam_id'], "The alternate date and time conflict with other exams", 409, conflicts)
+                    valid.remove(item)
+                else:
+                    index.add(dict(exam, start=start, end=end))
+                    
+        # One guarded UPDATE per action; an exam whose status or teachers changed since the
+        # check above is not updated and is reported as changed
+        updated = set()
+        for action, (from_status, to_status) in REVIEW_TRANSITIONS.items():
+            batch = [item for item in valid if item['action'] == action]
+            if not batch:
+                continue
+            if action == 'ALTERNATE':
+                cursor.execute(
+                    """
+                    UPDATE exams e
+                    SET status = %s, exam_date = a.exam_date, start_hour = a.start_hour, updated_at = CURRENT_TIMESTAMP
+                    FROM unnest(%s::int[], %s::date[], %s::int[]) AS a(id, exam_date, start_hour)
+                    WHERE e.id = a.id AND e.status = %s AND (e.main_teacher_id = %s OR e.second_teacher_id = %s)
+                    RETURNING e.id
+                    """,
+                    (to_status, [item['exam_id'] for item in batch], [item['date'] for item in batch],
+                     [item['hour'] for item in batch], from_status, teacher_id, teacher_id)
+                )
+            else:
+                cursor.execute(
+                    """
+                    UPDATE exams
+                    SET status = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s::int[]) AND status = %s AND (main_teacher_id = %s OR second_teacher_id = %s)
+                    RETURNING id
+                    """,
+                    (to_status, [item['exam_id'] for item in batch], from_status, teacher_id, teacher_id)
+                )
+            updated.update(row[0] for row in cursor.fetchall())
+        conn.commit()
+        
+        for item in valid:
+            exam_id = item['exam_id']
+            if exam_id not in updated:
+                results[item['position']] = _review_failure(exam_id, "The exam changed while the batch was checked", 409)
+                continue
+            new_status = REVIEW_TRANSITIONS[item['action']][1]
+            result = {"exam_id": exam_id, "ok": True, "action": item['action'], "new_status": new_status}
+            if item['action'] == 'ALTERNATE':
+                result.update(alternate_date=item['date'].isoformat(), alternate_hour=item['hour'])
+            if new_status in ('REJECTED', 'CANCELLED'):
+                after_commit(lambda exam_id=exam_id: room_occupancy.remove_booking(exam_id))
+            results[item['position']] = result
+            
+        return jsonify({
+            "reviewed": sum(1 for result in results if result['ok']),
+            "failed": sum(1 for result in results if not result['ok']),
+            "results": results
+        }), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error reviewing exams: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@cd_required
+def get_teacher_availability():
+    """Teacher gets the hours they blocked in an exam period (?period_id=, defaulting to the active one)"""
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    teacher_id = g.current_user.get('id')
+    period_id = request.args.get('period_id')
+    
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        if period_id:
+            cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+        else:
+            cursor.execute(
+                "SELECT id, name, start_date, end_date FROM exam_periods WHERE is_active ORDER BY start_date DESC LIMIT 1"
+            )
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found" if period_id else "No active exam period"}), 404
+            
+        teacher_availability.refresh_if_stale(get_db_connection)
+        entry = teacher_availability.get(teacher_id, period[0])
+        return jsonify({
+            "period": {"id": period[0], "name": period[1],
+                       "start_date": period[2].isoformat(), "end_date": period[3].isoformat()},
+            "blocked": blocked_ranges(entry[0], entry[2]) if entry else []
+        }), 200
+    except Exception as e:
+        print(f"Error fetching teacher availability: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@cd_required
+def import_teacher_availability():
+    """
+    Teacher replaces the hours they cannot supervise in an exam period with `blocked`, a
+    list of {date, start_hour?, end_hour?} items (a whole day when the hours are left out)
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    teacher_id = g.current_user.get('id')
+    data = request.get_json(silent=True) or {}
+    period_id = data.get('period_id')
+    blocked = data.get('blocked')
+    if not period_id:
+        return jsonify({"error": "period_id is required"}), 400
+    if not isinstance(blocked, list):
+        return jsonify({"error": "blocked must be a list of {date, start_hour, end_hour} items"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found"}), 404
+        start_date, end_date = period
+        try:
+            hours = parse_blocked(blocked, start_date, end_date)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+            
+        days = len(hours)
+        bits = pack(hours) if hours.any() else None
+        if bits is None:
+            cursor.execute(
+                "DELETE FROM teacher_availability WHERE teacher_id = %s AND period_id = %s",
+                (teacher_id, period_id)
+            )
+        else:
+            cursor.execute(
+                """
+                INSERT INTO teacher_availability (teacher_id, period_id, start_date, days, blocked)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (teacher_id, period_id) DO UPDATE
+                SET start_date = EXCLUDED.start_date, days = EXCLUDED.days, blocked = EXCLUDED.blocked,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (teacher_id, period_id, start_date, days, bits)
+            )
+            
+        # Exams already booked in the blocked hours are reported, not cancelled
+        cursor.execute(
+            """
+            SELECT e.id, d.name, e.student_group, e.exam_day, e.start_hour, COALESCE(e.duration, 120), e.status
+            FROM exams e
+            LEFT JOIN disciplines d ON e.discipline_id = d.id
+            WHERE (e.main_teacher_id = %s OR e.second_teacher_id = %s)
+            AND e.exam_day BETWEEN %s AND %s AND e.start_hour IS NOT NULL
+            AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            ORDER BY e.exam_day, e.start_hour
+            """,
+            (teacher_id, teacher_id, start_date, end_date)
+        )
+        affected = []
+        for exam_id, name, group, exam_day, hour, duration, status in cursor.fetchall():
+            touched = [h - DAY_START_HOUR for h in exam_hours(hour, duration)]
+            if hours[(exam_day - start_date).days, touched].any():
+                affected.append({
+                    "exam_id": exam_id, "discipline_name": name, "student_group": group,
+                    "date": exam_day.isoformat(), "start_hour": hour, "status": status
+                })
+        conn.commit()
+        entry = (teacher_id, int(period_id), start_date, days, bits)
+        after_commit(lambda: teacher_availability.set_blocked(*entry))
+        
+        return jsonify({
+            "message": "Availability saved",
+            "blocked_hours": int(hours.sum()),
+            "bytes": len(bits or b''),
+            "blocked": blocked_ranges(start_date, hours),
+            "affected_exams": affected
+        }), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error importing teacher availability: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
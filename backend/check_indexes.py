@@ -0,0 +1,188 @@
+"""
+EXPLAIN-based check that the role listings use the indexes created by the schema migrations.
+
+Seeds a synthetic workload (100k exams by default) inside a transaction, runs
+EXPLAIN on the hot queries of every role and verifies that the planner picks the
+expected index. Everything is rolled back at the end, so it is safe to run
+against a development database:
+
+    python check_indexes.py [--exams 100000]
+"""
+
+import argparse
+import json
+import sys
+from database import get_db_connection
+
+GROUPS = 200
+TEACHERS = 400
+ROOMS = 60
+
+# Placeholders resolved to ids of seeded rows
+SEEDED_ROOM = '<seeded room>'
+SEEDED_DISCIPLINE = '<seeded discipline>'
+
+# (description, query, params, indexes of which at least one must appear in the plan)
+CHECKS = [
+    (
+        "SG/student listing by student_group",
+        """SELECT e.id, e.status, e.exam_date, e.start_hour FROM exams e
+           WHERE e.student_group = %s ORDER BY e.status, e.exam_date, e.start_hour""",
+        ('G17',),
+        ['idx_exams_student_group'],
+    ),
+    (
+        "CD listing by main or second teacher",
+        """SELECT e.id, e.status, e.exam_date, e.start_hour FROM exams e
+           WHERE e.main_teacher_id = %s OR e.second_teacher_id = %s
+           ORDER BY e.status, e.exam_date, e.start_hour""",
+        ('idxchk-t-42', 'idxchk-t-42'),
+        ['idx_exams_main_teacher', 'idx_exams_second_teacher'],
+    ),
+    (
+        "SEC confirmed listing/export",
+        """SELECT e.id, e.exam_date, e.start_hour FROM exams e
+           WHERE e.status = 'CONFIRMED' ORDER BY e.exam_date, e.start_hour""",
+        (),
+        ['idx_exams_status_slot'],
+    ),
+    (
+        "Room booking overlap for one room",
+        """SELECT 1 FROM exams
+           WHERE int4range(room_id, room_id, '[]') && int4range(%s, %s, '[]')
+           AND booked_during && tsrange('2025-06-16 10:00', '2025-06-16 12:00', '[)')
+           AND room_id IS NOT NULL AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')""",
+        (SEEDED_ROOM, SEEDED_ROOM),
+        ['exams_room_booking_excl'],
+    ),
+    (
+        "Rooms booked on a day (available rooms)",
+        """SELECT DISTINCT room_id FROM exams
+           WHERE exam_day = %s::date
+           AND booked_during && tsrange('2025-06-16 10:00', '2025-06-16 12:00', '[)')
+           AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')""",
+        ('2025-06-16',),
+        ['idx_exams_active_day_slot'],
+    ),
+    (
+        "Exam lookup by discipline and group",
+        "SELECT id FROM exams WHERE discipline_id = %s AND student_group = %s",
+        (SEEDED_DISCIPLINE, 'G17'),
+        ['exams_discipline_group_key'],
+    ),
+    (
+        "Teacher picker by role",
+        "SELECT id, full_name FROM users WHERE role = 'CADRU_DIDACTIC' ORDER BY full_name",
+        (),
+        ['idx_users_role'],
+    ),
+    (
+        "Group leader lookup",
+        "SELECT id FROM users WHERE student_group = %s AND role = 'SEF_GRUPA'",
+        ('G17',),
+        ['idx_users_student_group_role'],
+    ),
+    (
+        "Disciplines of a teacher",
+        "SELECT discipline_id FROM discipline_teachers WHERE teacher_id = %s",
+        ('idxchk-t-42',),
+        ['idx_discipline_teachers_teacher'],
+    ),
+]
+
+
+def seed(cursor, exam_count):
+    disciplines = -(-exam_count // GROUPS)
+    cursor.execute(
+        """INSERT INTO users (id, full_name, email, role)
+           SELECT 'idxchk-t-' || i, 'Teacher ' || i, 'idxchk-t-' || i || '@usv.ro', 'CADRU_DIDACTIC'
+           FROM generate_series(1, %s) AS i""",
+        (TEACHERS,)
+    )
+    cursor.execute(
+        """INSERT INTO users (id, full_name, email, role, student_group)
+           SELECT 'idxchk-s-' || i, 'Student ' || i, 'idxchk-s-' || i || '@student.usv.ro',
+                  CASE WHEN i %% 25 = 0 THEN 'SEF_GRUPA' ELSE 'STUDENT' END, 'G' || (i %% %s)
+           FROM generate_series(1, %s) AS i""",
+        (GROUPS, GROUPS * 25)
+    )
+    cursor.execute(
+        """INSERT INTO rooms (name, capacity)
+           SELECT 'IDXCHK ' || i, 30 + i FROM generate_series(1, %s) AS i RETURNING id""",
+        (ROOMS,)
+    )
+    room_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        """INSERT INTO disciplines (name)
+           SELECT 'IDXCHK discipline ' || i FROM generate_series(1, %s) AS i RETURNING id""",
+        (disciplines,)
+    )
+    discipline_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        """INSERT INTO discipline_teachers (discipline_id, teacher_id)
+           SELECT d, 'idxchk-t-' || (1 + (d %% %s)) FROM unnest(%s::int[]) AS d""",
+        (TEACHERS, discipline_ids)
+    )
+    cursor.execute(
+        """INSERT INTO exams (discipline_id, exam_type, student_group, main_teacher_id, second_teacher_id,
+                              status, exam_date, start_hour, room_id)
+           SELECT d.ids[1 + (i / %s)], 'EXAM', 'G' || (i %% %s),
+                  'idxchk-t-' || (1 + (i * 7) %% %s), 'idxchk-t-' || (1 + (i * 13) %% %s),
+                  (ARRAY['DRAFT', 'PROPOSED', 'ACCEPTED', 'REJECTED', 'CANCELLED', 'RESCHEDULED', 'CONFIRMED'])[1 + i %% 7],
+                  DATE '2025-06-02' + (i %% 60), 8 + 2 * ((i / 60) %% 6),
+                  -- Distinct (room, day, slot) for every booked exam, as the exclusion constraint demands
+                  CASE WHEN i < 360 * %s THEN r.ids[1 + (i / 360)] END
+           FROM generate_series(0, %s - 1) AS i,
+                (SELECT %s::int[] AS ids) AS d,
+                (SELECT %s::int[] AS ids) AS r""",
+        (GROUPS, GROUPS, TEACHERS, TEACHERS, len(room_ids), exam_count, discipline_ids, room_ids)
+    )
+    for table in ('users', 'rooms', 'disciplines', 'discipline_teachers', 'exams'):
+        cursor.execute(f"ANALYZE {table}")
+    return discipline_ids, room_ids
+
+
+def plan_indexes(node):
+    found = set()
+    if 'Index Name' in node:
+        found.add(node['Index Name'])
+    for child in node.get('Plans', []):
+        found |= plan_indexes(child)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--exams', type=int, default=100000, help='number of synthetic exams to seed')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    failures = 0
+    try:
+        print(f"Seeding {args.exams} exams...")
+        discipline_ids, room_ids = seed(cursor, args.exams)
+        seeded = {SEEDED_ROOM: room_ids[7], SEEDED_DISCIPLINE: discipline_ids[12]}
+        for description, query, params, expected in CHECKS:
+            params = tuple(seeded.get(p, p) for p in params)
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            used = plan_indexes(plan[0]['Plan'])
+            ok = any(index in used for index in expected)
+            failures += 0 if ok else 1
+            print(f"[{'OK' if ok else 'FAIL'}] {description}: uses {sorted(used) or 'no index'}")
+    finally:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+
+    if failures:
+        print(f"{failures} check(s) did not use the expected index.")
+        sys.exit(1)
+    print("All role listings use their indexes.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Weekly class timetable imported from orar.usv.ro.
+
+init_db only keeps discipline and teacher names from orarSPG.php; this module keeps
+every class with its weekday, start, duration, week parity, room, teacher and group, so
+exams are not scheduled over ongoing classes. The source is either the HTTP API
+(CLASS_TIMETABLE_URL, orar.usv.ro or a local stand-in serving the same paths) or a
+local JSON snapshot written by the `fetch` command:
+
+    python class_timetable.py fetch --out timetable.json
+    python class_timetable.py import timetable.json --valid-from 2026-02-23 --valid-to 2026-06-07
+
+A snapshot is {"source", "fetched_at", "groups": [{"id", "name"}], "classes": [...]}
+with the classes already normalised by parse_entries(). The import replaces the
+class_timetable table in one transaction; classes count between valid_from and
+valid_to (the teaching weeks), or always when those are left out.
+
+Rooms are booked by classes in the room occupancy index (occupancy.py). ClassTimetable
+is the matching in-memory index for the conflict checks: the classes of every room,
+teacher and group, by weekday, so a lookup only scans the few classes of one resource
+on one day.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import requests
+from occupancy import minute_slot_range, class_parities, SLOTS_PER_DAY, DEFAULT_DURATION
+
+DEFAULT_URL = "https://orar.usv.ro/orar/vizualizare/data"
+REQUEST_TIMEOUT = 30
+
+
+# --- Parsing ---
+
+def _int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def group_name(group):
+    """The student_group value of an orar group: its name, or specialization + year + group."""
+    if group.get('name'):
+        return str(group['name']).strip()
+    parts = [group.get('specializationShortName'), group.get('studyYear'), group.get('groupName'), group.get('subgroupIndex')]
+    return ''.join(str(part).strip() for part in parts if part not in (None, ''))
+
+
+def parse_entries(response, student_group):
+    """
+    Normalises the orarSPG.php entries of one group. weekDay is 1 (Monday) to 7,
+    startHour and duration are minutes (or hours, for values up to 24 and 12), and parity
+    is 0 (every week), 1 (odd weeks) or 2 (even weeks). Entries without a usable weekday
+    or start are skipped.
+    """
+    if isinstance(response, list) and response and isinstance(response[0], list):
+        response = response[0]
+    classes = []
+    for entry in response if isinstance(response, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        weekday = _int(entry.get('weekDay'))
+        start = _int(entry.get('startHour'))
+        if weekday is None or not 1 <= weekday <= 7 or start is None:
+            continue
+        duration = _int(entry.get('duration'), DEFAULT_DURATION)
+        teacher = f"{(entry.get('teacherLastName') or '').strip()} {(entry.get('teacherFirstName') or '').strip()}".strip()
+        classes.append({
+            'weekday': weekday - 1,
+            'start_minute': start * 60 if start <= 24 else start,
+            'duration': duration * 60 if duration <= 12 else duration,
+            'parity': _int(entry.get('parity'), 0) if _int(entry.get('parity'), 0) in (0, 1, 2) else 0,
+            'room_name': (entry.get('roomShortName') or entry.get('roomLongName') or '').strip() or None,
+            'teacher_name': teacher or None,
+            'student_group': student_group,
+            'discipline_name': (entry.get('topicLongName') or '').strip() or None,
+            'class_type': (entry.get('typeShortName') or '').strip() or None,
+        })
+    return classes
+
+
+def fetch_snapshot(base_url=None, faculty=None):
+    """Reads the groups and the timetable of every group from the HTTP source."""
+    base_url = (base_url or os.environ.get('CLASS_TIMETABLE_URL') or DEFAULT_URL).rstrip('/')
+    response = requests.get(f"{base_url}/grupe.php?json", timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    groups = [group for group in response.json()
+              if isinstance(group, dict) and (not faculty or group.get('facultyName') == faculty)]
+
+    snapshot = {'source': base_url, 'fetched_at': datetime.utcnow().isoformat(), 'groups': [], 'classes': []}
+    for group in groups:
+        name = group_name(group)
+        if group.get('id') is None or not name:
+            continue
+        response = requests.get(
+            f"{base_url}/orarSPG.php", params={'ID': group['id'], 'mod': 'grupa', 'json': ''}, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        snapshot['groups'].append({'id': group['id'], 'name': name})
+        snapshot['classes'].extend(parse_entries(response.json(), name))
+    return snapshot
+
+
+def load_snapshot(path):
+    with open(path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or not isinstance(snapshot.get('classes'), list):
+        raise ValueError(f"{path} is not a class timetable snapshot")
+    return snapshot
+
+
+# --- Database ---
+
+def import_classes(cursor, classes, valid_from=None, valid_to=None):
+    """
+    Replaces the class_timetable table with `classes` (dicts as returned by
+    parse_entries), matching rooms by name or short name and teachers by full name.
+    Returns the number of classes and the room and teacher names that did not match;
+    the caller commits.
+    """
+    fields = ['weekday', 'start_minute', 'duration', 'parity', 'room_name', 'teacher_name',
+              'student_group', 'discipline_name', 'class_type']
+    classes = [c for c in classes if isinstance(c, dict) and all(c.get(k) is not None for k in fields[:4])]
+    cursor.execute("DELETE FROM class_timetable")
+    if classes:
+        cursor.execute(
+            """
+            INSERT INTO class_timetable (weekday, start_minute, duration, parity, room_id, room_name, teacher_id,
+                                         teacher_name, student_group, discipline_name, class_type, valid_from, valid_to)
+            SELECT c.weekday, c.start_minute, c.duration, c.parity,
+                   (SELECT r.id FROM rooms r WHERE c.room_name IN (r.name, r.short_name) ORDER BY r.id LIMIT 1),
+                   c.room_name,
+                   (SELECT u.id FROM users u WHERE u.full_name = c.teacher_name AND u.role = 'CADRU_DIDACTIC'
+                    ORDER BY u.id LIMIT 1),
+                   c.teacher_name, c.student_group, c.discipline_name, c.class_type, %s, %s
+            FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+                 AS c(weekday, start_minute, duration, parity, room_name, teacher_name, student_group,
+                      discipline_name, class_type)
+            """,
+            [valid_from, valid_to] + [[c.get(k) for c in classes] for k in fields]
+        )
+    cursor.execute(
+        """
+        SELECT COUNT(*),
+               ARRAY(SELECT DISTINCT room_name FROM class_timetable WHERE room_id IS NULL AND room_name IS NOT NULL ORDER BY 1),
+               ARRAY(SELECT DISTINCT teacher_name FROM class_timetable WHERE teacher_id IS NULL AND teacher_name IS NOT NULL ORDER BY 1)
+        FROM class_timetable
+        """
+    )
+    count, rooms, teachers = cursor.fetchone()
+    return {'classes': count, 'unknown_rooms': rooms, 'unknown_teachers': teachers}
+
+
+# --- In-memory index ---
+
+class ClassTimetable:
+    """Thread-safe {(kind, resource): [classes of each weekday]} for rooms, teachers and groups."""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._index = {}
+        self._window = (None, None)
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, cursor):
+        cursor.execute(
+            """SELECT weekday, start_minute, duration, parity, room_id, room_name, teacher_id,
+                      student_group, discipline_name, class_type, valid_from, valid_to
+            FROM class_timetable"""
+        )
+        columns = [desc[0] for desc in cursor.description]
+        index, window = {}, (None, None)
+        for row in cursor.fetchall():
+            entry = dict(zip(columns, row))
+            window = (entry.pop('valid_from'), entry.pop('valid_to'))
+            entry['slots'] = minute_slot_range(entry['start_minute'], entry['duration'])
+            for key in (('room', entry['room_id']), ('teacher', entry['teacher_id']), ('group', entry['student_group'])):
+                if key[1] is not None:
+                    index.setdefault(key, [[] for _ in range(7)])[entry['weekday']].append(entry)
+        with self._lock:
+            self._index, self._window = index, window
+            self._loaded_at = time.monotonic()
+
+    def refresh_if_stale(self, connection_factory):
+        if self.is_fresh():
+            return
+        conn = connection_factory()
+        cursor = conn.cursor()
+        try:
+            self.load(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def classes_on(self, kind, resource, day):
+        """The classes of a room, teacher or group held on `day`."""
+        with self._lock:
+            weekdays = self._index.get((kind, resource))
+            window = self._window
+        parities = class_parities(day, *window)
+        if weekdays is None or not parities:
+            return []
+        return [entry for entry in weekdays[day.weekday()] if entry['parity'] in parities]
+
+    def busy_slots(self, teacher_ids, student_group, days):
+        """bool[len(days), slots]: the slots in which any of the teachers or the group has a class."""
+        busy = np.zeros((len(days), SLOTS_PER_DAY), dtype=bool)
+        keys = [('teacher', teacher_id) for teacher_id in teacher_ids] + [('group', student_group)]
+        for d, day in enumerate(days):
+            for kind, resource in keys:
+                for entry in self.classes_on(kind, resource, day):
+                    busy[d, entry['slots'][0]:entry['slots'][1]] = True
+        return busy
+
+
+def class_conflicts(exam, exam_date, start_hour, room_ids=()):
+    """
+    Returns one conflict entry (type 'class') per regular class held in one of `room_ids`,
+    by a teacher of `exam` or by its group during the exam at `exam_date`/`start_hour`.
+    """
+    day = exam_date if isinstance(exam_date, date) and not isinstance(exam_date, datetime) \
+        else datetime.strptime(str(exam_date)[:10], '%Y-%m-%d').date()
+    start = int(start_hour) * 60
+    end = start + (exam.get('duration') or DEFAULT_DURATION)
+    checks = [('room', room_id) for room_id in room_ids if room_id is not None]
+    checks += [('teacher', teacher_id) for teacher_id in
+               dict.fromkeys([exam.get('main_teacher_id'), exam.get('second_teacher_id')]) if teacher_id]
+    checks.append(('group', exam.get('student_group')))
+
+    found = []
+    midnight = datetime.combine(day, datetime.min.time())
+    for kind, resource in checks:
+        for entry in class_timetable.classes_on(kind, resource, day):
+            if entry['start_minute'] < end and start < entry['start_minute'] + entry['duration']:
+                found.append({
+                    'type': 'class',
+                    'resource_type': kind,
+                    'resource': resource,
+                    'discipline_name': entry['discipline_name'],
+                    'class_type': entry['class_type'],
+                    'student_group': entry['student_group'],
+                    'room_name': entry['room_name'],
+                    'start': (midnight + timedelta(minutes=entry['start_minute'])).isoformat(),
+                    'end': (midnight + timedelta(minutes=entry['start_minute'] + entry['duration'])).isoformat(),
+                })
+    return found
+
+
+class_timetable = ClassTimetable(ttl=float(os.environ.get('CLASS_TIMETABLE_TTL', 300)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Imports the weekly class timetable from orar.usv.ro.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    fetch = commands.add_parser('fetch', help="Download the timetable of every group into a JSON snapshot")
+    fetch.add_argument('--url', help=f"Base URL of the timetable API (CLASS_TIMETABLE_URL, default {DEFAULT_URL})")
+    fetch.add_argument('--faculty', help="Only groups whose facultyName matches")
+    fetch.add_argument('--out', required=True, help="Snapshot file to write")
+    load = commands.add_parser('import', help="Replace the class_timetable table")
+    load.add_argument('snapshot', nargs='?', help="Snapshot file; the HTTP source is read when omitted")
+    load.add_argument('--url', help="Base URL of the timetable API, when no snapshot is given")
+    load.add_argument('--faculty', help="Only groups whose facultyName matches, when no snapshot is given")
+    load.add_argument('--valid-from', type=date.fromisoformat, help="First day of the teaching weeks (counts week parity)")
+    load.add_argument('--valid-to', type=date.fromisoformat, help="Last day of the teaching weeks")
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        snapshot = fetch_snapshot(args.url, args.faculty)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        print(f"Wrote {len(snapshot['classes'])} classes of {len(snapshot['groups'])} groups to {args.out}")
+        return
+
+    snapshot = load_snapshot(args.snapshot) if args.snapshot else fetch_snapshot(args.url, args.faculty)
+    from database import get_db_connection
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        report = import_classes(cursor, snapshot['classes'], args.valid_from, args.valid_to)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+    print(f"Imported {report['classes']} classes")
+    for kind in ('unknown_rooms', 'unknown_teachers'):
+        if report[kind]:
+            print(f"{kind.replace('_', ' ').capitalize()} ({len(report[kind])}): {', '.join(report[kind])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Duration-aware conflict detection for exam bookings.
+
+Every active exam (PROPOSED, ACCEPTED or CONFIRMED) occupies the half-open interval
+[start, start + duration). ConflictIndex keeps one sorted IntervalIndex per room,
+per teacher and per student group, so checking a candidate slot is a binary search
+per resource and all conflicting exams are reported in one pass.
+"""
+
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+from datetime import datetime, time, timedelta
+from class_timetable import class_conflicts
+
+DEFAULT_DURATION = 120
+
+
+def exam_interval(exam_date, start_hour, duration=None):
+    """Returns the (start, end) datetimes occupied by an exam."""
+    if isinstance(exam_date, str):
+        exam_date = datetime.strptime(exam_date[:10], '%Y-%m-%d').date()
+    elif isinstance(exam_date, datetime):
+        exam_date = exam_date.date()
+    start = datetime.combine(exam_date, time(int(start_hour)))
+    return start, start + timedelta(minutes=duration or DEFAULT_DURATION)
+
+
+class IntervalIndex:
+    """
+    Half-open intervals sorted by start.
+
+    Because no stored interval is longer than `max_length`, only intervals starting in
+    (start - max_length, end) can overlap [start, end); both bounds are found by bisection.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._entries = []  # (start, end, key), parallel to _starts
+        self.max_length = timedelta(0)
+
+    def add(self, start, end, key):
+        entry = (start, end, key)
+        position = bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._entries.insert(position, entry)
+        self.max_length = max(self.max_length, end - start)
+
+    def overlapping(self, start, end):
+        """Yields the (start, end, key) entries overlapping [start, end)."""
+        lo = bisect_right(self._starts, start - self.max_length)
+        hi = bisect_left(self._starts, end)
+        for entry in self._entries[lo:hi]:
+            if entry[1] > start:
+                yield entry
+
+    def overlapping_pairs(self):
+        """Yields every pair of overlapping entries, sweeping them in start order."""
+        active = []  # min-heap of (end, position) of the entries still in progress
+        for position, entry in enumerate(self._entries):
+            while active and active[0][0] <= entry[0]:
+                heappop(active)
+            for _, other in active:
+                yield self._entries[other], entry
+            heappush(active, (entry[1], position))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ConflictIndex:
+    """Active bookings indexed by room, teacher and student group."""
+
+    def __init__(self, bookings=()):
+        self.rooms = {}
+        self.teachers = {}
+        self.groups = {}
+        self.exams = {}
+        for booking in bookings:
+            self.add(booking)
+
+    def add(self, booking):
+        """
+        Adds a booking dict with the keys id, room_id (or room_ids, for exams spanning several
+        rooms), main_teacher_id, second_teacher_id, student_group, start and end (plus any
+        descriptive fields to echo in reports).
+        """
+        self.exams[booking['id']] = booking
+        start, end, exam_id = booking['start'], booking['end'], booking['id']
+        room_ids = booking.get('room_ids') or [booking.get('room_id')]
+        for room_id in set(room_ids) - {None}:
+            self.rooms.setdefault(room_id, IntervalIndex()).add(start, end, exam_id)
+        for teacher_id in {booking.get('main_teacher_id'), booking.get('second_teacher_id')} - {None}:
+            self.teachers.setdefault(teacher_id, IntervalIndex()).add(start, end, exam_id)
+        if booking.get('student_group'):
+            self.groups.setdefault(booking['student_group'], IntervalIndex()).add(start, end, exam_id)
+
+    def conflicts(self, start, end, room_id=None, teacher_ids=(), student_group=None, exclude_exam_id=None, room_ids=()):
+        """Returns every booking overlapping [start, end) that shares a room, a teacher or the group."""
+        checks = [('room', rid, self.rooms.get(rid)) for rid in dict.fromkeys([room_id, *room_ids]) if rid is not None]
+        checks += [('teacher', teacher_id, self.teachers.get(teacher_id)) for teacher_id in teacher_ids if teacher_id]
+        checks.append(('group', student_group, self.groups.get(student_group)))
+
+        found = []
+        for kind, resource, index in checks:
+            if resource is None or index is None:
+                continue
+            for _, _, exam_id in index.overlapping(start, end):
+                if exam_id == exclude_exam_id:
+                    continue
+                found.append(self._report(kind, resource, self.exams[exam_id]))
+        return found
+
+    def all_conflicts(self):
+        """Returns every pair of bookings that overlap on the same room, teacher or group."""
+        found = []
+        for kind, table in (('room', self.rooms), ('teacher', self.teachers), ('group', self.groups)):
+            for resource, index in table.items():
+                for first, second in index.overlapping_pairs():
+                    found.append({
+                        'type': kind,
+                        'resource': resource,
+                        'exam_ids': sorted([first[2], second[2]]),
+                        'start': max(first[0], second[0]).isoformat(),
+                        'end': min(first[1], second[1]).isoformat(),
+                    })
+        return found
+
+    @staticmethod
+    def _report(kind, resource, booking):
+        return {
+            'type': kind,
+            'resource': resource,
+            'exam_id': booking['id'],
+            'discipline_name': booking.get('discipline_name'),
+            'student_group': booking.get('student_group'),
+            'start': booking['start'].isoformat(),
+            'end': booking['end'].isoformat(),
+        }
+
+
+def load_day_index(cursor, exam_day, exclude_exam_id=None):
+    """Builds a ConflictIndex from the active bookings of one day (uses idx_exams_active_day_slot)."""
+    return load_index(cursor, [exam_day], [exclude_exam_id] if exclude_exam_id else ())
+
+
+def load_index(cursor, exam_days, exclude_exam_ids=()):
+    """Builds a ConflictIndex from the active bookings of several days, in one query."""
+    cursor.execute(
+        """
+        SELECT e.id, e.room_id, e.main_teacher_id, e.second_teacher_id, e.student_group,
+               e.exam_day, e.start_hour, e.duration, d.name AS discipline_name,
+               ARRAY(SELECT er.room_id FROM exam_rooms er WHERE er.exam_id = e.id) AS room_ids
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE e.exam_day = ANY(%s::date[])
+        AND e.start_hour IS NOT NULL
+        AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+        AND NOT e.id = ANY(%s::int[])
+        """,
+        (sorted({str(day)[:10] for day in exam_days}), list(exclude_exam_ids))
+    )
+    columns = [desc[0] for desc in cursor.description]
+    index = ConflictIndex()
+    for row in cursor.fetchall():
+        booking = dict(zip(columns, row))
+        booking['start'], booking['end'] = exam_interval(booking['exam_day'], booking['start_hour'], booking['duration'])
+        index.add(booking)
+    return index
+
+
+def find_conflicts(cursor, exam, exam_date, start_hour, room_id=None):
+    """
+    Returns the conflicts of placing `exam` (a dict with id, duration, main_teacher_id,
+    second_teacher_id and student_group) at `exam_date`/`start_hour`, optionally in `room_id`
+    (one room id or a list of them).
+    """
+    start, end = exam_interval(exam_date, start_hour, exam.get('duration'))
+    index = load_day_index(cursor, start.date(), exclude_exam_id=exam['id'])
+    room_ids = room_id if isinstance(room_id, (list, tuple)) else [room_id]
+    return index.conflicts(
+        start, end,
+        room_ids=[int(rid) for rid in room_ids if rid is not None],
+        teacher_ids=(exam.get('main_teacher_id'), exam.get('second_teacher_id')),
+        student_group=exam.get('student_group'),
+    )
+
+
+def load_group_sizes(cursor):
+    """Returns {student_group: number of students} for the groups that have students."""
+    cursor.execute(
+        """SELECT student_group, COUNT(*) FROM users
+        WHERE role IN ('STUDENT', 'SEF_GRUPA') AND student_group IS NOT NULL
+        GROUP BY student_group"""
+    )
+    return dict(cursor.fetchall())
+
+
+def schedule_report(cursor):
+    """
+    Checks every active exam in one pass and returns (exams, problems).
+
+    `exams` maps exam id to its booking; each problem is a dict with type, resource,
+    exam_ids and detail. The types are room/teacher/group overlaps (one sweep per
+    resource over the ConflictIndex), same_day (a group with several exams on one
+    day), capacity (room smaller than the group), class (a room, teacher or the group
+    has a regular class at the time; the class_timetable cache must be fresh) and
+    outside_period (no active exam period covers the exam day; only checked when an
+    active period exists).
+    """
+    cursor.execute(
+        """
+        SELECT e.id, e.room_id, e.main_teacher_id, e.second_teacher_id, e.student_group,
+               e.exam_day, e.start_hour, e.duration, e.status, d.name AS discipline_name,
+               ARRAY(SELECT er.room_id FROM exam_rooms er WHERE er.exam_id = e.id) AS room_ids,
+               (SELECT SUM(r2.capacity) FROM exam_rooms er JOIN rooms r2 ON er.room_id = r2.id
+                WHERE er.exam_id = e.id) AS total_capacity,
+               r.name AS room_name, r.capacity,
+               EXISTS (SELECT 1 FROM exam_periods p
+                       WHERE p.is_active AND e.exam_day BETWEEN p.start_date AND p.end_date) AS in_active_period
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        LEFT JOIN rooms r ON e.room_id = r.id
+        WHERE e.exam_day IS NOT NULL AND e.start_hour IS NOT NULL
+        AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+        ORDER BY e.exam_day, e.start_hour, e.id
+        """
+    )
+    columns = [desc[0] for desc in cursor.description]
+    index = ConflictIndex()
+    for row in cursor.fetchall():
+        booking = dict(zip(columns, row))
+        booking['start'], booking['end'] = exam_interval(booking['exam_day'], booking['start_hour'], booking['duration'])
+        index.add(booking)
+    exams = index.exams
+    group_sizes = load_group_sizes(cursor)
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM exam_periods WHERE is_active)")
+    has_active_period = cursor.fetchone()[0]
+
+    problems = []
+    for conflict in index.all_conflicts():
+        problems.append({
+            'type': conflict['type'],
+            'resource': conflict['resource'],
+            'exam_ids': conflict['exam_ids'],
+            'detail': f"overlap {conflict['start'][11:16]}-{conflict['end'][11:16]} on {conflict['start'][:10]}",
+        })
+
+    group_days = {}
+    for exam_id, exam in exams.items():
+        if exam['student_group']:
+            group_days.setdefault((exam['student_group'], exam['exam_day']), []).append(exam_id)
+    for (group, day), exam_ids in group_days.items():
+        if len(exam_ids) > 1:
+            problems.append({
+                'type': 'same_day',
+                'resource': group,
+                'exam_ids': sorted(exam_ids),
+                'detail': f"{len(exam_ids)} exams on {day.isoformat()}",
+            })
+
+    for exam_id, exam in exams.items():
+        size = group_sizes.get(exam['student_group'], 0)
+        capacity = exam['total_capacity'] or exam['capacity'] or 0
+        if exam['room_id'] is not None and capacity < size:
+            where = f"{len(exam['room_ids'])} rooms hold" if len(exam['room_ids']) > 1 else f"room {exam['room_name']} holds"
+            problems.append({
+                'type': 'capacity',
+                'resource': exam['room_id'],
+                'exam_ids': [exam_id],
+                'detail': f"{where} {capacity}, group {exam['student_group']} has {size}",
+            })
+        for clash in class_conflicts(exam, exam['exam_day'], exam['start_hour'], exam['room_ids'] or [exam['room_id']]):
+            problems.append({
+                'type': 'class',
+                'resource': clash['resource'],
+                'exam_ids': [exam_id],
+                'detail': f"{clash['resource_type']} has {clash['discipline_name']} ({clash['class_type'] or 'class'}) "
+                          f"in {clash['room_name']} {clash['start'][11:16]}-{clash['end'][11:16]}",
+            })
+        if has_active_period and not exam['in_active_period']:
+            problems.append({
+                'type': 'outside_period',
+                'resource': None,
+                'exam_ids': [exam_id],
+                'detail': f"{exam['exam_day'].isoformat()} is outside the active exam periods",
+            })
+    return exams, problems
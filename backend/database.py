@@ -1,26 +1,449 @@
 import os
+import threading
+import time
+from collections import deque
 import pg8000.dbapi
 from urllib.parse import urlparse
+from flask import g, has_request_context, current_app, jsonify
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, '') else default
+
+
+def _connect_params():
     db_url = os.environ.get('DATABASE_URL')
     if not db_url:
         raise ValueError("DATABASE_URL environment variable is not set.")
 
     # pg8000 doesn't parse the URL, so we do it manually
     result = urlparse(db_url)
-    user = result.username
-    password = result.password
-    database = result.path[1:]
-    hostname = result.hostname
-    port = result.port
-
-    conn = pg8000.dbapi.connect(
-        user=user,
-        password=password,
-        host=hostname,
-        port=port,
-        database=database
-    )
+    return {
+        'user': result.username,
+        'password': result.password,
+        'host': result.hostname,
+        'port': result.port,
+        'database': result.path[1:],
+    }
+
+
+# SQLSTATE codes the endpoints map to HTTP conflicts
+UNIQUE_VIOLATION = '23505'
+EXCLUSION_VIOLATION = '23P01'
+
+
+def pg_error_code(exc):
+    """Returns the SQLSTATE of a pg8000 database error, or None for other exceptions."""
+    args = getattr(exc, 'args', None)
+    if args and isinstance(args[0], dict):
+        return args[0].get('C')
+    return None
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of pg8000 connections.
+
+    Idle connections are kept in a LIFO stack so the hottest ones are reused first,
+    connections idle for longer than `max_idle` seconds are closed (never going below
+    `min_size`), and a connection that sat idle for more than `ping_after` seconds is
+    checked with `SELECT 1` before it is handed out again.
+    """
+
+    def __init__(self, connect_params, min_size=1, max_size=10, timeout=10.0,
+                 max_idle=300.0, max_lifetime=3600.0, ping_after=5.0):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size configuration.")
+        self._connect_params = connect_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (raw_conn, created_at, last_used)
+        self._size = 0
+        self._waiting = 0
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'failed_liveness_checks': 0,
+            'total_wait_ms': 0.0,
+        }
+
+    # --- Connection lifecycle ---
+
+    def _open(self):
+        conn = pg8000.dbapi.connect(**self._connect_params)
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._lock.notify()
+
+    def _is_alive(self, raw):
+        try:
+            cursor = raw.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def warm_up(self):
+        """Opens connections until `min_size` are available. Failures are left to checkout."""
+        while True:
+            with self._lock:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                raw = self._open()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            now = time.monotonic()
+            with self._lock:
+                self._idle.append((raw, now, now))
+                self._lock.notify()
+
+    def acquire(self, timeout=None):
+        """Checks a connection out of the pool, opening a new one if the pool is not full."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            candidate = None
+            must_open = False
+            with self._lock:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {timeout:.1f}s waiting for a database connection "
+                            f"(pool size {self.max_size})."
+                        )
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._size += 1
+                    must_open = True
+
+            if must_open:
+                try:
+                    raw = self._open()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                return self._checked_out(raw, time.monotonic(), started)
+
+            raw, created_at, last_used = candidate
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime or now - last_used > self.max_idle:
+                self._close_raw(raw)
+                continue
+            if now - last_used > self.ping_after and not self._is_alive(raw):
+                with self._lock:
+                    self._stats['failed_liveness_checks'] += 1
+                self._close_raw(raw)
+                continue
+            return self._checked_out(raw, created_at, started)
+
+    def _checked_out(self, raw, created_at, started):
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['total_wait_ms'] += (time.monotonic() - started) * 1000
+        return PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at, discard=False):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        if not discard:
+            try:
+                raw.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close_raw(raw)
+            return
+
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._idle.append((raw, created_at, now))
+            # Recycle connections that have been idle for too long, oldest first
+            while len(self._idle) > self.min_size and now - self._idle[0][2] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+            self._lock.notify()
+        for stale in expired:
+            self._close_raw(stale)
+
+    def close_all(self):
+        """Closes every idle connection. Checked-out connections are closed when returned."""
+        with self._lock:
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+        for raw in idle:
+            self._close_raw(raw)
+
+    def stats(self):
+        with self._lock:
+            checkouts = self._stats['checkouts']
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'timeouts': self._stats['timeouts'],
+                'created': self._stats['created'],
+                'closed': self._stats['closed'],
+                'failed_liveness_checks': self._stats['failed_liveness_checks'],
+                'avg_wait_ms': round(self._stats['total_wait_ms'] / checkouts, 3) if checkouts else 0.0,
+            }
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a pg8000 connection checked out of a ConnectionPool.
+
+    It behaves like the raw connection, except that close() hands the connection back
+    to the pool (after a rollback) instead of tearing down the socket.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def cursor(self):
+        return self._connection().cursor()
+
+    def commit(self):
+        self._connection().commit()
+
+    def rollback(self):
+        self._connection().rollback()
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.release(raw, self._created_at)
+
+    def discard(self):
+        """Closes the underlying connection instead of returning it, e.g. after a protocol error."""
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.release(raw, self._created_at, discard=True)
+
+    @property
+    def closed(self):
+        return self._raw is None
+
+    def _connection(self):
+        if self._raw is None:
+            raise pg8000.dbapi.InterfaceError("Connection has been returned to the pool.")
+        return self._raw
+
+    def __getattr__(self, name):
+        return getattr(self._connection(), name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process-wide pool, creating it from the environment on first use."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # A forked worker must never share sockets with its parent
+            _pool = ConnectionPool(
+                _connect_params(),
+                min_size=_env_int('DB_POOL_MIN_SIZE', 1),
+                max_size=_env_int('DB_POOL_MAX_SIZE', 10),
+                timeout=_env_float('DB_POOL_TIMEOUT', 10.0),
+                max_idle=_env_float('DB_POOL_MAX_IDLE', 300.0),
+                max_lifetime=_env_float('DB_POOL_MAX_LIFETIME', 3600.0),
+                ping_after=_env_float('DB_POOL_PING_AFTER', 5.0),
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def get_pool_stats():
+    """Returns pool counters for monitoring, or None if no connection was requested yet."""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
+
+
+class RequestConnection:
+    """
+    Unit of work shared by the auth layer and the handler(s) of one HTTP request.
+
+    Handlers keep their usual commit()/rollback()/close() calls: close() is a no-op,
+    rollback() takes effect immediately, and commit() only marks the transaction so
+    that it is committed once, after the view returns (see init_request_connections).
+    """
+
+    def __init__(self, pooled):
+        self._conn = pooled
+        self.commit_requested = False
+        self.on_commit = []
+
+    def cursor(self):
+        return self._conn.cursor()
+
+    def commit(self):
+        self.commit_requested = True
+
+    def rollback(self):
+        self.commit_requested = False
+        self.on_commit = []
+        self._conn.rollback()
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def finish(self, commit):
+        """Commits (or rolls back) the request transaction and returns the connection to the pool."""
+        callbacks = []
+        try:
+            if commit and self.commit_requested:
+                self._conn.commit()
+                callbacks = self.on_commit
+        finally:
+            self.commit_requested = False
+            self.on_commit = []
+            self._conn.close()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in after-commit callback: {e}")
+
+
+def _commit_request_connection(response):
+    conn = g.pop('_db_conn', None)
+    if conn is None:
+        return response
+    try:
+        conn.finish(commit=True)
+    except Exception as e:
+        print(f"Error committing request transaction: {e}")
+        response = jsonify({"error": "An internal error occurred"})
+        response.status_code = 500
+    return response
+
+
+def _release_request_connection(exc):
+    # Only reached with a connection still attached when the view raised
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn.finish(commit=False)
+
+
+def init_request_connections(app):
+    """Makes get_db_connection() return one shared connection/transaction per request."""
+    app.extensions['request_db_connection'] = True
+    app.after_request(_commit_request_connection)
+    app.teardown_request(_release_request_connection)
+
+
+def after_commit(callback):
+    """
+    Runs `callback` once the current request transaction has been committed.
+    Outside a request-scoped transaction the callback runs immediately.
+    """
+    conn = g.get('_db_conn') if has_request_context() else None
+    if conn is None:
+        callback()
+    else:
+        conn.on_commit.append(callback)
+
+
+def get_db_connection():
+    """
+    Returns a database connection.
+
+    Inside a request of an app set up with init_request_connections() every caller gets
+    the same request-scoped connection; elsewhere (scripts, startup checks) a connection
+    is checked out of the pool and close() returns it.
+    """
+    if has_request_context() and current_app.extensions.get('request_db_connection'):
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = RequestConnection(_checkout())
+            g._db_conn = conn
+        return conn
+    return _checkout()
+
+
+def _checkout():
+    pool = get_pool()
+    conn = pool.acquire()
+    if pool.min_size > 1:
+        try:
+            pool.warm_up()
+        except Exception as e:
+            print(f"Could not warm up the database pool: {e}")
     return conn
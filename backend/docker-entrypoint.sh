@@ -8,10 +8,10 @@ while ! pg_isready -h db -U postgres -q; do
 done
 echo "PostgreSQL is ready!"
 
-# Initialize the database
-echo "Initializing database..."
+# Apply pending schema migrations (non-destructive; a no-op when the schema is current)
+echo "Migrating database..."
 python init_db.py
-echo "Database initialized!"
+echo "Database migrated!"
 
 # Populate the database with sample data
 echo "Populating database with sample data..."
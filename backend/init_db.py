@@ -1,4 +1,7 @@
 import os
+import sys
+import time
+import argparse
 import pg8000.dbapi
 from dotenv import load_dotenv
 from pathlib import Path
@@ -6,6 +9,7 @@ import re
 import requests
 from werkzeug.security import generate_password_hash
 import uuid
+import migrations
 
 def get_db_connection():
     dotenv_path = Path(__file__).resolve().parent / '.env'
@@ -140,82 +144,50 @@ def populate_initial_data(conn):
     except (requests.exceptions.RequestException, ValueError, KeyError) as e:
         print(f"Could not fetch or parse rooms data: {e}.")
 
+def reset_schema(conn):
+    """Drops every application table. Development only: this wipes all data."""
+    cursor = conn.cursor()
+    print("Dropping existing tables...")
+    for table_name in ['enrollments', 'class_timetable', 'teacher_availability', 'exam_periods', 'seating_plans', 'exam_rooms', 'exams', 'discipline_teachers', 'disciplines', 'rooms', 'users', 'schema_migrations']:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name} CASCADE;")
+    conn.commit()
+
 def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations and seed an empty database.")
+    parser.add_argument('--reset', action='store_true', help='drop all tables first (destroys data, development only)')
+    parser.add_argument('--populate', action='store_true', help='fetch teachers, disciplines and rooms even if users exist')
+    args = parser.parse_args()
+
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         print("Database connection successful.")
-        tables = [
-            ('users', """
-                id VARCHAR(255) PRIMARY KEY,
-                full_name VARCHAR(255) NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255),
-                role VARCHAR(50) NOT NULL DEFAULT 'STUDENT' CHECK (role IN ('STUDENT', 'CADRU_DIDACTIC', 'ADMIN', 'SEF_GRUPA', 'SEC')),
-                student_group VARCHAR(50),
-                year_of_study INTEGER,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            """),
-            ('rooms', """
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                short_name VARCHAR(50),
-                building_name VARCHAR(100),
-                capacity INTEGER NOT NULL
-            """),
-            ('disciplines', """
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                year_of_study INTEGER,
-                specialization VARCHAR(255)
-            """),
-            ('discipline_teachers', """
-                discipline_id INTEGER REFERENCES disciplines(id) ON DELETE CASCADE,
-                teacher_id VARCHAR(255) REFERENCES users(id) ON DELETE CASCADE,
-                PRIMARY KEY (discipline_id, teacher_id)
-            """),
-            ('exams', """
-                id SERIAL PRIMARY KEY,
-                discipline_id INTEGER REFERENCES disciplines(id),
-                exam_type VARCHAR(50) CHECK (exam_type IN ('EXAM', 'PROJECT')),
-                student_group VARCHAR(50),
-                main_teacher_id VARCHAR(255) REFERENCES users(id),
-                second_teacher_id VARCHAR(255) REFERENCES users(id),
-                status VARCHAR(50) DEFAULT 'DRAFT' CHECK (status IN ('DRAFT', 'PROPOSED', 'ACCEPTED', 'REJECTED', 'CANCELLED', 'RESCHEDULED', 'CONFIRMED')),
-                exam_date TIMESTAMP,
-                start_hour INTEGER CHECK (start_hour >= 8 AND start_hour <= 18),
-                duration INTEGER DEFAULT 120,
-                room_id INTEGER REFERENCES rooms(id),
-                created_by VARCHAR(255) REFERENCES users(id),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            """),
-            ('exam_periods', """
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                start_date DATE NOT NULL,
-                end_date DATE NOT NULL,
-                is_active BOOLEAN DEFAULT FALSE
-            """)
-        ]
-        print("Dropping existing tables...")
-        for table_name, _ in reversed(tables):
-            cursor.execute(f"DROP TABLE IF EXISTS {table_name} CASCADE;")
-        print("Creating tables...")
-        for table_name, schema in tables:
-            cursor.execute(f"CREATE TABLE {table_name} ({schema});")
-        conn.commit()
-        print("All tables created successfully.")
-        populate_initial_data(conn)
-        conn.commit()
+        if args.reset:
+            reset_schema(conn)
+
+        started = time.monotonic()
+        applied = migrations.migrate(conn)
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if applied:
+            print(f"Applied migrations {applied} in {elapsed_ms:.0f} ms.")
+        else:
+            print(f"Schema is up to date (version {migrations.latest_version()}, checked in {elapsed_ms:.1f} ms).")
+
+        # Only seed a database that has never been populated; restarts skip the HTTP fetches
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM users)")
+        if args.populate or not cursor.fetchone()[0]:
+            populate_initial_data(conn)
+            conn.commit()
         print("Database initialization complete.")
     except pg8000.dbapi.Error as e:
         print(f"Database error: {e}")
         if conn: conn.rollback()
+        sys.exit(1)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         if conn: conn.rollback()
+        sys.exit(1)
     finally:
         if conn:
             conn.close()
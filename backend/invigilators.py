@@ -0,0 +1,270 @@
+"""
+Balanced assignment of second teachers (invigilators) to scheduled exams.
+
+Every exam of a period that has a date and a start hour gets a second teacher picked
+among the CADRU_DIDACTIC users. The exams are taken one start time at a time, in
+chronological order; exams that start together all overlap, so each start time is a
+rectangular assignment problem (exams x teachers) solved exactly with
+scipy.optimize.linear_sum_assignment. The cost of giving an exam to a teacher is:
+
+  - the increase of the teacher's squared workload, in hours of supervision (as main
+    or second teacher) in the period; minimising the sum of squares spreads the work
+    evenly, and the running loads carry the balance from one start time to the next;
+  - minus AFFINITY_BONUS when the teacher teaches the discipline (discipline_teachers);
+  - minus KEEP_BONUS when the teacher already invigilates the exam, so equally good
+    plans keep the current assignment and the diff stays small;
+  - UNAVAILABLE when the teacher is the exam's main teacher, supervises another exam
+    or teaches a class at the same time, or blocked those hours in their calendar.
+
+plan() is pure (NumPy in, plain dicts out) and only returns a diff; load_problem() and
+apply_changes() are the only functions that touch the database.
+"""
+
+from collections import namedtuple
+from datetime import date
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from occupancy import slot_range, SLOTS_PER_DAY
+from teacher_availability import teacher_availability
+from class_timetable import class_timetable
+
+AFFINITY_BONUS = 4.0  # hours^2 of workload, about one extra two-hour exam for an idle teacher
+KEEP_BONUS = 1.0
+UNAVAILABLE = 1e9
+
+ACTIVE_STATUSES = ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+
+Problem = namedtuple('Problem', [
+    'teachers',     # (id, full_name) tuples
+    'exams',        # dicts: id, day, start_hour, duration, main_teacher_id, second_teacher_id, discipline_id, ...
+    'affinity',     # discipline id -> set of teacher ids
+    'fixed_hours',  # float per teacher: supervision of exams that are not reassigned
+    'busy',         # bool teachers x days x slots, from fixed exams, calendars and classes
+])
+
+
+def _spread(hours):
+    hours = np.asarray(hours, dtype=np.float64)
+    if not len(hours):
+        return {'min_hours': 0.0, 'max_hours': 0.0, 'mean_hours': 0.0, 'std_hours': 0.0}
+    return {
+        'min_hours': round(float(hours.min()), 2),
+        'max_hours': round(float(hours.max()), 2),
+        'mean_hours': round(float(hours.mean()), 2),
+        'std_hours': round(float(hours.std()), 2),
+    }
+
+
+def plan(problem):
+    """
+    Returns a report with the second teacher chosen for every exam of `problem`, the
+    changes against the current assignment and the workload spread before and after.
+    """
+    teacher_index = {teacher_id: i for i, (teacher_id, _) in enumerate(problem.teachers)}
+    names = dict(problem.teachers)
+    count = len(problem.teachers)
+    load = np.array(problem.fixed_hours, dtype=np.float64)
+    busy = problem.busy.copy()
+
+    before = load.copy()
+    for exam in problem.exams:
+        current = teacher_index.get(exam['second_teacher_id'])
+        if current is not None:
+            before[current] += exam['duration'] / 60
+
+    batches = {}
+    for i, exam in enumerate(problem.exams):
+        batches.setdefault((exam['day'], exam['start_hour']), []).append(i)
+
+    chosen = [None] * len(problem.exams)
+    for day, start_hour in sorted(batches):
+        members = batches[(day, start_hour)]
+        hours = np.array([problem.exams[i]['duration'] / 60 for i in members])
+        cost = hours[:, np.newaxis] * (2 * load[np.newaxis, :] + hours[:, np.newaxis])
+        for row, i in enumerate(members):
+            exam = problem.exams[i]
+            first, last = slot_range(start_hour, exam['duration'])
+            cost[row, busy[:, day, first:last].any(axis=1)] = UNAVAILABLE
+            for teacher_id in problem.affinity.get(exam['discipline_id'], ()):
+                if teacher_id in teacher_index:
+                    cost[row, teacher_index[teacher_id]] -= AFFINITY_BONUS
+            if exam['second_teacher_id'] in teacher_index:
+                cost[row, teacher_index[exam['second_teacher_id']]] -= KEEP_BONUS
+            if exam['main_teacher_id'] in teacher_index:
+                cost[row, teacher_index[exam['main_teacher_id']]] = UNAVAILABLE
+
+        if not count:
+            continue
+        rows, columns = linear_sum_assignment(cost)
+        for row, t in zip(rows, columns):
+            if cost[row, t] >= UNAVAILABLE / 2:
+                continue
+            i = members[row]
+            chosen[i] = t
+            load[t] += hours[row]
+            first, last = slot_range(start_hour, problem.exams[i]['duration'])
+            busy[t, day, first:last] = True
+
+    changes, unassigned = [], []
+    for i, exam in enumerate(problem.exams):
+        details = {
+            'exam_id': exam['id'],
+            'discipline_name': exam['discipline_name'],
+            'student_group': exam['student_group'],
+            'date': exam['date'],
+            'start_hour': exam['start_hour'],
+            'duration': exam['duration'],
+        }
+        if chosen[i] is None:
+            unassigned.append(dict(details, reason='Every teacher supervises another exam or is unavailable at this time'))
+            continue
+        teacher_id = problem.teachers[chosen[i]][0]
+        if teacher_id == exam['second_teacher_id']:
+            continue
+        changes.append(dict(
+            details,
+            from_teacher_id=exam['second_teacher_id'],
+            from_teacher_name=names.get(exam['second_teacher_id']),
+            to_teacher_id=teacher_id,
+            to_teacher_name=names[teacher_id],
+            teaches_discipline=teacher_id in problem.affinity.get(exam['discipline_id'], ()),
+        ))
+    changes.sort(key=lambda change: (change['date'], change['start_hour'], change['exam_id']))
+
+    # Exams left without a teacher keep their current one
+    after = load.copy()
+    for i, exam in enumerate(problem.exams):
+        current = teacher_index.get(exam['second_teacher_id'])
+        if chosen[i] is None and current is not None:
+            after[current] += exam['duration'] / 60
+
+    return {
+        'exams': len(problem.exams),
+        'teachers': count,
+        'changed': len(changes),
+        'unassigned': unassigned,
+        'workload_before': _spread(before),
+        'workload_after': _spread(after),
+        'workload': sorted([
+            {
+                'teacher_id': teacher_id,
+                'full_name': full_name,
+                'hours_before': round(float(before[t]), 2),
+                'hours_after': round(float(after[t]), 2),
+            }
+            for t, (teacher_id, full_name) in enumerate(problem.teachers)
+        ], key=lambda row: (-row['hours_after'], row['full_name'] or '')),
+        'changes': changes,
+    }
+
+
+def load_problem(cursor, start_date, end_date, exam_ids=None):
+    """
+    Reads the teachers, their availability and classes (from the teacher_availability and
+    class_timetable caches, which the caller refreshes) and the active exams of a date range. Every scheduled exam of the
+    range is reassigned, or only `exam_ids`; the other exams count as fixed workload.
+    """
+    cursor.execute("SELECT id, full_name FROM users WHERE role = 'CADRU_DIDACTIC' ORDER BY id")
+    teachers = [tuple(row) for row in cursor.fetchall()]
+    teacher_index = {teacher_id: i for i, (teacher_id, _) in enumerate(teachers)}
+
+    cursor.execute("SELECT discipline_id, teacher_id FROM discipline_teachers")
+    affinity = {}
+    for discipline_id, teacher_id in cursor.fetchall():
+        affinity.setdefault(discipline_id, set()).add(teacher_id)
+
+    cursor.execute(
+        """
+        SELECT e.id, e.exam_day - %s::date, e.exam_day, e.start_hour, COALESCE(e.duration, 120),
+               e.main_teacher_id, e.second_teacher_id, e.discipline_id, d.name, e.student_group,
+               %s::int[] IS NULL OR e.id = ANY(%s::int[])
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE e.exam_day BETWEEN %s AND %s AND e.start_hour IS NOT NULL
+        AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+        ORDER BY e.exam_day, e.start_hour, e.id
+        """,
+        (start_date, exam_ids, exam_ids, start_date, end_date)
+    )
+    days = (end_date - start_date).days + 1
+    fixed_hours = np.zeros(len(teachers))
+    busy = np.zeros((len(teachers), days, SLOTS_PER_DAY), dtype=bool)
+    exams = []
+    for exam_id, day, exam_day, hour, duration, main, second, discipline_id, name, group, selected in cursor.fetchall():
+        first, last = slot_range(hour, duration)
+        supervising = {main} if selected else {main, second}
+        for teacher_id in supervising - {None}:
+            t = teacher_index.get(teacher_id)
+            if t is not None:
+                fixed_hours[t] += duration / 60
+                busy[t, day, first:last] = True
+        if selected:
+            exams.append({
+                'id': exam_id,
+                'day': day,
+                'date': exam_day.isoformat(),
+                'start_hour': hour,
+                'duration': duration,
+                'main_teacher_id': main,
+                'second_teacher_id': second,
+                'discipline_id': discipline_id,
+                'discipline_name': name,
+                'student_group': group,
+            })
+
+    # Hours the teachers blocked in their availability calendars or teach classes count as busy
+    period_days = [date.fromordinal(start_date.toordinal() + d) for d in range(days)]
+    for t, (teacher_id, _) in enumerate(teachers):
+        busy[t] |= teacher_availability.blocked_slots([teacher_id], period_days)
+        busy[t] |= class_timetable.busy_slots([teacher_id], None, period_days)
+
+    return Problem(teachers, exams, affinity, fixed_hours, busy)
+
+
+def apply_changes(cursor, changes):
+    """
+    Sets the second teacher of each change ({exam_id, from_teacher_id, to_teacher_id}) in
+    one statement. Returns the ids of the exams that were not updated, because their
+    second teacher is no longer from_teacher_id, they are no longer active or the new
+    teacher is their main teacher, followed by the ids of the updated exams that now
+    overlap another exam of the new teacher; the caller commits only if both are empty.
+    """
+    if not changes:
+        return [], []
+    cursor.execute(
+        """
+        UPDATE exams e
+        SET second_teacher_id = c.to_teacher_id, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::int[], %s::text[], %s::text[]) AS c(id, from_teacher_id, to_teacher_id)
+        WHERE e.id = c.id
+        AND e.second_teacher_id IS NOT DISTINCT FROM c.from_teacher_id
+        AND e.main_teacher_id IS DISTINCT FROM c.to_teacher_id
+        AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+        AND EXISTS (SELECT 1 FROM users u WHERE u.id = c.to_teacher_id AND u.role = 'CADRU_DIDACTIC')
+        RETURNING e.id
+        """,
+        (
+            [c['exam_id'] for c in changes],
+            [c.get('from_teacher_id') for c in changes],
+            [c['to_teacher_id'] for c in changes],
+        )
+    )
+    updated = [row[0] for row in cursor.fetchall()]
+    stale = sorted({c['exam_id'] for c in changes} - set(updated))
+
+    clashes = []
+    if updated:
+        cursor.execute(
+            """
+            SELECT DISTINCT e.id FROM exams e
+            JOIN exams o ON o.id != e.id
+                AND o.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+                AND o.booked_during && e.booked_during
+                AND e.second_teacher_id IN (o.main_teacher_id, o.second_teacher_id)
+            WHERE e.id = ANY(%s)
+            ORDER BY e.id
+            """,
+            (updated,)
+        )
+        clashes = [row[0] for row in cursor.fetchall()]
+    return stale, clashes
@@ -0,0 +1,348 @@
+"""
+Versioned, non-destructive schema migrations.
+
+Every migration has an increasing version number and is applied at most once; the
+versions already applied are recorded in `schema_migrations`. When the schema is
+current, migrate() costs two catalog lookups and returns without taking any lock.
+
+Migrations marked non-transactional run in autocommit mode, which is what
+CREATE INDEX CONCURRENTLY needs in order to build an index without blocking writes
+to a live table. Such statements must be idempotent (IF NOT EXISTS), because a
+failure halfway leaves the earlier statements applied.
+"""
+
+import re
+import time
+from collections import namedtuple
+
+Migration = namedtuple('Migration', ['version', 'name', 'statements', 'transactional'])
+
+# Arbitrary key for pg_advisory_lock so that two app containers never migrate concurrently
+MIGRATION_LOCK_KEY = 72215301
+
+# Stops a migration with the list of clashing exam ids when two active exams overlap in the
+# same room; earlier versions only refused an identical start hour, so such rows can exist
+ROOM_DOUBLE_BOOKINGS_CHECK = """DO $$
+DECLARE
+    clashes TEXT;
+BEGIN
+    SELECT string_agg(format('%s and %s (room %s)', a.id, b.id, a.room_id), ', ' ORDER BY a.id, b.id)
+    INTO clashes
+    FROM exams a
+    JOIN exams b ON b.room_id = a.room_id AND b.id > a.id AND b.booked_during && a.booked_during
+    WHERE a.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+    AND b.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED');
+    IF clashes IS NOT NULL THEN
+        RAISE EXCEPTION 'Active exams overlap in the same room: %. Move, reject or cancel one exam of each pair and rerun init_db.py.', clashes;
+    END IF;
+END $$"""
+
+MIGRATIONS = [
+    Migration(1, 'baseline schema', [
+        """CREATE TABLE IF NOT EXISTS users (
+            id VARCHAR(255) PRIMARY KEY,
+            full_name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            password_hash VARCHAR(255),
+            role VARCHAR(50) NOT NULL DEFAULT 'STUDENT' CHECK (role IN ('STUDENT', 'CADRU_DIDACTIC', 'ADMIN', 'SEF_GRUPA', 'SEC')),
+            student_group VARCHAR(50),
+            year_of_study INTEGER,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS rooms (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            short_name VARCHAR(50),
+            building_name VARCHAR(100),
+            capacity INTEGER NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS disciplines (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            year_of_study INTEGER,
+            specialization VARCHAR(255)
+        )""",
+        """CREATE TABLE IF NOT EXISTS discipline_teachers (
+            discipline_id INTEGER REFERENCES disciplines(id) ON DELETE CASCADE,
+            teacher_id VARCHAR(255) REFERENCES users(id) ON DELETE CASCADE,
+            PRIMARY KEY (discipline_id, teacher_id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS exams (
+            id SERIAL PRIMARY KEY,
+            discipline_id INTEGER REFERENCES disciplines(id),
+            exam_type VARCHAR(50) CHECK (exam_type IN ('EXAM', 'PROJECT')),
+            student_group VARCHAR(50),
+            main_teacher_id VARCHAR(255) REFERENCES users(id),
+            second_teacher_id VARCHAR(255) REFERENCES users(id),
+            status VARCHAR(50) DEFAULT 'DRAFT' CHECK (status IN ('DRAFT', 'PROPOSED', 'ACCEPTED', 'REJECTED', 'CANCELLED', 'RESCHEDULED', 'CONFIRMED')),
+            exam_date TIMESTAMP,
+            start_hour INTEGER CHECK (start_hour >= 8 AND start_hour <= 18),
+            duration INTEGER DEFAULT 120,
+            room_id INTEGER REFERENCES rooms(id),
+            created_by VARCHAR(255) REFERENCES users(id),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS exam_periods (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            is_active BOOLEAN DEFAULT FALSE
+        )""",
+    ], True),
+    # Indexes backing the hot role listings and booking checks (see check_indexes.py)
+    Migration(2, 'exam workflow indexes', [
+        # SG and student listings: WHERE e.student_group = %s
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_student_group ON exams (student_group)",
+        # CD listing: WHERE e.main_teacher_id = %s OR e.second_teacher_id = %s (BitmapOr of both)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_main_teacher ON exams (main_teacher_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_second_teacher ON exams (second_teacher_id)",
+        # SEC confirmed listings and exports: WHERE e.status = 'CONFIRMED' ORDER BY exam_date, start_hour
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_status_slot ON exams (status, exam_date, start_hour)",
+        # Room booking checks only ever look at active bookings
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_active_room_slot ON exams (room_id, exam_date, start_hour)
+           WHERE status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')""",
+        # Role pickers and group leader lookups
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_role ON users (role)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_student_group_role ON users (student_group, role)",
+        # Teacher -> disciplines (the primary key leads with discipline_id)
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_discipline_teachers_teacher ON discipline_teachers (teacher_id)",
+        # One exam per discipline and group, enforced by the database instead of check-then-insert
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS exams_discipline_group_key ON exams (discipline_id, student_group)",
+        """DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'exams_discipline_group_key') THEN
+                ALTER TABLE exams ADD CONSTRAINT exams_discipline_group_key UNIQUE USING INDEX exams_discipline_group_key;
+            END IF;
+        END $$""",
+    ], False),
+    # Bookings as time ranges: a sargable day column plus an exclusion constraint that makes
+    # two active bookings of the same room impossible, whatever the request interleaving
+    Migration(3, 'room booking ranges and exclusion constraint', [
+        "ALTER TABLE exams ADD COLUMN IF NOT EXISTS exam_day DATE GENERATED ALWAYS AS (exam_date::date) STORED",
+        """ALTER TABLE exams ADD COLUMN IF NOT EXISTS booked_during TSRANGE GENERATED ALWAYS AS (
+            CASE WHEN exam_date IS NULL OR start_hour IS NULL THEN NULL
+            ELSE tsrange(
+                exam_date::date + make_interval(hours => start_hour),
+                exam_date::date + make_interval(hours => start_hour, mins => COALESCE(duration, 120)),
+                '[)'
+            ) END
+        ) STORED""",
+        ROOM_DOUBLE_BOOKINGS_CHECK,
+        # int4range(room_id, room_id, '[]') stands in for "room_id WITH =" without needing btree_gist;
+        # a NULL room would give an unbounded range, hence the room_id IS NOT NULL predicate
+        """ALTER TABLE exams ADD CONSTRAINT exams_room_booking_excl EXCLUDE USING gist (
+            int4range(room_id, room_id, '[]') WITH &&,
+            booked_during WITH &&
+        ) WHERE (room_id IS NOT NULL AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED'))""",
+    ], True),
+    Migration(4, 'active bookings by day index', [
+        """CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_exams_active_day_slot ON exams (exam_day, start_hour)
+           WHERE status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')""",
+        # Room checks now go through the exclusion constraint's GiST index
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_exams_active_room_slot",
+    ], False),
+    # Exams spanning several rooms. exam_rooms holds every room of an exam (the primary one,
+    # exams.room_id, included); a trigger keeps its time range and active flag in step with
+    # the exam, so one exclusion constraint covers primary and extra rooms alike
+    Migration(5, 'multi-room exams', [
+        """CREATE TABLE IF NOT EXISTS exam_rooms (
+            exam_id INTEGER NOT NULL REFERENCES exams(id) ON DELETE CASCADE,
+            room_id INTEGER NOT NULL REFERENCES rooms(id),
+            is_primary BOOLEAN NOT NULL DEFAULT FALSE,
+            seats INTEGER,
+            booked_during TSRANGE,
+            active BOOLEAN NOT NULL DEFAULT FALSE,
+            PRIMARY KEY (exam_id, room_id),
+            CHECK (NOT active OR booked_during IS NOT NULL)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_exam_rooms_room ON exam_rooms (room_id)",
+        """ALTER TABLE exam_rooms ADD CONSTRAINT exam_rooms_booking_excl EXCLUDE USING gist (
+            int4range(room_id, room_id, '[]') WITH &&,
+            booked_during WITH &&
+        ) WHERE (active)""",
+        """CREATE OR REPLACE FUNCTION sync_exam_rooms() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' OR NEW.room_id IS DISTINCT FROM OLD.room_id THEN
+                DELETE FROM exam_rooms WHERE exam_id = NEW.id AND (is_primary OR room_id = NEW.room_id);
+                IF NEW.room_id IS NOT NULL THEN
+                    INSERT INTO exam_rooms (exam_id, room_id, is_primary) VALUES (NEW.id, NEW.room_id, TRUE);
+                END IF;
+            END IF;
+            UPDATE exam_rooms
+            SET booked_during = NEW.booked_during,
+                active = NEW.booked_during IS NOT NULL AND NEW.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            WHERE exam_id = NEW.id
+            AND (booked_during IS DISTINCT FROM NEW.booked_during
+                 OR active IS DISTINCT FROM (NEW.booked_during IS NOT NULL AND NEW.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')));
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER exams_sync_exam_rooms
+            AFTER INSERT OR UPDATE OF room_id, exam_date, start_hour, duration, status ON exams
+            FOR EACH ROW EXECUTE FUNCTION sync_exam_rooms()""",
+        ROOM_DOUBLE_BOOKINGS_CHECK,
+        """INSERT INTO exam_rooms (exam_id, room_id, is_primary, booked_during, active)
+            SELECT id, room_id, TRUE, booked_during,
+                   booked_during IS NOT NULL AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            FROM exams WHERE room_id IS NOT NULL
+            ON CONFLICT DO NOTHING""",
+    ], True),
+    # Seating plans of confirmed exams, packed per student in id order (see seating.py)
+    Migration(6, 'seating plans', [
+        """CREATE TABLE IF NOT EXISTS seating_plans (
+            exam_id INTEGER PRIMARY KEY REFERENCES exams(id) ON DELETE CASCADE,
+            input_hash CHAR(32) NOT NULL,
+            room_ids INTEGER[] NOT NULL,
+            rooms BYTEA NOT NULL,
+            seats BYTEA NOT NULL,
+            generated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )""",
+    ], True),
+    # Hours teachers cannot supervise, one bit per (day, hour) of a period (see teacher_availability.py)
+    Migration(7, 'teacher availability', [
+        """CREATE TABLE IF NOT EXISTS teacher_availability (
+            teacher_id VARCHAR(255) REFERENCES users(id) ON DELETE CASCADE,
+            period_id INTEGER REFERENCES exam_periods(id) ON DELETE CASCADE,
+            start_date DATE NOT NULL,
+            days INTEGER NOT NULL,
+            blocked BYTEA NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (teacher_id, period_id)
+        )""",
+    ], True),
+    # Weekly class timetable imported from orar.usv.ro (see class_timetable.py)
+    Migration(8, 'class timetable', [
+        """CREATE TABLE IF NOT EXISTS class_timetable (
+            id SERIAL PRIMARY KEY,
+            weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_minute SMALLINT NOT NULL,
+            duration SMALLINT NOT NULL,
+            parity SMALLINT NOT NULL DEFAULT 0 CHECK (parity IN (0, 1, 2)),
+            room_id INTEGER REFERENCES rooms(id) ON DELETE SET NULL,
+            room_name VARCHAR(255),
+            teacher_id VARCHAR(255) REFERENCES users(id) ON DELETE SET NULL,
+            teacher_name VARCHAR(255),
+            student_group VARCHAR(50),
+            discipline_name VARCHAR(255),
+            class_type VARCHAR(50),
+            valid_from DATE,
+            valid_to DATE
+        )""",
+    ], True),
+    # Students who sit the exams of another cohort: retakes and optional disciplines (see student_conflicts.py)
+    Migration(9, 'enrollments', [
+        """CREATE TABLE IF NOT EXISTS enrollments (
+            student_id VARCHAR(255) REFERENCES users(id) ON DELETE CASCADE,
+            discipline_id INTEGER REFERENCES disciplines(id) ON DELETE CASCADE,
+            student_group VARCHAR(50) NOT NULL,
+            kind VARCHAR(20) NOT NULL DEFAULT 'RETAKE' CHECK (kind IN ('RETAKE', 'OPTIONAL')),
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (student_id, discipline_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_enrollments_discipline ON enrollments (discipline_id, student_group)",
+    ], True),
+]
+
+_CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+def latest_version():
+    return MIGRATIONS[-1].version
+
+
+def current_version(cursor):
+    """Returns the highest applied version, or 0 for a database without schema_migrations."""
+    cursor.execute("SELECT to_regclass('public.schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def _drop_invalid_index(cursor, index_name):
+    # A failed CREATE INDEX CONCURRENTLY leaves an INVALID index that IF NOT EXISTS would skip
+    cursor.execute(
+        """SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+           WHERE c.relname = %s AND NOT i.indisvalid""",
+        (index_name,)
+    )
+    if cursor.fetchone():
+        print(f"Dropping invalid index {index_name} left by an interrupted migration...")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+
+def _apply(conn, migration):
+    cursor = conn.cursor()
+    started = time.monotonic()
+    try:
+        if migration.transactional:
+            for statement in migration.statements:
+                cursor.execute(statement)
+        else:
+            conn.autocommit = True
+            try:
+                for statement in migration.statements:
+                    match = _CONCURRENT_INDEX.search(statement)
+                    if match:
+                        _drop_invalid_index(cursor, match.group(1))
+                    cursor.execute(statement)
+            finally:
+                conn.autocommit = False
+        duration_ms = int((time.monotonic() - started) * 1000)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+            (migration.version, migration.name, duration_ms)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return duration_ms
+
+
+def migrate(conn, target=None):
+    """
+    Applies pending migrations on a raw (non-pooled) pg8000 connection.
+    Returns the list of versions applied by this call.
+    """
+    target = latest_version() if target is None else target
+    cursor = conn.cursor()
+    try:
+        if current_version(cursor) >= target:
+            conn.rollback()
+            return []
+
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                duration_ms INTEGER
+            )"""
+        )
+        conn.commit()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+        try:
+            # Another process may have migrated while we waited for the lock
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            newly_applied = []
+            for migration in MIGRATIONS:
+                if migration.version > target or migration.version in applied:
+                    continue
+                print(f"Applying migration {migration.version}: {migration.name}...")
+                duration_ms = _apply(conn, migration)
+                print(f"Migration {migration.version} applied in {duration_ms} ms.")
+                newly_applied.append(migration.version)
+            return newly_applied
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+    finally:
+        cursor.close()
@@ -0,0 +1,298 @@
+"""
+Process-wide room occupancy index.
+
+Active bookings (PROPOSED, ACCEPTED, CONFIRMED) are kept in a NumPy array of shape
+rooms x days x slots, where a slot is SLOT_MINUTES long and the day runs from
+DAY_START_HOUR to DAY_END_HOUR. Each cell counts the bookings covering it, so
+"which rooms are free at this date and time" is a slice, an any() and a mask,
+without touching the database.
+
+Regular classes (the class_timetable table, see class_timetable.py) recur weekly, so
+they are kept apart in a parity x rooms x weekdays x slots array; a date selects its
+weekday and week parity, which adds one more slice to every lookup.
+
+The index is loaded lazily (or at startup) and is then kept current by the endpoints
+that change bookings, through after_commit callbacks. A full reload still happens
+every OCCUPANCY_TTL seconds to pick up changes made outside this process.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, date
+import numpy as np
+
+SLOT_MINUTES = 30
+DAY_START_HOUR = 8
+DAY_END_HOUR = 22
+SLOTS_PER_DAY = (DAY_END_HOUR - DAY_START_HOUR) * 60 // SLOT_MINUTES
+DEFAULT_DURATION = 120
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def slot_range(start_hour, duration=None):
+    """Returns the [first, last) slot indexes covered by an exam, clipped to the day."""
+    return minute_slot_range(int(start_hour) * 60, duration)
+
+
+def minute_slot_range(start_minute, duration=None):
+    """Like slot_range, for a start given in minutes after midnight (classes start at 8:30 too)."""
+    start_minute -= DAY_START_HOUR * 60
+    end_minute = start_minute + (duration or DEFAULT_DURATION)
+    first = min(SLOTS_PER_DAY, max(0, start_minute // SLOT_MINUTES))
+    last = min(SLOTS_PER_DAY, -(-end_minute // SLOT_MINUTES))
+    return first, max(first, last)
+
+
+def class_parities(day, valid_from=None, valid_to=None):
+    """
+    Returns the week parities (0 = every week, 1 = odd weeks, 2 = even weeks) of the
+    regular classes held on `day`, or () outside [valid_from, valid_to]. Weeks are counted
+    from valid_from; without it alternating classes are assumed to be held every week.
+    """
+    if (valid_from and day < valid_from) or (valid_to and day > valid_to):
+        return ()
+    if valid_from is None:
+        return (0, 1, 2)
+    return (0, 1 if (day - valid_from).days // 7 % 2 == 0 else 2)
+
+
+class RoomOccupancy:
+    """Thread-safe rooms x days x slots booking counts, with per-exam bookkeeping for updates."""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._journal = None  # mutations made while a reload is querying the database
+        self._reset([], {})
+
+    def _reset(self, rooms, bookings, classes=(), class_window=(None, None)):
+        # Rooms are kept in name order, which is the order the API returns them in
+        self._rooms = rooms
+        self._room_index = {room['id']: i for i, room in enumerate(rooms)}
+        self._capacity = np.array([room['capacity'] or 0 for room in rooms], dtype=np.int32)
+        self._day_index = {}
+        self._grid = np.zeros((len(rooms), 0, SLOTS_PER_DAY), dtype=np.uint8)
+        self._bookings = {}  # exam id -> (room indexes, day, first slot, last slot, student group)
+        for exam_id, booking in bookings.items():
+            self._book(exam_id, *booking)
+        self._classes = np.zeros((3, len(rooms), 7, SLOTS_PER_DAY), dtype=bool)
+        self._class_window = class_window
+        for room_id, weekday, start_minute, duration, parity in classes:
+            room = self._room_index.get(room_id)
+            if room is not None:
+                first, last = minute_slot_range(start_minute, duration)
+                self._classes[parity, room, weekday, first:last] = True
+
+    # --- Loading ---
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        """Forces a reload on next use, e.g. after rooms were added, edited or deleted."""
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, cursor):
+        """Rebuilds the index from the rooms table and the active bookings."""
+        with self._lock:
+            self._journal = []
+        try:
+            cursor.execute("SELECT id, name, capacity, building_name FROM rooms ORDER BY name")
+            columns = [desc[0] for desc in cursor.description]
+            rooms = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            # exam_rooms holds every room of an exam, the primary one included
+            cursor.execute(
+                """
+                SELECT e.id, array_agg(er.room_id), e.exam_day, e.start_hour, e.duration, e.student_group
+                FROM exam_rooms er JOIN exams e ON er.exam_id = e.id
+                WHERE er.active
+                GROUP BY e.id
+                """
+            )
+            bookings = {row[0]: row[1:] for row in cursor.fetchall()}
+            cursor.execute(
+                """SELECT room_id, weekday, start_minute, duration, parity, valid_from, valid_to
+                FROM class_timetable WHERE room_id IS NOT NULL"""
+            )
+            classes = cursor.fetchall()
+            class_window = tuple(classes[0][5:]) if classes else (None, None)
+            with self._lock:
+                self._reset(rooms, bookings, [row[:5] for row in classes], class_window)
+                # Replay the updates committed while the snapshot above was being read
+                journal, self._journal = self._journal, None
+                for method, args in journal:
+                    method(*args)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def refresh_if_stale(self, connection_factory):
+        """Reloads the index with a connection from `connection_factory` when it is missing or expired."""
+        if self.is_fresh():
+            return
+        conn = connection_factory()
+        cursor = conn.cursor()
+        try:
+            self.load(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    # --- Incremental updates ---
+
+    def set_booking(self, exam_id, room_ids, exam_date, start_hour, duration=None, student_group=None):
+        """Records (or moves) the active booking of an exam in one room id or a list of them."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((self.set_booking, (exam_id, room_ids, exam_date, start_hour, duration, student_group)))
+            self._unbook(exam_id)
+            if room_ids is not None and exam_date is not None and start_hour is not None:
+                self._book(exam_id, room_ids, exam_date, start_hour, duration, student_group)
+
+    def remove_booking(self, exam_id):
+        """Frees the slot held by an exam that was rejected, cancelled or deleted."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((self.remove_booking, (exam_id,)))
+            self._unbook(exam_id)
+
+    def _day(self, day):
+        index = self._day_index.get(day)
+        if index is None:
+            index = len(self._day_index)
+            self._day_index[day] = index
+            if index >= self._grid.shape[1]:
+                # Grow the day axis geometrically so bulk loads stay linear
+                extra = np.zeros((len(self._rooms), max(8, self._grid.shape[1]), SLOTS_PER_DAY), dtype=np.uint8)
+                self._grid = np.concatenate([self._grid, extra], axis=1)
+        return index
+
+    def _book(self, exam_id, room_ids, exam_date, start_hour, duration, student_group=None):
+        if isinstance(room_ids, int):
+            room_ids = [room_ids]
+        rooms = [self._room_index.get(room_id) for room_id in room_ids]
+        if None in rooms:
+            # Unknown room: the next reload will pick it up
+            self._loaded_at = None
+            rooms = [room for room in rooms if room is not None]
+        if not rooms:
+            return
+        day = _as_date(exam_date)
+        day_index = self._day(day)  # may grow (and replace) the grid
+        first, last = slot_range(start_hour, duration)
+        self._grid[rooms, day_index, first:last] += 1
+        self._bookings[exam_id] = (rooms, day, first, last, student_group)
+
+    def _unbook(self, exam_id):
+        booking = self._bookings.pop(exam_id, None)
+        if booking is not None:
+            rooms, day, first, last, _ = booking
+            self._grid[rooms, self._day_index[day], first:last] -= 1
+
+    # --- Queries ---
+
+    def _class_busy(self, day):
+        """bool rooms x slots: the rooms held by regular classes on `day`, or None."""
+        parities = class_parities(day, *self._class_window)
+        if not parities:
+            return None
+        return self._classes[list(parities), :, day.weekday(), :].any(axis=0)
+
+    def free_rooms(self, exam_date, start_hour, duration=None, min_capacity=None):
+        """Returns the rooms (id, name, capacity dicts, by name) free for the whole slot."""
+        first, last = slot_range(start_hour, duration)
+        with self._lock:
+            free = np.ones(len(self._rooms), dtype=bool)
+            day = self._day_index.get(_as_date(exam_date))
+            if day is not None:
+                free &= ~self._grid[:, day, first:last].any(axis=1)
+            classes = self._class_busy(_as_date(exam_date))
+            if classes is not None:
+                free &= ~classes[:, first:last].any(axis=1)
+            if min_capacity is not None:
+                free &= self._capacity >= int(min_capacity)
+            return [dict(self._rooms[i]) for i in np.flatnonzero(free)]
+
+    def stranded_slots(self, exam_date, start_hour, duration=None, min_run=None):
+        """
+        Returns {room_id: free slots that booking the slot would strand}: the free runs left
+        just before and after it that are shorter than `min_run` slots (by default, the
+        length of a default-duration exam), which no later exam can use.
+        """
+        first, last = slot_range(start_hour, duration)
+        min_run = min_run or slot_range(DAY_START_HOUR, DEFAULT_DURATION)[1]
+        with self._lock:
+            day = self._day_index.get(_as_date(exam_date))
+            if day is None:
+                busy = np.zeros((len(self._rooms), SLOTS_PER_DAY), dtype=bool)
+            else:
+                busy = self._grid[:, day, :] > 0
+            classes = self._class_busy(_as_date(exam_date))
+            if classes is not None:
+                busy |= classes
+            room_ids = [room['id'] for room in self._rooms]
+        slots = np.arange(SLOTS_PER_DAY)
+        # Nearest busy slot (or the day's edge) on each side of the window
+        before = np.where(busy[:, :first], slots[:first], -1).max(axis=1, initial=-1)
+        after = np.where(busy[:, last:], slots[last:], SLOTS_PER_DAY).min(axis=1, initial=SLOTS_PER_DAY)
+        left = first - before - 1
+        right = after - last
+        stranded = np.where(left < min_run, left, 0) + np.where(right < min_run, right, 0)
+        return dict(zip(room_ids, stranded.tolist()))
+
+    def busy_slots(self, days, exclude_exam_id=None):
+        """
+        Returns (rooms, busy): the rooms by name and a boolean rooms x len(days) x slots array,
+        ignoring the booking of `exclude_exam_id` (e.g. the exam being moved).
+        """
+        with self._lock:
+            rooms = [dict(room) for room in self._rooms]
+            busy = np.zeros((len(rooms), len(days), SLOTS_PER_DAY), dtype=np.int16)
+            known = [(i, self._day_index[_as_date(day)]) for i, day in enumerate(days)
+                     if _as_date(day) in self._day_index]
+            if known:
+                columns, source = zip(*known)
+                busy[:, list(columns), :] = self._grid[:, list(source), :]
+            excluded = self._bookings.get(exclude_exam_id)
+            if excluded is not None:
+                booked, day, first, last, _ = excluded
+                for i, candidate in enumerate(days):
+                    if _as_date(candidate) == day:
+                        busy[booked, i, first:last] -= 1
+            for i, day in enumerate(days):
+                classes = self._class_busy(_as_date(day))
+                if classes is not None:
+                    busy[:, i, :] += classes
+        return rooms, busy > 0
+
+    def group_buildings(self, student_group):
+        """The buildings of the rooms booked by the active exams of a student group."""
+        with self._lock:
+            rooms = {room for booking in self._bookings.values() if booking[4] == student_group for room in booking[0]}
+            return sorted({self._rooms[room]['building_name'] for room in rooms}, key=lambda name: name or '')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'days': len(self._day_index),
+                'bookings': len(self._bookings),
+                'booked_rooms': sum(len(booking[0]) for booking in self._bookings.values()),
+                'class_slots': int(self._classes.sum()),
+                'bytes': int(self._grid.nbytes + self._classes.nbytes),
+                'age_seconds': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at is not None else None,
+            }
+
+
+room_occupancy = RoomOccupancy(ttl=float(os.environ.get('OCCUPANCY_TTL', 300)))
@@ -2,15 +2,16 @@ import io
 import os
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from flask import send_file, jsonify, g
+from flask import send_file, jsonify, g, request
 from datetime import datetime
 # Import ReportLab's built-in font support
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.pdfbase.ttfonts import TTFont
+import seating
 
 # Flag to indicate if the database is available
 DB_AVAILABLE = False
@@ -235,3 +236,117 @@ def export_exams_pdf():
         if conn:
             cursor.close()
             conn.close()
+
+
+def _door_sheet_fonts():
+    """(header font, body font) with Romanian characters when a Unicode font is registered"""
+    if not UNICODE_FONT_AVAILABLE:
+        return 'Helvetica-Bold', 'Helvetica'
+    if os.path.exists('C:/Windows/Fonts/arialbd.ttf'):
+        return 'Arial-Bold', 'Arial'
+    return 'STSong-Light', 'STSong-Light'
+
+def export_door_sheets():
+    """
+    Export seating plans as PDF door sheets: one page per exam and room, listing the
+    students alphabetically with their seats. Optional filters: ?exam_id= and ?date=
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+
+    user_id = g.current_user.get('id')
+    if not user_id:
+        return jsonify({"error": "User not found in token"}), 401
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        # Verify user is SEC or ADMIN
+        cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
+        user_role = cursor.fetchone()
+        if not user_role or user_role[0] not in ['SEC', 'ADMIN']:
+            return jsonify({"error": "Unauthorized access"}), 403
+            
+        exam_id = request.args.get('exam_id')
+        exam_date = request.args.get('date')
+        try:
+            exam_id = int(exam_id) if exam_id else None
+            exam_date = datetime.strptime(exam_date, '%Y-%m-%d').date() if exam_date else None
+        except ValueError:
+            return jsonify({"error": "Invalid exam_id or date"}), 400
+            
+        cursor.execute(
+            """
+            SELECT id FROM exams
+            WHERE status = 'CONFIRMED'
+            AND (%s::int IS NULL OR id = %s::int)
+            AND (%s::date IS NULL OR exam_day = %s::date)
+            """,
+            (exam_id, exam_id, exam_date, exam_date)
+        )
+        exam_ids = [row[0] for row in cursor.fetchall()]
+        if not exam_ids:
+            return jsonify({"error": "No confirmed exams found"}), 404
+            
+        plans = seating.load_plans(cursor, exam_ids)
+        conn.commit()
+        
+        header_font, body_font = _door_sheet_fonts()
+        styles = getSampleStyleSheet()
+        title_style = ParagraphStyle('DoorTitle', parent=styles['Heading1'], alignment=1, fontName=header_font)
+        info_style = ParagraphStyle('DoorInfo', parent=styles['Normal'], alignment=1, fontName=body_font, fontSize=12, spaceAfter=12)
+        
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4)
+        elements = []
+        for plan in sorted(plans.values(), key=lambda p: (p['exam_date'] or '', p['start_hour'] or 0, p['discipline_name'] or '')):
+            for room in plan['rooms']:
+                if not room['students']:
+                    continue
+                if elements:
+                    elements.append(PageBreak())
+                building = f" ({room['building_name']})" if room['building_name'] else ''
+                elements.append(Paragraph(f"Sala {room['room_name']}{building}", title_style))
+                elements.append(Paragraph(
+                    f"{plan['discipline_name']} - grupa {plan['student_group']}<br/>"
+                    f"{plan['exam_date']}, ora {plan['start_hour']}.00", info_style))
+                
+                data = [['Nr.', 'Student', 'Loc']]
+                data += [[i, student['full_name'] or student['student_id'], student['seat']]
+                         for i, student in enumerate(room['students'], 1)]
+                table = Table(data, colWidths=[0.6 * inch, 4.4 * inch, 0.8 * inch], repeatRows=1)
+                table.setStyle(TableStyle([
+                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                    ('FONTNAME', (0, 0), (-1, 0), header_font),
+                    ('FONTNAME', (0, 1), (-1, -1), body_font),
+                    ('FONTSIZE', (0, 0), (-1, -1), 11),
+                    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+                    ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+                    ('ALIGN', (2, 0), (2, -1), 'CENTER'),
+                    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey]),
+                ]))
+                elements.append(table)
+                
+        if not elements:
+            return jsonify({"error": "The confirmed exams have no seated students"}), 404
+        doc.build(elements)
+        buffer.seek(0)
+        
+        return send_file(
+            buffer,
+            download_name=f"foi_usa_{datetime.now().strftime('%Y-%m-%d')}.pdf",
+            as_attachment=True,
+            mimetype='application/pdf'
+        )
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error exporting door sheets to PDF: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
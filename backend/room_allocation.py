@@ -0,0 +1,119 @@
+"""
+Packing a student group into the fewest free rooms of a slot.
+
+The fewest rooms that can hold a group are always the largest ones, so the number of
+rooms k is fixed by a largest-first prefix; what remains is choosing k rooms that
+leave the fewest seats empty. allocate() does that with first-fit-decreasing (take
+the largest rooms while no single room covers the remainder, then the smallest room
+that does) and, when there are at most EXACT_MAX_ROOMS candidates, checks every
+k-room combination for the one with the least waste.
+
+Seats are split over the chosen rooms largest first, so every room but the last
+one is filled to capacity.
+"""
+
+from itertools import combinations
+
+# Up to C(16, 8) = 12870 combinations for the exact search
+EXACT_MAX_ROOMS = 16
+
+
+class AllocationError(ValueError):
+    """Raised when the free rooms cannot hold the group; the message is safe to return to the client."""
+
+
+def _first_fit_decreasing(rooms, headcount):
+    remaining = headcount
+    available = sorted(rooms, key=lambda room: (-room['capacity'], room['name']))
+    chosen = []
+    while remaining > 0:
+        covering = [room for room in available if room['capacity'] >= remaining]
+        if covering:
+            chosen.append(covering[-1])  # the smallest room that holds the rest
+            break
+        room = available.pop(0)
+        chosen.append(room)
+        remaining -= room['capacity']
+    return chosen
+
+
+def _exact(rooms, headcount, count, best_waste):
+    best = None
+    for combination in combinations(rooms, count):
+        waste = sum(room['capacity'] for room in combination) - headcount
+        if 0 <= waste < best_waste:
+            best, best_waste = list(combination), waste
+            if waste == 0:
+                break
+    return best
+
+
+def allocate(rooms, headcount):
+    """
+    Returns (allocation, method) for `rooms` (dicts with id, name and capacity): a list of
+    {room_id, room_name, capacity, seats} dicts, largest room first, and 'single',
+    'first_fit_decreasing' or 'exact'.
+    """
+    rooms = [dict(room, capacity=room['capacity'] or 0) for room in rooms if room['capacity']]
+    if headcount <= 0:
+        raise AllocationError("The group has no students")
+    if sum(room['capacity'] for room in rooms) < headcount:
+        raise AllocationError(f"The free rooms hold {sum(room['capacity'] for room in rooms)} of {headcount} students")
+
+    chosen = _first_fit_decreasing(rooms, headcount)
+    method = 'single' if len(chosen) == 1 else 'first_fit_decreasing'
+    if len(chosen) > 1 and len(rooms) <= EXACT_MAX_ROOMS:
+        waste = sum(room['capacity'] for room in chosen) - headcount
+        better = _exact(rooms, headcount, len(chosen), waste)
+        if better:
+            chosen, method = better, 'exact'
+
+    return split_seats(chosen, headcount), method
+
+
+def split_seats(rooms, headcount, strict=True):
+    """
+    Spreads `headcount` students over `rooms`, filling the largest rooms first. Raises
+    AllocationError when the rooms cannot hold everyone or one of several rooms would
+    stay empty, unless `strict` is false (seating plans leave the rest unseated).
+    """
+    allocation = []
+    remaining = headcount
+    for room in sorted(rooms, key=lambda room: (-(room['capacity'] or 0), room['name'])):
+        seats = min(room['capacity'] or 0, remaining)
+        remaining -= seats
+        allocation.append({'room_id': room['id'], 'room_name': room['name'], 'capacity': room['capacity'], 'seats': seats})
+    if strict and remaining > 0:
+        raise AllocationError(f"The rooms hold {headcount - remaining} of {headcount} students")
+    if strict and len(allocation) > 1:
+        empty = [share['room_name'] for share in allocation if not share['seats']]
+        if empty:
+            raise AllocationError(f"The group fits without {', '.join(empty)}")
+    return allocation
+
+
+def save_allocation(cursor, exam_id, allocation):
+    """
+    Records the rooms and seat counts of an exam whose exams.room_id is already one of the
+    rooms of `allocation`, replacing its previous extra rooms. The exam_rooms exclusion
+    constraint rejects any room that is booked at the same time.
+    """
+    save_allocations(cursor, {exam_id: allocation})
+
+
+def save_allocations(cursor, allocations):
+    """save_allocation for {exam_id: allocation} of several exams, in two statements."""
+    exam_ids = list(allocations)
+    rows = [(exam_id, a['room_id'], a['seats']) for exam_id in exam_ids for a in allocations[exam_id]]
+    cursor.execute("DELETE FROM exam_rooms WHERE exam_id = ANY(%s::int[]) AND NOT is_primary", (exam_ids,))
+    cursor.execute(
+        """
+        INSERT INTO exam_rooms (exam_id, room_id, is_primary, seats, booked_during, active)
+        SELECT e.id, a.room_id, a.room_id = e.room_id, a.seats, e.booked_during,
+               e.booked_during IS NOT NULL AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS a(exam_id, room_id, seats)
+        JOIN exams e ON e.id = a.exam_id
+        ON CONFLICT (exam_id, room_id) DO UPDATE SET seats = EXCLUDED.seats
+        """,
+        ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows])
+    )
@@ -0,0 +1,125 @@
+"""
+Best-fit ranking of free rooms for a student group.
+
+GroupHeadcounts is a process-wide cache of how many students (STUDENT and SEF_GRUPA
+users) every group has. It is loaded with one GROUP BY and then kept current by the
+endpoints that change a user's role or group, through after_commit callbacks, so
+ranking rooms never counts users per request. A full reload still happens every
+HEADCOUNT_TTL seconds to pick up changes made outside this process.
+
+rank_rooms() orders free rooms by a cost in "wasted seats": the seats left empty,
+plus OTHER_BUILDING_PENALTY when the group's other exams are in another building,
+plus STRANDED_SLOT_WEIGHT seats per free slot the booking would strand in the room
+(weighted by capacity, so splitting the free time of a large room costs more).
+Rooms too small for the group come last.
+"""
+
+import os
+import threading
+import time
+
+COUNTED_ROLES = ('STUDENT', 'SEF_GRUPA')
+OTHER_BUILDING_PENALTY = 20.0
+STRANDED_SLOT_WEIGHT = 0.05  # times the room's capacity, per stranded slot
+
+
+class GroupHeadcounts:
+    """Thread-safe {student_group: headcount}, with per-user membership for incremental updates."""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._journal = None  # updates made while a reload is querying the database
+        self._members = {}
+        self._counts = {}
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, cursor):
+        with self._lock:
+            self._journal = []
+        try:
+            cursor.execute(
+                "SELECT id, student_group FROM users WHERE role IN ('STUDENT', 'SEF_GRUPA') AND student_group IS NOT NULL"
+            )
+            members = dict(cursor.fetchall())
+            with self._lock:
+                self._members = members
+                self._counts = {}
+                for group in members.values():
+                    self._counts[group] = self._counts.get(group, 0) + 1
+                journal, self._journal = self._journal, None
+                for args in journal:
+                    self._set(*args)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def refresh_if_stale(self, connection_factory):
+        if self.is_fresh():
+            return
+        conn = connection_factory()
+        cursor = conn.cursor()
+        try:
+            self.load(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def set_member(self, user_id, role, student_group):
+        """Records the committed role and group of a user, moving them between groups."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((user_id, role, student_group))
+            self._set(user_id, role, student_group)
+
+    def _set(self, user_id, role, student_group):
+        old = self._members.pop(user_id, None)
+        if old is not None:
+            self._counts[old] -= 1
+            if not self._counts[old]:
+                del self._counts[old]
+        if role in COUNTED_ROLES and student_group:
+            self._members[user_id] = student_group
+            self._counts[student_group] = self._counts.get(student_group, 0) + 1
+
+    def get(self, student_group):
+        with self._lock:
+            return self._counts.get(student_group, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+def rank_rooms(rooms, group_size, buildings=(), stranded=None):
+    """
+    Returns `rooms` (dicts with id, name, capacity and building_name) best fit first,
+    each with fits, seats_left, same_building and stranded_slots added.
+    """
+    stranded = stranded or {}
+    buildings = {building for building in buildings if building}
+    ranked = []
+    for room in rooms:
+        capacity = room['capacity'] or 0
+        slots = stranded.get(room['id'], 0)
+        same_building = bool(buildings) and room.get('building_name') in buildings
+        cost = capacity - group_size + slots * STRANDED_SLOT_WEIGHT * capacity
+        if buildings and not same_building:
+            cost += OTHER_BUILDING_PENALTY
+        fits = capacity >= group_size
+        ranked.append((not fits, cost if fits else -capacity, room['name'], dict(
+            room, fits=fits, seats_left=capacity - group_size, same_building=same_building, stranded_slots=slots
+        )))
+    ranked.sort(key=lambda item: item[:3])
+    return [item[3] for item in ranked]
+
+
+group_headcounts = GroupHeadcounts(ttl=float(os.environ.get('HEADCOUNT_TTL', 300)))
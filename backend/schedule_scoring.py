@@ -0,0 +1,348 @@
+"""
+Vectorized quality metrics of the exam schedule.
+
+The schedule is loaded once into flat NumPy arrays (one entry per exam, plus one
+entry per exam-teacher pair) and every metric is a sort, a bincount or a broadcast
+over those arrays, so scoring 50k exams takes about a tenth of a second:
+
+    groups    exams, minimum gap in days between consecutive exams, same-day and
+              back-to-back (consecutive calendar days) pairs
+    teachers  exams and busy days, maximum exams and minutes on one day
+    rooms     booked minutes and utilization per room and per hour of the day
+
+The penalty uses the weights of the timetable solver over consecutive exams of a
+group, so a lower penalty means a better spread schedule.
+
+Usage:
+
+    python schedule_scoring.py [--active] [--period ID] [--json]
+    python schedule_scoring.py --benchmark 50000
+"""
+
+import argparse
+import json
+import time
+from collections import namedtuple
+import numpy as np
+from conflicts import load_group_sizes
+from database import get_db_connection
+from occupancy import DAY_START_HOUR, DAY_END_HOUR, DEFAULT_DURATION
+from timetable_solver import SAME_DAY_PENALTY, MIN_GAP_DAYS, GAP_PENALTY
+
+# More exams than this on one day counts as an overloaded teacher day
+MAX_TEACHER_EXAMS_PER_DAY = 3
+
+Schedule = namedtuple('Schedule', [
+    'exam_ids',       # int64[n]
+    'day',            # int32[n], days since first_day
+    'start_hour',     # int32[n]
+    'duration',       # int32[n], minutes
+    'group',          # int32[n], index into groups
+    'group_size',     # int32[n], students in the exam's group
+    'room_exam',      # int32[k], exam index of each exam-room pair
+    'room',           # int32[k], index into rooms
+    'teacher_exam',   # int32[m], exam index of each exam-teacher pair
+    'teacher',        # int32[m], index into teachers
+    'groups',         # group names
+    'teachers',       # teacher ids
+    'rooms',          # room names
+    'capacity',       # int32[rooms]
+    'first_day',      # date of day 0, or None for an empty schedule
+])
+
+
+def _codes(values):
+    """Returns (names, int32 codes) for a list of hashable values."""
+    names, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return names.tolist(), codes.astype(np.int32)
+
+
+def build_schedule(exam_ids, days, start_hours, durations, groups, room_ids, main_teachers, second_teachers,
+                   rooms, group_sizes, first_day=None):
+    """
+    Builds a Schedule from per-exam sequences. Each entry of `room_ids` is a room id, a
+    list of room ids (exams spanning several rooms) or None. `rooms` is a list of
+    (id, name, capacity) and `group_sizes` maps group names to headcounts.
+    """
+    n = len(exam_ids)
+    group_names, group = _codes(groups) if n else ([], np.zeros(0, dtype=np.int32))
+
+    room_index = {room[0]: i for i, room in enumerate(rooms)}
+    room_pairs = [(i, room_index[room_id])
+                  for i, ids in enumerate(room_ids)
+                  for room_id in (ids if isinstance(ids, (list, tuple)) else [ids])
+                  if room_id in room_index]
+    room_exam = np.array([pair[0] for pair in room_pairs], dtype=np.int32)
+    room = np.array([pair[1] for pair in room_pairs], dtype=np.int32)
+
+    main = np.asarray(main_teachers, dtype=object)
+    second = np.asarray(second_teachers, dtype=object)
+    exam_index = np.arange(n, dtype=np.int32)
+    # One pair per distinct teacher of an exam: drop missing second teachers and duplicates
+    keep_second = (second != None) & (second != main)  # noqa: E711 (element-wise comparison)
+    keep_main = main != None  # noqa: E711
+    pair_exam = np.concatenate([exam_index[keep_main], exam_index[keep_second]])
+    pair_teacher = np.concatenate([main[keep_main], second[keep_second]])
+    teacher_names, teacher = _codes(pair_teacher) if len(pair_teacher) else ([], np.zeros(0, dtype=np.int32))
+
+    sizes = np.array([group_sizes.get(name, 0) for name in group_names] or [0], dtype=np.int32)
+    return Schedule(
+        exam_ids=np.asarray(exam_ids, dtype=np.int64),
+        day=np.asarray(days, dtype=np.int32),
+        start_hour=np.asarray(start_hours, dtype=np.int32),
+        duration=np.asarray(durations, dtype=np.int32),
+        group=group,
+        group_size=sizes[group] if n else np.zeros(0, dtype=np.int32),
+        room_exam=room_exam,
+        room=room,
+        teacher_exam=pair_exam,
+        teacher=teacher,
+        groups=group_names,
+        teachers=teacher_names,
+        rooms=[room[1] for room in rooms],
+        capacity=np.array([room[2] or 0 for room in rooms], dtype=np.int32),
+        first_day=first_day,
+    )
+
+
+def load_schedule(cursor, statuses=('CONFIRMED',), start_date=None, end_date=None):
+    """Loads the exams with the given statuses (optionally within a date range) into a Schedule."""
+    cursor.execute(
+        """
+        SELECT MIN(exam_day) FROM exams
+        WHERE status = ANY(%s) AND exam_day IS NOT NULL AND start_hour IS NOT NULL
+        AND exam_day BETWEEN COALESCE(%s::date, '-infinity') AND COALESCE(%s::date, 'infinity')
+        """,
+        (list(statuses), start_date, end_date)
+    )
+    first_day = cursor.fetchone()[0]
+    # Day offsets are computed by the database: plain integers are much cheaper to fetch than dates.
+    # exam_rooms holds every room of an exam, the primary one included
+    cursor.execute(
+        """
+        SELECT id, exam_day - %s::date, start_hour, COALESCE(duration, %s), student_group,
+               ARRAY(SELECT er.room_id FROM exam_rooms er WHERE er.exam_id = exams.id),
+               main_teacher_id, second_teacher_id
+        FROM exams
+        WHERE status = ANY(%s) AND exam_day IS NOT NULL AND start_hour IS NOT NULL
+        AND exam_day BETWEEN COALESCE(%s::date, '-infinity') AND COALESCE(%s::date, 'infinity')
+        """,
+        (first_day, DEFAULT_DURATION, list(statuses), start_date, end_date)
+    )
+    rows = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 8
+    cursor.execute("SELECT id, name, capacity FROM rooms ORDER BY name")
+    rooms = cursor.fetchall()
+    return build_schedule(*columns, rooms=rooms, group_sizes=load_group_sizes(cursor), first_day=first_day)
+
+
+def _group_metrics(schedule):
+    n_groups = len(schedule.groups)
+    order = np.lexsort((schedule.start_hour, schedule.day, schedule.group))
+    group = schedule.group[order]
+    day = schedule.day[order]
+
+    consecutive = group[1:] == group[:-1]
+    gaps = (day[1:] - day[:-1])[consecutive]
+    gap_group = group[1:][consecutive]
+
+    min_gap = np.full(n_groups, np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(min_gap, gap_group, gaps)
+    same_day = np.bincount(gap_group[gaps == 0], minlength=n_groups)
+    back_to_back = np.bincount(gap_group[gaps == 1], minlength=n_groups)
+    shortfall = np.where(gaps > 0, np.maximum(0, MIN_GAP_DAYS - gaps), 0)
+    penalty = (np.bincount(gap_group, weights=(gaps == 0) * SAME_DAY_PENALTY + shortfall * GAP_PENALTY,
+                           minlength=n_groups))
+    exams = np.bincount(schedule.group, minlength=n_groups)
+    has_gap = exams > 1
+
+    per_group = [{
+        'student_group': schedule.groups[i],
+        'exams': int(exams[i]),
+        'min_gap_days': int(min_gap[i]) if has_gap[i] else None,
+        'same_day_pairs': int(same_day[i]),
+        'back_to_back_pairs': int(back_to_back[i]),
+        'penalty': float(penalty[i]),
+    } for i in np.argsort(-penalty, kind='stable')]
+
+    summary = {
+        'groups': n_groups,
+        'min_gap_days': int(min_gap[has_gap].min()) if has_gap.any() else None,
+        'mean_min_gap_days': round(float(min_gap[has_gap].mean()), 3) if has_gap.any() else None,
+        'same_day_pairs': int(same_day.sum()),
+        'back_to_back_pairs': int(back_to_back.sum()),
+        'groups_with_same_day': int((same_day > 0).sum()),
+        'groups_with_back_to_back': int((back_to_back > 0).sum()),
+        'penalty': float(penalty.sum()),
+    }
+    return summary, per_group
+
+
+def _teacher_metrics(schedule):
+    n_teachers = len(schedule.teachers)
+    n_days = int(schedule.day.max()) + 1 if len(schedule.day) else 1
+    teacher_day = schedule.teacher.astype(np.int64) * n_days + schedule.day[schedule.teacher_exam]
+    keys, inverse, counts = np.unique(teacher_day, return_inverse=True, return_counts=True)
+    minutes = np.bincount(inverse, weights=schedule.duration[schedule.teacher_exam], minlength=len(keys))
+    key_teacher = (keys // n_days).astype(np.int32)
+
+    max_exams = np.zeros(n_teachers, dtype=np.int64)
+    np.maximum.at(max_exams, key_teacher, counts)
+    max_minutes = np.zeros(n_teachers, dtype=np.float64)
+    np.maximum.at(max_minutes, key_teacher, minutes)
+    busy_days = np.bincount(key_teacher, minlength=n_teachers)
+    exams = np.bincount(schedule.teacher, minlength=n_teachers)
+    overloaded = np.bincount(key_teacher[counts > MAX_TEACHER_EXAMS_PER_DAY], minlength=n_teachers)
+
+    per_teacher = [{
+        'teacher_id': schedule.teachers[i],
+        'exams': int(exams[i]),
+        'busy_days': int(busy_days[i]),
+        'max_exams_per_day': int(max_exams[i]),
+        'max_minutes_per_day': int(max_minutes[i]),
+        'overloaded_days': int(overloaded[i]),
+    } for i in np.lexsort((-max_minutes, -max_exams))]
+
+    summary = {
+        'teachers': n_teachers,
+        'max_exams_per_day': int(counts.max()) if len(counts) else 0,
+        'mean_exams_per_busy_day': round(float(counts.mean()), 3) if len(counts) else 0.0,
+        'overloaded_days': int((counts > MAX_TEACHER_EXAMS_PER_DAY).sum()),
+    }
+    return summary, per_teacher
+
+
+def _room_metrics(schedule):
+    n_rooms = len(schedule.rooms)
+    # Every exam-room pair books its room: a multi-room exam counts once per room
+    exam = schedule.room_exam
+    start = schedule.start_hour[exam] * 60
+    end = start + schedule.duration[exam]
+    days = len(np.unique(schedule.day[exam])) or 1
+
+    # Minutes of every booking falling in every hour of the day: a bookings x hours overlap matrix
+    hours = np.arange(DAY_START_HOUR, DAY_END_HOUR)
+    overlap = np.clip(np.minimum(end[:, np.newaxis], (hours + 1) * 60) - np.maximum(start[:, np.newaxis], hours * 60), 0, 60)
+    by_hour = overlap.sum(axis=0)
+    by_room = np.bincount(schedule.room, weights=schedule.duration[exam], minlength=n_rooms)
+    room_minutes = days * (DAY_END_HOUR - DAY_START_HOUR) * 60
+
+    # Seats of an exam are summed over all its rooms
+    n = len(schedule.exam_ids)
+    capacity = np.bincount(exam, weights=schedule.capacity[schedule.room], minlength=n)
+    placed = np.bincount(exam, minlength=n) > 0
+    group_size = schedule.group_size[placed]
+    capacity = capacity[placed]
+    seat_fill = group_size / np.maximum(capacity, 1)
+
+    summary = {
+        'rooms': n_rooms,
+        'scheduled_days': days,
+        'utilization': round(float(by_room.sum() / max(1, n_rooms * room_minutes)), 4),
+        'mean_seat_fill': round(float(seat_fill.mean()), 4) if len(seat_fill) else None,
+        'over_capacity': int((group_size > capacity).sum()),
+        'by_hour': [{
+            'hour': int(hour),
+            'booked_minutes': int(minutes),
+            'utilization': round(float(minutes / max(1, n_rooms * days * 60)), 4),
+        } for hour, minutes in zip(hours, by_hour)],
+    }
+    per_room = [{
+        'room_name': schedule.rooms[i],
+        'capacity': int(schedule.capacity[i]),
+        'booked_minutes': int(by_room[i]),
+        'utilization': round(float(by_room[i] / room_minutes), 4),
+    } for i in range(n_rooms)]
+    return summary, per_room
+
+
+def score(schedule):
+    """Returns the faculty-wide summary and the per-group, per-teacher and per-room metrics."""
+    started = time.perf_counter()
+    groups_summary, groups = _group_metrics(schedule)
+    teachers_summary, teachers = _teacher_metrics(schedule)
+    rooms_summary, rooms = _room_metrics(schedule)
+    return {
+        'exams': int(len(schedule.exam_ids)),
+        'first_day': schedule.first_day.isoformat() if schedule.first_day else None,
+        'penalty': groups_summary['penalty'],
+        'summary': {'groups': groups_summary, 'teachers': teachers_summary, 'rooms': rooms_summary},
+        'groups': groups,
+        'teachers': teachers,
+        'rooms': rooms,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def synthetic_schedule(exams, groups=None, teachers=None, rooms=None, days=25, seed=0):
+    """A random schedule of `exams` exams, for benchmarking score()."""
+    rng = np.random.default_rng(seed)
+    groups = groups or max(1, exams // 6)
+    teachers = teachers or max(2, exams // 10)
+    rooms = rooms or max(1, exams // 200)
+    main = rng.integers(0, teachers, exams)
+    return build_schedule(
+        exam_ids=np.arange(exams),
+        days=rng.integers(0, days, exams),
+        start_hours=rng.integers(8, 19, exams),
+        durations=rng.choice([120, 180], exams),
+        groups=[f'G{g}' for g in rng.integers(0, groups, exams)],
+        room_ids=rng.integers(0, rooms, exams),
+        main_teachers=[f't{t}' for t in main],
+        second_teachers=[f't{t}' for t in (main + rng.integers(1, teachers, exams)) % teachers],
+        rooms=[(i, f'R{i}', int(rng.integers(20, 150))) for i in range(rooms)],
+        group_sizes={f'G{g}': int(rng.integers(15, 35)) for g in range(groups)},
+    )
+
+
+def _print_report(report, limit=10):
+    summary = report['summary']
+    print(f"Exams: {report['exams']}  penalty: {report['penalty']:.0f}  ({report['elapsed_ms']} ms)")
+    print("Groups: " + ", ".join(f"{k}={v}" for k, v in summary['groups'].items()))
+    print("Teachers: " + ", ".join(f"{k}={v}" for k, v in summary['teachers'].items()))
+    print("Rooms: " + ", ".join(f"{k}={v}" for k, v in summary['rooms'].items() if k != 'by_hour'))
+    print("Room utilization by hour: " + " ".join(
+        f"{h['hour']}h={h['utilization']:.0%}" for h in summary['rooms']['by_hour']))
+    print(f"Worst {limit} groups:")
+    for group in report['groups'][:limit]:
+        print(f"  {group['student_group']}: {group['exams']} exams, min gap {group['min_gap_days']} days, "
+              f"{group['same_day_pairs']} same-day, {group['back_to_back_pairs']} back-to-back")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--active', action='store_true', help='score PROPOSED and ACCEPTED exams too, not only CONFIRMED')
+    parser.add_argument('--period', type=int, help='only exams of this exam period')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    parser.add_argument('--benchmark', type=int, metavar='EXAMS', help='score a random schedule instead of the database')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        schedule = synthetic_schedule(args.benchmark)
+    else:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            start_date = end_date = None
+            if args.period:
+                cursor.execute("SELECT start_date, end_date FROM exam_periods WHERE id = %s", (args.period,))
+                period = cursor.fetchone()
+                if not period:
+                    parser.error(f"exam period {args.period} not found")
+                start_date, end_date = period
+            statuses = ('PROPOSED', 'ACCEPTED', 'CONFIRMED') if args.active else ('CONFIRMED',)
+            schedule = load_schedule(cursor, statuses, start_date, end_date)
+        finally:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+
+    report = score(schedule)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == '__main__':
+    main()
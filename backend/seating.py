@@ -0,0 +1,210 @@
+"""
+Seating plans for confirmed exams.
+
+Every student of the exam's group gets a room (one of the exam's rooms, largest first,
+split as in room_allocation.split_seats) and a seat number. Seats are handed out
+odd-numbered first (1, 3, 5, ...) so that neighbours sit one seat apart, and the
+even-numbered seats are used only when a room is more than half full. The order of the
+students is a shuffle seeded from the exam id and PLAN_SEED, so regenerating an
+unchanged exam yields the same plan.
+
+A plan is stored in seating_plans as two byte strings in the order of the students' ids:
+one room index (uint8) and one seat number (uint16) per student, about three bytes per
+student. Each plan also stores a hash of its inputs (students, rooms, seed); the batch
+job regenerates only the exams whose hash changed, so after one exam changes only that
+exam is recomputed and written.
+"""
+
+import hashlib
+import time
+import numpy as np
+from room_allocation import split_seats
+
+PLAN_SEED = 2024
+NO_ROOM = 255  # room index of students that no room has a seat for
+
+
+def input_hash(exam_id, student_ids, rooms):
+    """Hash of everything a plan depends on; `rooms` are (id, capacity) pairs, largest first."""
+    digest = hashlib.md5(f"{PLAN_SEED}:{exam_id}:".encode())
+    digest.update(",".join(f"{room_id}:{capacity}" for room_id, capacity in rooms).encode())
+    digest.update(b"|")
+    digest.update("\n".join(student_ids).encode())
+    return digest.hexdigest()
+
+
+def seat_order(capacity):
+    """Seat numbers in the order they are handed out: odd seats first, then even ones."""
+    seats = np.arange(1, capacity + 1, dtype=np.uint16)
+    return np.concatenate([seats[0::2], seats[1::2]])
+
+
+def generate_plan(exam_id, student_ids, rooms):
+    """
+    Returns (room_index, seat) uint8/uint16 arrays for `student_ids` (sorted) over `rooms`,
+    a list of (id, capacity) pairs ordered largest first.
+    """
+    count = len(student_ids)
+    room_index = np.full(count, NO_ROOM, dtype=np.uint8)
+    seat = np.zeros(count, dtype=np.uint16)
+    rng = np.random.default_rng([PLAN_SEED, exam_id])
+    order = rng.permutation(count)
+
+    allocation = split_seats([{'id': i, 'name': '', 'capacity': capacity} for i, (_, capacity) in enumerate(rooms)], count, strict=False)
+    position = 0
+    for share in sorted(allocation, key=lambda share: share['room_id']):
+        students = order[position:position + share['seats']]
+        room_index[students] = share['room_id']
+        seat[students] = seat_order(share['capacity'])[:len(students)]
+        position += share['seats']
+    return room_index, seat
+
+
+def _load_inputs(cursor, exam_ids=None):
+    """Returns {exam_id: (student_group, [(room_id, capacity)], [student ids])} of confirmed exams."""
+    cursor.execute(
+        """
+        SELECT e.id, e.student_group,
+               ARRAY(SELECT r.id FROM exam_rooms er JOIN rooms r ON er.room_id = r.id
+                     WHERE er.exam_id = e.id ORDER BY r.capacity DESC, r.name),
+               ARRAY(SELECT r.capacity FROM exam_rooms er JOIN rooms r ON er.room_id = r.id
+                     WHERE er.exam_id = e.id ORDER BY r.capacity DESC, r.name)
+        FROM exams e
+        WHERE e.status = 'CONFIRMED' AND (%s::int[] IS NULL OR e.id = ANY(%s::int[]))
+        """,
+        (exam_ids, exam_ids)
+    )
+    exams = cursor.fetchall()
+    groups = list({row[1] for row in exams if row[1]})
+    students = {}
+    if groups:
+        cursor.execute(
+            """SELECT student_group, array_agg(id ORDER BY id) FROM users
+            WHERE role IN ('STUDENT', 'SEF_GRUPA') AND student_group = ANY(%s)
+            GROUP BY student_group""",
+            (groups,)
+        )
+        students = dict(cursor.fetchall())
+    return {
+        exam_id: (group, list(zip(room_ids, [c or 0 for c in capacities])), students.get(group, []))
+        for exam_id, group, room_ids, capacities in exams
+    }
+
+
+def regenerate(cursor, exam_ids=None, force=False):
+    """
+    Brings the plans of the confirmed exams (or of `exam_ids`) up to date and drops the
+    plans of exams that are no longer confirmed. Only plans whose inputs changed are
+    recomputed, unless `force` is set. The caller commits.
+    """
+    started = time.perf_counter()
+    inputs = _load_inputs(cursor, exam_ids)
+    cursor.execute(
+        "SELECT exam_id, input_hash FROM seating_plans WHERE %s::int[] IS NULL OR exam_id = ANY(%s::int[])",
+        (exam_ids, exam_ids)
+    )
+    stored = dict(cursor.fetchall())
+
+    rows = []
+    for exam_id, (_, rooms, student_ids) in inputs.items():
+        digest = input_hash(exam_id, student_ids, rooms)
+        if not force and stored.get(exam_id) == digest:
+            continue
+        room_index, seat = generate_plan(exam_id, student_ids, rooms)
+        rows.append((exam_id, digest, [room_id for room_id, _ in rooms], room_index.tobytes(), seat.tobytes()))
+
+    if rows:
+        columns = list(zip(*rows))
+        # Room id lists differ in length, so they travel as text and are split back in SQL
+        cursor.execute(
+            """
+            INSERT INTO seating_plans (exam_id, input_hash, room_ids, rooms, seats, generated_at)
+            SELECT p.exam_id, p.input_hash, string_to_array(p.room_ids, ',')::int[], p.rooms, p.seats, CURRENT_TIMESTAMP
+            FROM unnest(%s::int[], %s::text[], %s::text[], %s::bytea[], %s::bytea[])
+                 AS p(exam_id, input_hash, room_ids, rooms, seats)
+            ON CONFLICT (exam_id) DO UPDATE
+            SET input_hash = EXCLUDED.input_hash, room_ids = EXCLUDED.room_ids, rooms = EXCLUDED.rooms,
+                seats = EXCLUDED.seats, generated_at = EXCLUDED.generated_at
+            """,
+            (list(columns[0]), list(columns[1]), [",".join(map(str, ids)) for ids in columns[2]],
+             list(columns[3]), list(columns[4]))
+        )
+
+    stale = [exam_id for exam_id in stored if exam_id not in inputs]
+    if stale:
+        cursor.execute("DELETE FROM seating_plans WHERE exam_id = ANY(%s)", (stale,))
+
+    return {
+        'exams': len(inputs),
+        'students': sum(len(student_ids) for _, _, student_ids in inputs.values()),
+        'generated': len(rows),
+        'unchanged': len(inputs) - len(rows),
+        'removed': len(stale),
+        'bytes': sum(len(row[3]) + len(row[4]) for row in rows),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def load_plans(cursor, exam_ids):
+    """
+    Returns {exam_id: plan} for the given confirmed exams, regenerating stale plans first.
+    A plan is a dict with the exam's details and its rooms, each with the students
+    (student_id, full_name, seat) sorted by name; students without a seat are listed
+    under 'unseated'.
+    """
+    regenerate(cursor, exam_ids)
+    cursor.execute(
+        """
+        SELECT p.exam_id, p.room_ids, p.rooms, p.seats, e.student_group, e.exam_date, e.start_hour,
+               d.name, p.generated_at
+        FROM seating_plans p
+        JOIN exams e ON p.exam_id = e.id
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE p.exam_id = ANY(%s)
+        ORDER BY e.exam_date, e.start_hour, d.name
+        """,
+        (exam_ids,)
+    )
+    rows = cursor.fetchall()
+    groups = list({row[4] for row in rows if row[4]})
+    students, rooms = {}, {}
+    if groups:
+        cursor.execute(
+            """SELECT student_group, array_agg(id ORDER BY id), array_agg(full_name ORDER BY id) FROM users
+            WHERE role IN ('STUDENT', 'SEF_GRUPA') AND student_group = ANY(%s)
+            GROUP BY student_group""",
+            (groups,)
+        )
+        students = {group: list(zip(ids, names)) for group, ids, names in cursor.fetchall()}
+        cursor.execute("SELECT id, name, building_name FROM rooms")
+        rooms = {row[0]: row[1:] for row in cursor.fetchall()}
+
+    plans = {}
+    for exam_id, room_ids, room_bytes, seat_bytes, group, exam_date, start_hour, discipline, generated_at in rows:
+        room_index = np.frombuffer(bytes(room_bytes), dtype=np.uint8)
+        seat = np.frombuffer(bytes(seat_bytes), dtype=np.uint16)
+        members = students.get(group, [])
+        by_room = [[] for _ in room_ids]
+        unseated = []
+        for (student_id, full_name), index, number in zip(members, room_index.tolist(), seat.tolist()):
+            entry = {'student_id': student_id, 'full_name': full_name, 'seat': number}
+            if index == NO_ROOM:
+                unseated.append(entry)
+            else:
+                by_room[index].append(entry)
+        plans[exam_id] = {
+            'exam_id': exam_id,
+            'discipline_name': discipline,
+            'student_group': group,
+            'exam_date': exam_date.strftime('%Y-%m-%d') if exam_date else None,
+            'start_hour': start_hour,
+            'generated_at': generated_at.isoformat() if generated_at else None,
+            'rooms': [{
+                'room_id': room_id,
+                'room_name': rooms.get(room_id, (None, None))[0],
+                'building_name': rooms.get(room_id, (None, None))[1],
+                'students': sorted(entries, key=lambda entry: (entry['full_name'] or '', entry['student_id'])),
+            } for room_id, entries in zip(room_ids, by_room)],
+            'unseated': unseated,
+        }
+    return plans
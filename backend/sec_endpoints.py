@@ -4,8 +4,18 @@ These endpoints will be imported into the main app.py file.
 """
 
 from flask import jsonify, request, g
-from database import get_db_connection
+from database import get_db_connection, after_commit, pg_error_code, EXCLUSION_VIOLATION
 from auth import token_required
+from occupancy import room_occupancy
+from teacher_availability import teacher_availability
+from class_timetable import class_timetable, import_classes, fetch_snapshot
+import timetable_solver
+import simulation
+from conflicts import schedule_report
+import schedule_scoring
+import seating
+import invigilators
+import student_conflicts
 import pandas as pd
 from io import BytesIO
 import datetime
@@ -57,16 +67,8 @@ def create_exam():
         if not cursor.fetchone():
             return jsonify({"error": f"Room with ID {data['room_id']} not found"}), 404
                 
-        # Check if an exam for this discipline and group already exists
-        cursor.execute(
-            """SELECT id FROM exams 
-            WHERE discipline_id = %s AND student_group = %s""",
-            (data['discipline_id'], data['student_group'])
-        )
-        if cursor.fetchone():
-            return jsonify({"error": "An exam for this discipline and student group already exists"}), 409
-            
-        # Insert the new exam
+        # Insert the new exam; the (discipline_id, student_group) unique constraint
+        # rejects duplicates atomically instead of a separate existence check
         cursor.execute(
             """
             INSERT INTO exams (
@@ -75,6 +77,7 @@ def create_exam():
                 created_by, created_at, room_id
             )
             VALUES (%s, %s, %s, %s, %s, 'DRAFT', %s, CURRENT_TIMESTAMP, %s)
+            ON CONFLICT ON CONSTRAINT exams_discipline_group_key DO NOTHING
             RETURNING id
             """,
             (
@@ -83,7 +86,10 @@ def create_exam():
                 data['room_id']
             )
         )
-        new_exam_id = cursor.fetchone()[0]
+        inserted = cursor.fetchone()
+        if not inserted:
+            return jsonify({"error": "An exam for this discipline and student group already exists"}), 409
+        new_exam_id = inserted[0]
         conn.commit()
         
         return jsonify({
@@ -283,6 +289,18 @@ def export_exams_excel():
                     len(str(col))  # length of column name
                 ) + 2  # adding a little extra space
                 worksheet.set_column(i, i, max_len)
+            
+            # Conflicts of the whole active schedule, next to the confirmed exams
+            class_timetable.refresh_if_stale(get_db_connection)
+            conflicts_df = pd.DataFrame(_conflict_rows(*schedule_report(cursor)), columns=list(CONFLICT_COLUMNS.values()))
+            conflicts_df.to_excel(writer, sheet_name='Conflicte', index=False, startrow=1)
+            conflicts_sheet = writer.sheets['Conflicte']
+            conflicts_sheet.merge_range('A1:E1', 'Conflicte în programare', title_format)
+            for col_num, value in enumerate(conflicts_df.columns.values):
+                conflicts_sheet.write(1, col_num, value, header_format)
+            for i, col in enumerate(conflicts_df.columns):
+                max_len = max(conflicts_df[col].astype(str).map(len).max() if not conflicts_df.empty else 0, len(col)) + 2
+                conflicts_sheet.set_column(i, i, min(max_len, 80))
         
         output.seek(0)
         
@@ -300,6 +318,86 @@ def export_exams_excel():
             cursor.close()
             conn.close()
 
+# Excel columns of the conflicts sheet
+CONFLICT_COLUMNS = {
+    'type': 'Tip conflict',
+    'resource': 'Resursă',
+    'detail': 'Detalii',
+    'exam_ids': 'ID examene',
+    'exams': 'Examene',
+}
+
+CONFLICT_LABELS = {
+    'room': 'Sală ocupată de două ori',
+    'teacher': 'Profesor suprapus',
+    'group': 'Grupă suprapusă',
+    'same_day': 'Grupă cu mai multe examene în aceeași zi',
+    'capacity': 'Capacitate sală insuficientă',
+    'class': 'Suprapus cu ore de curs',
+    'outside_period': 'În afara sesiunii active',
+}
+
+def _conflict_rows(exams, problems):
+    """Flattens schedule_report() problems into rows for the conflicts sheet"""
+    rows = []
+    for problem in problems:
+        described = [exams[exam_id] for exam_id in problem['exam_ids']]
+        resource = problem['resource']
+        if problem['type'] in ('room', 'capacity') and described:
+            resource = described[0]['room_name']
+        rows.append([
+            CONFLICT_LABELS.get(problem['type'], problem['type']),
+            resource if resource is not None else '',
+            problem['detail'],
+            ', '.join(str(exam_id) for exam_id in problem['exam_ids']),
+            '; '.join(f"{exam['discipline_name']} ({exam['student_group']}, {exam['exam_day'].strftime('%Y-%m-%d')} {exam['start_hour']}.00)"
+                      for exam in described),
+        ])
+    return rows
+
+@token_required
+def get_schedule_conflicts():
+    """SEC checks the whole active schedule for overlaps, capacity shortfalls, clashes with classes and out-of-period exams"""
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can view schedule conflicts"}), 403
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        class_timetable.refresh_if_stale(get_db_connection)
+        exams, problems = schedule_report(cursor)
+        summary = {kind: 0 for kind in CONFLICT_LABELS}
+        for problem in problems:
+            summary[problem['type']] += 1
+            problem['exams'] = [{
+                "id": exam_id,
+                "discipline_name": exams[exam_id]['discipline_name'],
+                "student_group": exams[exam_id]['student_group'],
+                "exam_date": exams[exam_id]['exam_day'].strftime('%Y-%m-%d'),
+                "start_hour": exams[exam_id]['start_hour'],
+                "duration": exams[exam_id]['duration'],
+                "room_name": exams[exam_id]['room_name'],
+                "status": exams[exam_id]['status'],
+            } for exam_id in problem['exam_ids']]
+            
+        return jsonify({
+            "checked_exams": len(exams),
+            "summary": summary,
+            "conflicts": problems
+        }), 200
+    except Exception as e:
+        print(f"Error building conflict report: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
 @token_required
 def manage_exam_periods():
     """SEC creates or updates exam periods"""
@@ -549,3 +647,591 @@ def get_sec_teachers():
         if conn:
             cursor.close()
             conn.close()
+
+@token_required
+def solve_timetable():
+    """
+    SEC runs the timetable solver over every DRAFT exam for an exam period and, unless
+    dry_run is set, writes the assignment as PROPOSED in a single transaction
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can run the timetable solver"}), 403
+        
+    data = request.get_json() or {}
+    period_id = data.get('period_id')
+    if not period_id:
+        return jsonify({"error": "period_id is required"}), 400
+    try:
+        restarts = int(data.get('restarts', 4))
+        time_limit = float(data.get('time_limit', 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "restarts and time_limit must be numbers"}), 400
+    if not (1 <= restarts <= 16) or not (0 < time_limit <= 60):
+        return jsonify({"error": "restarts must be between 1 and 16 and time_limit (for the whole run) between 0 and 60 seconds"}), 400
+    dry_run = bool(data.get('dry_run', False))
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found"}), 404
+            
+        teacher_availability.refresh_if_stale(get_db_connection)
+        class_timetable.refresh_if_stale(get_db_connection)
+        problem = timetable_solver.load_problem(cursor, period[2], period[3])
+        # End the read transaction so the connection does not sit idle in it while the
+        # solver runs; apply_solution re-checks every exam it writes
+        conn.rollback()
+        if not problem.days:
+            return jsonify({"error": "The exam period has no weekdays left to schedule"}), 400
+            
+        report = timetable_solver.solve(problem, restarts=restarts, time_limit=time_limit)
+        report['period'] = {"id": period[0], "name": period[1]}
+        report['applied'] = False
+        
+        assignments = report['assignments']
+        if not dry_run and assignments:
+            try:
+                stale = timetable_solver.apply_solution(cursor, assignments)
+            except Exception as e:
+                if pg_error_code(e) != EXCLUSION_VIOLATION:
+                    raise
+                conn.rollback()
+                return jsonify({"error": "A room was booked while the solver was running; run it again"}), 409
+            if stale:
+                conn.rollback()
+                return jsonify({
+                    "error": "Some exams changed while the solver was running; run it again",
+                    "exam_ids": stale
+                }), 409
+            conn.commit()
+            report['applied'] = True
+            after_commit(lambda: [
+                room_occupancy.set_booking(a['exam_id'], a['room_id'], a['date'], a['start_hour'], a['duration'], a['student_group'])
+                for a in assignments
+            ])
+            
+        return jsonify(report), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error running timetable solver: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def simulate_schedule():
+    """
+    SEC evaluates hypothetical changes (moves, room closures, cancellations) against the
+    current schedule of an exam period, without writing anything
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can run simulations"}), 403
+        
+    data = request.get_json() or {}
+    scenarios = data.get('scenarios')
+    if scenarios is None:
+        scenarios = [{"name": data.get('name'), "operations": data.get('operations')}]
+    if not isinstance(scenarios, list) or not scenarios or len(scenarios) > simulation.MAX_SCENARIOS:
+        return jsonify({"error": f"scenarios must be a list of 1 to {simulation.MAX_SCENARIOS} items"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        if data.get('period_id'):
+            cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s", (data['period_id'],))
+        else:
+            cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE is_active = TRUE ORDER BY start_date DESC LIMIT 1")
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found"}), 404
+            
+        model = simulation.load_model(cursor, period[2], period[3])
+        conn.rollback()
+        
+        results = []
+        for i, scenario in enumerate(scenarios):
+            if not isinstance(scenario, dict):
+                return jsonify({"error": f"Scenario {i + 1} must be an object"}), 400
+            try:
+                results.append(simulation.simulate(model, scenario.get('operations'), name=scenario.get('name')))
+            except simulation.SimulationError as e:
+                return jsonify({"error": f"Scenario {i + 1}: {e}"}), 400
+                
+        return jsonify({
+            "period": {"id": period[0], "name": period[1]},
+            "baseline": {
+                "exams": len(model.exams),
+                "conflicts": len(model.baseline['conflicts']),
+                "unplaced": len(model.baseline['unplaced']),
+            },
+            "scenarios": results
+        }), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error running schedule simulation: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def get_schedule_score():
+    """
+    SEC gets the quality metrics of the confirmed schedule (or of every active exam with
+    ?include=active), optionally limited to one exam period
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can score the schedule"}), 403
+        
+    include = request.args.get('include', 'confirmed')
+    if include not in ['confirmed', 'active']:
+        return jsonify({"error": "include must be 'confirmed' or 'active'"}), 400
+    statuses = ('PROPOSED', 'ACCEPTED', 'CONFIRMED') if include == 'active' else ('CONFIRMED',)
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        start_date = end_date = None
+        period_id = request.args.get('period_id')
+        if period_id:
+            cursor.execute("SELECT start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+            period = cursor.fetchone()
+            if not period:
+                return jsonify({"error": "Exam period not found"}), 404
+            start_date, end_date = period
+            
+        schedule = schedule_scoring.load_schedule(cursor, statuses, start_date, end_date)
+        return jsonify(schedule_scoring.score(schedule)), 200
+    except Exception as e:
+        print(f"Error scoring schedule: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def generate_seating_plans():
+    """
+    SEC (re)generates the seating plans of the confirmed exams, or of exam_ids; plans whose
+    students and rooms did not change are kept unless force is set
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can generate seating plans"}), 403
+        
+    data = request.get_json(silent=True) or {}
+    exam_ids = data.get('exam_ids')
+    if exam_ids is not None and (not isinstance(exam_ids, list) or not all(isinstance(i, int) for i in exam_ids)):
+        return jsonify({"error": "exam_ids must be a list of exam ids"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        report = seating.regenerate(cursor, exam_ids, force=bool(data.get('force', False)))
+        conn.commit()
+        return jsonify(report), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error generating seating plans: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def get_seating_plan(exam_id):
+    """SEC gets the seating plan of a confirmed exam, by room"""
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can view seating plans"}), 403
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        plan = seating.load_plans(cursor, [exam_id]).get(exam_id)
+        conn.commit()
+        if not plan:
+            return jsonify({"error": "Exam not found or not confirmed"}), 404
+        return jsonify(plan), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error fetching seating plan: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def plan_invigilators():
+    """
+    SEC computes a balanced assignment of second teachers for the scheduled exams of an
+    exam period (or of exam_ids within it) and gets the diff against the current one;
+    nothing is written
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can plan invigilators"}), 403
+        
+    data = request.get_json(silent=True) or {}
+    period_id = data.get('period_id')
+    if not period_id:
+        return jsonify({"error": "period_id is required"}), 400
+    exam_ids = data.get('exam_ids')
+    if exam_ids is not None and (not isinstance(exam_ids, list) or not all(isinstance(i, int) for i in exam_ids)):
+        return jsonify({"error": "exam_ids must be a list of exam ids"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found"}), 404
+            
+        teacher_availability.refresh_if_stale(get_db_connection)
+        class_timetable.refresh_if_stale(get_db_connection)
+        problem = invigilators.load_problem(cursor, period[2], period[3], exam_ids)
+        report = invigilators.plan(problem)
+        report['period'] = {"id": period[0], "name": period[1]}
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Error planning invigilators: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def apply_invigilators():
+    """
+    SEC applies the changes of an invigilator plan ({exam_id, from_teacher_id,
+    to_teacher_id} each) in a single transaction; nothing is written if any exam changed
+    since the plan was made
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can assign invigilators"}), 403
+        
+    data = request.get_json(silent=True) or {}
+    changes = data.get('changes')
+    if not isinstance(changes, list) or not changes:
+        return jsonify({"error": "changes must be a non-empty list"}), 400
+    for change in changes:
+        if (not isinstance(change, dict) or not isinstance(change.get('exam_id'), int)
+                or not change.get('to_teacher_id')):
+            return jsonify({"error": "Every change needs exam_id, from_teacher_id and to_teacher_id"}), 400
+    if len({change['exam_id'] for change in changes}) != len(changes):
+        return jsonify({"error": "Every exam may appear only once in changes"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        stale, clashes = invigilators.apply_changes(cursor, changes)
+        if stale:
+            conn.rollback()
+            return jsonify({
+                "error": "Some exams changed since the plan was made; plan again",
+                "exam_ids": stale
+            }), 409
+        if clashes:
+            conn.rollback()
+            return jsonify({
+                "error": "Some teachers now supervise another exam at the same time; plan again",
+                "exam_ids": clashes
+            }), 409
+        conn.commit()
+        return jsonify({"applied": len(changes)}), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error applying invigilator plan: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def import_class_timetable():
+    """
+    SEC replaces the weekly class timetable with the classes of a snapshot (the output of
+    `class_timetable.py fetch`) or, when none is sent, with a fresh copy from
+    CLASS_TIMETABLE_URL; valid_from/valid_to bound the teaching weeks
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can import the class timetable"}), 403
+        
+    data = request.get_json(silent=True) or {}
+    try:
+        valid_from = datetime.date.fromisoformat(data['valid_from']) if data.get('valid_from') else None
+        valid_to = datetime.date.fromisoformat(data['valid_to']) if data.get('valid_to') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "valid_from and valid_to must be dates (YYYY-MM-DD)"}), 400
+    if valid_from and valid_to and valid_from > valid_to:
+        return jsonify({"error": "valid_from must not be after valid_to"}), 400
+    snapshot = data.get('snapshot')
+    classes = snapshot.get('classes') if isinstance(snapshot, dict) else data.get('classes')
+    if classes is not None and not isinstance(classes, list):
+        return jsonify({"error": "classes must be a list"}), 400
+        
+    conn = None
+    try:
+        if classes is None:
+            try:
+                classes = fetch_snapshot()['classes']
+            except Exception as e:
+                print(f"Error fetching the class timetable: {e}")
+                return jsonify({"error": "The timetable source could not be read"}), 502
+                
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        report = import_classes(cursor, classes, valid_from, valid_to)
+        conn.commit()
+        after_commit(lambda: (class_timetable.invalidate(), room_occupancy.invalidate()))
+        return jsonify(report), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error importing the class timetable: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def get_student_conflicts():
+    """
+    SEC gets every student with overlapping or same-day exams in the confirmed schedule (or
+    among every active exam with ?include=active), counting retakes and optional
+    disciplines; ?limit bounds the students listed (the summary always counts them all)
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can check student conflicts"}), 403
+        
+    include = request.args.get('include', 'confirmed')
+    if include not in ['confirmed', 'active']:
+        return jsonify({"error": "include must be 'confirmed' or 'active'"}), 400
+    statuses = ('PROPOSED', 'ACCEPTED', 'CONFIRMED') if include == 'active' else ('CONFIRMED',)
+    try:
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        start_date = end_date = None
+        period_id = request.args.get('period_id')
+        if period_id:
+            cursor.execute("SELECT start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+            period = cursor.fetchone()
+            if not period:
+                return jsonify({"error": "Exam period not found"}), 404
+            start_date, end_date = period
+            
+        roster = student_conflicts.load_roster(cursor, statuses, start_date, end_date)
+        report = student_conflicts.check(roster)
+        report['truncated'] = len(report['students']) > max(limit, 0)
+        report['students'] = report['students'][:max(limit, 0)]
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"Error checking student conflicts: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def get_enrollments():
+    """SEC lists the enrollments (retakes and optional disciplines), optionally of one discipline or student"""
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can view enrollments"}), 403
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """
+            SELECT en.student_id, u.full_name, u.student_group, en.discipline_id, d.name,
+                   en.student_group, en.kind
+            FROM enrollments en
+            JOIN users u ON en.student_id = u.id
+            JOIN disciplines d ON en.discipline_id = d.id
+            WHERE (%s::int IS NULL OR en.discipline_id = %s::int)
+            AND (%s::text IS NULL OR en.student_id = %s::text)
+            ORDER BY d.name, en.student_group, u.full_name
+            """,
+            (
+                request.args.get('discipline_id'), request.args.get('discipline_id'),
+                request.args.get('student_id'), request.args.get('student_id'),
+            )
+        )
+        
+        enrollments = []
+        for row in cursor.fetchall():
+            enrollments.append({
+                'student_id': row[0],
+                'student_name': row[1],
+                'own_group': row[2],
+                'discipline_id': row[3],
+                'discipline_name': row[4],
+                'student_group': row[5],
+                'kind': row[6],
+            })
+            
+        return jsonify(enrollments), 200
+    except Exception as e:
+        print(f"Error fetching enrollments: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+@token_required
+def update_enrollments():
+    """
+    SEC adds or updates enrollments ({student_id, discipline_id, student_group, kind}) and
+    removes others ({student_id, discipline_id}) in one transaction
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') not in ['SEC', 'ADM']:
+        return jsonify({"error": "Only SEC or ADM can manage enrollments"}), 403
+        
+    data = request.get_json(silent=True) or {}
+    upserts = data.get('enrollments', [])
+    removals = data.get('remove', [])
+    if not isinstance(upserts, list) or not isinstance(removals, list):
+        return jsonify({"error": "enrollments and remove must be lists"}), 400
+    for i, item in enumerate(upserts):
+        if not isinstance(item, dict) or not item.get('student_id') or not isinstance(item.get('discipline_id'), int) or not item.get('student_group'):
+            return jsonify({"error": f"Enrollment {i + 1} needs student_id, discipline_id and student_group"}), 400
+        if item.get('kind', 'RETAKE') not in ['RETAKE', 'OPTIONAL']:
+            return jsonify({"error": f"Enrollment {i + 1}: kind must be 'RETAKE' or 'OPTIONAL'"}), 400
+    for i, item in enumerate(removals):
+        if not isinstance(item, dict) or not item.get('student_id') or not isinstance(item.get('discipline_id'), int):
+            return jsonify({"error": f"Removal {i + 1} needs student_id and discipline_id"}), 400
+    # The last entry wins when a student and discipline are listed twice
+    upserts = list({(u['student_id'], u['discipline_id']): u for u in upserts}.values())
+            
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        removed = 0
+        if removals:
+            cursor.execute(
+                """
+                DELETE FROM enrollments en
+                USING unnest(%s::text[], %s::int[]) AS r(student_id, discipline_id)
+                WHERE en.student_id = r.student_id AND en.discipline_id = r.discipline_id
+                """,
+                ([r['student_id'] for r in removals], [r['discipline_id'] for r in removals])
+            )
+            removed = cursor.rowcount
+            
+        saved = 0
+        if upserts:
+            cursor.execute(
+                """
+                INSERT INTO enrollments (student_id, discipline_id, student_group, kind)
+                SELECT u.id, d.id, e.student_group, e.kind
+                FROM unnest(%s::text[], %s::int[], %s::text[], %s::text[]) AS e(student_id, discipline_id, student_group, kind)
+                JOIN users u ON u.id = e.student_id AND u.role IN ('STUDENT', 'SEF_GRUPA')
+                JOIN disciplines d ON d.id = e.discipline_id
+                ON CONFLICT (student_id, discipline_id)
+                DO UPDATE SET student_group = EXCLUDED.student_group, kind = EXCLUDED.kind
+                RETURNING student_id, discipline_id
+                """,
+                (
+                    [u['student_id'] for u in upserts],
+                    [u['discipline_id'] for u in upserts],
+                    [u['student_group'] for u in upserts],
+                    [u.get('kind', 'RETAKE') for u in upserts],
+                )
+            )
+            saved_keys = {(row[0], row[1]) for row in cursor.fetchall()}
+            saved = len(saved_keys)
+            unknown = [u for u in upserts if (u['student_id'], u['discipline_id']) not in saved_keys]
+            if unknown:
+                conn.rollback()
+                return jsonify({
+                    "error": "Unknown student or discipline",
+                    "enrollments": [{'student_id': u['student_id'], 'discipline_id': u['discipline_id']} for u in unknown],
+                }), 400
+                
+        conn.commit()
+        return jsonify({"saved": saved, "removed": removed}), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error updating enrollments: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
@@ -3,11 +3,19 @@ Group Leader (SG) role endpoints for the exam scheduling system.
 These endpoints will be imported into the main app.py file.
 """
 
-from flask import jsonify, request, g
+from flask import jsonify, request, g, Response
+import hashlib
 import logging
-from database import get_db_connection
+import numpy as np
+from database import get_db_connection, after_commit, pg_error_code, EXCLUSION_VIOLATION
+from conflicts import find_conflicts, load_index, exam_interval
+from occupancy import room_occupancy, slot_range, class_parities, DAY_START_HOUR, DAY_END_HOUR, SLOT_MINUTES, SLOTS_PER_DAY
+from room_ranking import group_headcounts, rank_rooms
+from room_allocation import allocate, split_seats, save_allocation, save_allocations, AllocationError
+from teacher_availability import teacher_availability, unavailable_teachers
+from class_timetable import class_timetable, class_conflicts
 from auth import token_required
-from datetime import datetime
+from datetime import datetime, date, timedelta
 # Import DB_AVAILABLE from app.py when this module is imported
 DB_AVAILABLE = None
 
@@ -78,7 +86,7 @@ def get_sg_exams():
 
 @token_required
 def get_available_rooms():
-    """Get available rooms for a specific date and time"""
+    """Get available rooms for a specific date and time, best fit for the leader's group first"""
     if not DB_AVAILABLE:
         return jsonify({"error": "Database not available"}), 500
         
@@ -89,6 +97,8 @@ def get_available_rooms():
         
     date = request.args.get('date')
     hour = request.args.get('hour')
+    duration = request.args.get('duration', 120)
+    min_capacity = request.args.get('min_capacity')
     
     if not all([date, hour]):
         return jsonify({"error": "Date and hour are required"}), 400
@@ -102,47 +112,42 @@ def get_available_rooms():
         hour_int = int(hour)
         if not (8 <= hour_int <= 20):
             return jsonify({"error": "Hour must be between 8 and 20"}), 400
+        duration_int = int(duration)
+        if duration_int <= 0:
+            return jsonify({"error": "Duration must be a positive number of minutes"}), 400
+        min_capacity_int = int(min_capacity) if min_capacity else None
     except ValueError:
         return jsonify({"error": "Invalid date or hour format"}), 400
         
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get all rooms
-        cursor.execute("SELECT id, name, capacity FROM rooms ORDER BY name")
-        all_rooms = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        all_rooms_dict = [dict(zip(columns, row)) for row in all_rooms]
-        
-        # Get rooms that are already booked for the given date and hour
-        cursor.execute(
-            """
-            SELECT room_id FROM exams 
-            WHERE exam_date::date = %s::date 
-            AND start_hour = %s 
-            AND room_id IS NOT NULL
-            AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
-            """,
-            (date, hour_int)
-        )
-        booked_room_ids = [row[0] for row in cursor.fetchall()]
+        # Answered from the in-memory occupancy index; the database is only read when it expires
+        room_occupancy.refresh_if_stale(get_db_connection)
+        available_rooms = room_occupancy.free_rooms(date_obj, hour_int, duration_int, min_capacity_int)
         
-        # Filter out booked rooms
-        available_rooms = [room for room in all_rooms_dict if room['id'] not in booked_room_ids]
+        # Best fit for the leader's group first, from cached headcounts and the buildings of
+        # the group's other bookings in the occupancy index
+        student_group = g.current_user.get('student_group')
+        if student_group:
+            group_headcounts.refresh_if_stale(get_db_connection)
+            available_rooms = rank_rooms(
+                available_rooms,
+                group_headcounts.get(student_group),
+                room_occupancy.group_buildings(student_group),
+                room_occupancy.stranded_slots(date_obj, hour_int, duration_int)
+            )
         
         return jsonify(available_rooms), 200
     except Exception as e:
         print(f"Error fetching available rooms: {e}")
         return jsonify({"error": "An internal error occurred"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @token_required
 def propose_exam_schedule(exam_id):
-    """Group leader proposes a date, time, and room for an exam"""
+    """
+    Group leader proposes a date, time, and room for an exam. Groups that do not fit one
+    room can send room_ids instead of room_id: the first room becomes exams.room_id and
+    the students are split over all of them, largest room first.
+    """
     if not DB_AVAILABLE:
         return jsonify({"error": "Database not available"}), 500
         
@@ -157,12 +162,14 @@ def propose_exam_schedule(exam_id):
     data = request.get_json()
     exam_date = data.get('exam_date')
     start_hour = data.get('start_hour')
-    room_id = data.get('room_id')
+    room_ids = data.get('room_ids') or ([data['room_id']] if data.get('room_id') else [])
     
-    if not all([exam_date, start_hour, room_id]):
+    if not all([exam_date, start_hour, room_ids]):
         return jsonify({"error": "Exam date, start hour, and room ID are required"}), 400
         
     try:
+        room_ids = list(dict.fromkeys(int(rid) for rid in (room_ids if isinstance(room_ids, list) else [room_ids])))
+        room_id = room_ids[0]
         # Validate hour range (8-20)
         start_hour_int = int(start_hour)
         if not (8 <= start_hour_int <= 20):
@@ -172,62 +179,106 @@ def propose_exam_schedule(exam_id):
         exam_date_obj = datetime.strptime(exam_date, '%Y-%m-%d')
         if exam_date_obj.weekday() >= 5:  # 5=Saturday, 6=Sunday
             return jsonify({"error": "Exams can only be scheduled on weekdays (Monday to Friday)"}), 400
-    except ValueError:
-        return jsonify({"error": "Invalid date or hour format"}), 400
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid date, hour or room format"}), 400
         
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Check if exam exists and belongs to the group leader's group
-        cursor.execute(
-            "SELECT status FROM exams WHERE id = %s AND student_group = %s",
-            (exam_id, student_group)
-        )
-        exam = cursor.fetchone()
-        if not exam:
-            return jsonify({"error": "Exam not found or does not belong to your group"}), 404
-            
-        # Check if exam is in a state that can be proposed (DRAFT, REJECTED, or CANCELLED)
-        status = exam[0]
-        if status not in ['DRAFT', 'REJECTED', 'CANCELLED']:
-            return jsonify({"error": f"Cannot propose schedule for exam in {status} status"}), 400
+        # Book the slot in a single statement. The exclusion constraints on (room_id, booked_during)
+        # reject an overlapping active booking atomically, so there is no check-then-update race.
+        # Extra rooms of an earlier proposal are dropped first so they do not move with the exam
+        try:
+            cursor.execute(
+                """
+                DELETE FROM exam_rooms er USING exams e
+                WHERE er.exam_id = e.id AND NOT er.is_primary
+                AND e.id = %s AND e.student_group = %s AND e.status IN ('DRAFT', 'REJECTED', 'CANCELLED')
+                """,
+                (exam_id, student_group)
+            )
+            cursor.execute(
+                """
+                UPDATE exams 
+                SET exam_date = %s, start_hour = %s, room_id = %s, status = 'PROPOSED', updated_at = CURRENT_TIMESTAMP 
+                WHERE id = %s AND student_group = %s
+                AND status IN ('DRAFT', 'REJECTED', 'CANCELLED')
+                RETURNING id, discipline_id, exam_date, start_hour, room_id, status,
+                          duration, main_teacher_id, second_teacher_id, student_group
+                """,
+                (exam_date, start_hour_int, room_id, exam_id, student_group)
+            )
+        except Exception as e:
+            if pg_error_code(e) != EXCLUSION_VIOLATION:
+                raise
+            conn.rollback()
+            # Report the room clash together with any teacher or group clashes
+            exam = _load_exam_resources(cursor, exam_id)
+            conflicts = find_conflicts(cursor, exam, exam_date, start_hour_int, room_ids) if exam else []
+            return _conflict_response(conflicts)
+        updated_exam = cursor.fetchone()
+        
+        if not updated_exam:
+            # Only the failure path pays for a second query, to tell the two cases apart
+            cursor.execute(
+                "SELECT status FROM exams WHERE id = %s AND student_group = %s",
+                (exam_id, student_group)
+            )
+            exam = cursor.fetchone()
+            if not exam:
+                return jsonify({"error": "Exam not found or does not belong to your group"}), 404
+            return jsonify({"error": f"Cannot propose schedule for exam in {exam[0]} status"}), 400
             
         # Exam period validation was removed as per user request
         # No longer checking if date is within an active exam period
-            
-        # Check if room is available at the given date and time
-        cursor.execute(
-            """
-            SELECT 1 FROM exams 
-            WHERE exam_date::date = %s::date 
-            AND start_hour = %s 
-            AND room_id = %s
-            AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
-            AND id != %s
-            """,
-            (exam_date, start_hour_int, room_id, exam_id)
-        )
-        if cursor.fetchone():
-            return jsonify({"error": "Room is already booked for the selected date and time"}), 409
-            
-        # Update the exam with the proposed schedule
-        cursor.execute(
-            """
-            UPDATE exams 
-            SET exam_date = %s, start_hour = %s, room_id = %s, status = 'PROPOSED', updated_at = CURRENT_TIMESTAMP 
-            WHERE id = %s
-            RETURNING id, discipline_id, exam_date, start_hour, room_id, status
-            """,
-            (exam_date, start_hour_int, room_id, exam_id)
-        )
-        updated_exam = cursor.fetchone()
-        conn.commit()
         
         columns = [desc[0] for desc in cursor.description]
         updated_exam_dict = dict(zip(columns, updated_exam))
+        
+        # Teachers and the group must not sit two overlapping exams either, nor have a
+        # class then, and neither teacher may have blocked the slot in their calendar
+        teacher_availability.refresh_if_stale(get_db_connection)
+        class_timetable.refresh_if_stale(get_db_connection)
+        conflicts = unavailable_teachers(updated_exam_dict, exam_date, start_hour_int)
+        conflicts += class_conflicts(updated_exam_dict, exam_date, start_hour_int, room_ids)
+        conflicts += find_conflicts(cursor, updated_exam_dict, exam_date, start_hour_int, room_ids)
+        if conflicts:
+            conn.rollback()
+            return _conflict_response(conflicts)
+            
+        # Record every room with its share of the group; extra rooms are checked by the
+        # exam_rooms exclusion constraint within the same transaction
+        cursor.execute("SELECT id, name, capacity FROM rooms WHERE id = ANY(%s)", (room_ids,))
+        rooms = [dict(zip(('id', 'name', 'capacity'), row)) for row in cursor.fetchall()]
+        if len(rooms) != len(room_ids):
+            conn.rollback()
+            return jsonify({"error": "Room not found"}), 404
+        group_headcounts.refresh_if_stale(get_db_connection)
+        headcount = group_headcounts.get(student_group)
+        try:
+            allocation = split_seats(rooms, headcount)
+        except AllocationError as e:
+            conn.rollback()
+            return jsonify(_capacity_error(e, rooms, headcount)), 409
+        try:
+            save_allocation(cursor, exam_id, allocation)
+        except Exception as e:
+            if pg_error_code(e) != EXCLUSION_VIOLATION:
+                raise
+            conn.rollback()
+            exam = _load_exam_resources(cursor, exam_id)
+            return _conflict_response(find_conflicts(cursor, exam, exam_date, start_hour_int, room_ids))
+        conn.commit()
+        booking = (exam_id, room_ids, updated_exam_dict['exam_date'],
+                   updated_exam_dict['start_hour'], updated_exam_dict['duration'], student_group)
+        after_commit(lambda: room_occupancy.set_booking(*booking))
+        
+        for key in ('duration', 'main_teacher_id', 'second_teacher_id', 'student_group'):
+            updated_exam_dict.pop(key)
         updated_exam_dict['exam_date'] = updated_exam_dict['exam_date'].isoformat()
+        updated_exam_dict['rooms'] = allocation
         
         return jsonify({
             "message": "Exam schedule proposed successfully",
@@ -242,6 +293,105 @@ def propose_exam_schedule(exam_id):
         if conn:
             conn.close()
 
+@token_required
+def get_room_allocation(exam_id):
+    """
+    Suggests the fewest free rooms that hold the leader's group at ?date=&hour= for the
+    exam's duration, to be sent back as room_ids when proposing
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') != 'SEF_GRUPA':
+        return jsonify({"error": "Only group leaders can access this endpoint"}), 403
+        
+    student_group = g.current_user.get('student_group')
+    if not student_group:
+        return jsonify({"error": "Group leader is not assigned to a student group"}), 400
+        
+    try:
+        date_obj = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d')
+        hour_int = int(request.args.get('hour', ''))
+    except ValueError:
+        return jsonify({"error": "Valid date (YYYY-MM-DD) and hour are required"}), 400
+    if date_obj.weekday() >= 5:
+        return jsonify({"error": "Exams can only be scheduled on weekdays (Monday to Friday)"}), 400
+    if not (8 <= hour_int <= 20):
+        return jsonify({"error": "Hour must be between 8 and 20"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "SELECT COALESCE(duration, 120) FROM exams WHERE id = %s AND student_group = %s",
+            (exam_id, student_group)
+        )
+        exam = cursor.fetchone()
+        if not exam:
+            return jsonify({"error": "Exam not found or does not belong to your group"}), 404
+        duration = exam[0]
+        
+        room_occupancy.refresh_if_stale(get_db_connection)
+        group_headcounts.refresh_if_stale(get_db_connection)
+        headcount = group_headcounts.get(student_group)
+        # The exam's own current booking does not block its rooms
+        rooms, busy = room_occupancy.busy_slots([date_obj], exclude_exam_id=exam_id)
+        first, last = slot_range(hour_int, duration)
+        free = [room for room, room_busy in zip(rooms, busy[:, 0, first:last].any(axis=1)) if not room_busy]
+        try:
+            allocation, method = allocate(free, headcount)
+        except AllocationError as e:
+            return jsonify({"error": str(e), "group_size": headcount}), 409
+            
+        return jsonify({
+            "exam_id": exam_id,
+            "exam_date": date_obj.strftime('%Y-%m-%d'),
+            "start_hour": hour_int,
+            "duration": duration,
+            "group_size": headcount,
+            "method": method,
+            "total_capacity": sum(room['capacity'] for room in allocation),
+            "rooms": allocation,
+            "room_ids": [room['room_id'] for room in allocation]
+        }), 200
+    except Exception as e:
+        print(f"Error allocating rooms: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+def _load_exam_resources(cursor, exam_id):
+    """Returns the fields of an exam that the conflict checks need, or None if it does not exist."""
+    cursor.execute(
+        """SELECT id, duration, main_teacher_id, second_teacher_id, student_group
+        FROM exams WHERE id = %s""",
+        (exam_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    columns = [desc[0] for desc in cursor.description]
+    return dict(zip(columns, row))
+
+def _capacity_error(error, rooms, headcount):
+    capacity = sum(room['capacity'] or 0 for room in rooms)
+    return {
+        "error": str(error),
+        "group_size": headcount,
+        "total_capacity": capacity,
+        "shortfall": max(headcount - capacity, 0)
+    }
+
+def _conflict_response(conflicts):
+    return jsonify({
+        "error": "The selected date and time conflict with other exams",
+        "conflicts": conflicts
+    }), 409
+
 @token_required
 def reschedule_exam(exam_id):
     """Group leader reschedules an exam that was rejected or cancelled"""
@@ -255,3 +405,549 @@ def reschedule_exam(exam_id):
     # The rest of the function implementation is the same as propose_exam_schedule
     # since it's essentially doing the same thing but with stricter status checks
     return propose_exam_schedule(exam_id)
+
+
+# Most proposals one batch request may carry
+MAX_BATCH_PROPOSALS = 100
+
+def _batch_failure(exam_id, error, code, conflicts=None):
+    failure = {"exam_id": exam_id, "ok": False, "code": code, "error": error}
+    if conflicts:
+        failure["conflicts"] = conflicts
+    return failure
+
+def _validate_proposals(cursor, student_group, headcount, items, results):
+    """
+    Checks parsed proposals ({position, exam_id, date, hour, room_ids}) against the database
+    with one query per kind of check, and against each other: a proposal that passes is
+    added to the conflict index, so later proposals of the batch clash with it. Failures
+    go into `results`; returns the proposals that passed, each with its exam and the
+    seats of its rooms (which must hold the group's `headcount`).
+    """
+    cursor.execute(
+        """
+        SELECT e.id, e.status, e.student_group, e.discipline_id, d.name AS discipline_name,
+               COALESCE(e.duration, 120) AS duration, e.main_teacher_id, e.second_teacher_id
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE e.id = ANY(%s::int[])
+        """,
+        ([item['exam_id'] for item in items],)
+    )
+    columns = [desc[0] for desc in cursor.description]
+    exams = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+    cursor.execute(
+        "SELECT id, name, capacity FROM rooms WHERE id = ANY(%s::int[])",
+        (sorted({rid for item in items for rid in item['room_ids']}),)
+    )
+    rooms = {row[0]: dict(zip(('id', 'name', 'capacity'), row)) for row in cursor.fetchall()}
+
+    candidates = []
+    for item in items:
+        exam = exams.get(item['exam_id'])
+        if not exam or exam['student_group'] != student_group:
+            results[item['position']] = _batch_failure(item['exam_id'], "Exam not found or does not belong to your group", 404)
+        elif exam['status'] not in ('DRAFT', 'REJECTED', 'CANCELLED'):
+            results[item['position']] = _batch_failure(item['exam_id'], f"Cannot propose schedule for exam in {exam['status']} status", 400)
+        elif any(rid not in rooms for rid in item['room_ids']):
+            results[item['position']] = _batch_failure(item['exam_id'], "Room not found", 404)
+        else:
+            item_rooms = [rooms[rid] for rid in item['room_ids']]
+            try:
+                allocation = split_seats(item_rooms, headcount)
+            except AllocationError as e:
+                failure = _batch_failure(item['exam_id'], str(e), 409)
+                failure.update({k: v for k, v in _capacity_error(e, item_rooms, headcount).items() if k != 'error'})
+                results[item['position']] = failure
+                continue
+            candidates.append(dict(item, exam=exam, allocation=allocation))
+
+    index = load_index(cursor, [item['date'] for item in candidates], [item['exam_id'] for item in candidates])
+    accepted = []
+    for item in candidates:
+        exam = item['exam']
+        conflicts = unavailable_teachers(exam, item['date'], item['hour'])
+        conflicts += class_conflicts(exam, item['date'], item['hour'], item['room_ids'])
+        start, end = exam_interval(item['date'], item['hour'], exam['duration'])
+        conflicts += index.conflicts(
+            start, end,
+            room_ids=item['room_ids'],
+            teacher_ids=(exam['main_teacher_id'], exam['second_teacher_id']),
+            student_group=student_group,
+        )
+        if conflicts:
+            results[item['position']] = _batch_failure(
+                item['exam_id'], "The selected date and time conflict with other exams", 409, conflicts)
+            continue
+        index.add(dict(exam, room_ids=item['room_ids'], start=start, end=end))
+        accepted.append(item)
+    return accepted
+
+def _apply_proposals(cursor, student_group, accepted):
+    """
+    Books the accepted proposals with one UPDATE and records their rooms with
+    save_allocations. Returns the RETURNING rows by exam id; an exclusion violation
+    (a concurrent booking) propagates to the caller.
+    """
+    exam_ids = [item['exam_id'] for item in accepted]
+    cursor.execute(
+        """
+        DELETE FROM exam_rooms er USING exams e
+        WHERE er.exam_id = e.id AND NOT er.is_primary
+        AND e.id = ANY(%s::int[]) AND e.student_group = %s AND e.status IN ('DRAFT', 'REJECTED', 'CANCELLED')
+        """,
+        (exam_ids, student_group)
+    )
+    cursor.execute(
+        """
+        UPDATE exams e
+        SET exam_date = p.exam_date, start_hour = p.start_hour, room_id = p.room_id,
+            status = 'PROPOSED', updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::int[], %s::date[], %s::int[], %s::int[]) AS p(id, exam_date, start_hour, room_id)
+        WHERE e.id = p.id AND e.student_group = %s
+        AND e.status IN ('DRAFT', 'REJECTED', 'CANCELLED')
+        RETURNING e.id, e.discipline_id, e.exam_date, e.start_hour, e.room_id, e.status, e.duration
+        """,
+        (
+            exam_ids,
+            [item['date'] for item in accepted],
+            [item['hour'] for item in accepted],
+            [item['room_ids'][0] for item in accepted],
+            student_group,
+        )
+    )
+    columns = [desc[0] for desc in cursor.description]
+    updated = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+    save_allocations(cursor, {item['exam_id']: item['allocation'] for item in accepted if item['exam_id'] in updated})
+    return updated
+
+@token_required
+def propose_exam_schedules():
+    """
+    Group leader proposes several exams at once: proposals is a list of {exam_id,
+    exam_date, start_hour, room_id or room_ids}, checked together (including clashes
+    between proposals of the batch) and booked in one transaction. Every proposal gets a
+    result; with all_or_nothing, nothing is booked unless every proposal passes.
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') != 'SEF_GRUPA':
+        return jsonify({"error": "Only group leaders can propose exam schedules"}), 403
+        
+    student_group = g.current_user.get('student_group')
+    if not student_group:
+        return jsonify({"error": "Group leader is not assigned to a student group"}), 400
+        
+    data = request.get_json(silent=True) or {}
+    proposals = data.get('proposals')
+    all_or_nothing = bool(data.get('all_or_nothing'))
+    if not isinstance(proposals, list) or not proposals:
+        return jsonify({"error": "proposals must be a non-empty list"}), 400
+    if len(proposals) > MAX_BATCH_PROPOSALS:
+        return jsonify({"error": f"At most {MAX_BATCH_PROPOSALS} proposals can be sent at once"}), 400
+        
+    # The same checks as propose_exam_schedule, per proposal and without the database
+    results = [None] * len(proposals)
+    items, seen = [], set()
+    for position, proposal in enumerate(proposals):
+        proposal = proposal if isinstance(proposal, dict) else {}
+        exam_id = proposal.get('exam_id')
+        room_ids = proposal.get('room_ids') or ([proposal['room_id']] if proposal.get('room_id') else [])
+        try:
+            exam_id = int(exam_id)
+            room_ids = list(dict.fromkeys(int(rid) for rid in (room_ids if isinstance(room_ids, list) else [room_ids])))
+            start_hour = int(proposal.get('start_hour'))
+            exam_date = datetime.strptime(proposal.get('exam_date'), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            results[position] = _batch_failure(exam_id, "Exam id, date, start hour and room ID are required", 400)
+            continue
+        if not room_ids:
+            results[position] = _batch_failure(exam_id, "Exam id, date, start hour and room ID are required", 400)
+        elif not (8 <= start_hour <= 20):
+            results[position] = _batch_failure(exam_id, "Start hour must be between 8 and 20", 400)
+        elif exam_date.weekday() >= 5:
+            results[position] = _batch_failure(exam_id, "Exams can only be scheduled on weekdays (Monday to Friday)", 400)
+        elif exam_id in seen:
+            results[position] = _batch_failure(exam_id, "The exam is proposed more than once in the batch", 400)
+        else:
+            items.append({'position': position, 'exam_id': exam_id, 'date': exam_date, 'hour': start_hour, 'room_ids': room_ids})
+        seen.add(exam_id)
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        teacher_availability.refresh_if_stale(get_db_connection)
+        class_timetable.refresh_if_stale(get_db_connection)
+        group_headcounts.refresh_if_stale(get_db_connection)
+        headcount = group_headcounts.get(student_group)
+        
+        updated = {}
+        # A booking committed by someone else between the checks and the UPDATE trips the
+        # exclusion constraints; the batch is then checked once more against it
+        for attempt in range(2):
+            accepted = _validate_proposals(cursor, student_group, headcount, items, results) if items else []
+            if not accepted or (all_or_nothing and len(accepted) < len(proposals)):
+                conn.rollback()
+                break
+            try:
+                updated = _apply_proposals(cursor, student_group, accepted)
+            except Exception as e:
+                if pg_error_code(e) != EXCLUSION_VIOLATION:
+                    raise
+                conn.rollback()
+                if attempt:
+                    return jsonify({"error": "Other bookings were made while the batch was checked; please send it again"}), 409
+                continue
+            for item in accepted:
+                if item['exam_id'] not in updated:
+                    results[item['position']] = _batch_failure(item['exam_id'], "The exam changed while the batch was checked", 409)
+            if all_or_nothing and len(updated) < len(accepted):
+                conn.rollback()
+                updated = {}
+            else:
+                conn.commit()
+            break
+            
+        for item in accepted:
+            exam = updated.get(item['exam_id'])
+            if exam is None:
+                if results[item['position']] is None:
+                    results[item['position']] = _batch_failure(item['exam_id'], "Not booked because other proposals of the batch failed", 409)
+                continue
+            booking = (exam['id'], item['room_ids'], exam['exam_date'], exam['start_hour'], exam['duration'], student_group)
+            after_commit(lambda booking=booking: room_occupancy.set_booking(*booking))
+            exam.pop('duration')
+            exam['exam_date'] = exam['exam_date'].isoformat()
+            exam['rooms'] = item['allocation']
+            results[item['position']] = {"exam_id": exam['id'], "ok": True, "exam": exam}
+            
+        return jsonify({
+            "proposed": len(updated),
+            "failed": len(proposals) - len(updated),
+            "results": results
+        }), 200
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"Error proposing exam schedules: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# Longest range the availability grid accepts, in days
+MAX_GRID_DAYS = 120
+
+def _sweep_busy(shape, slots, intervals):
+    """
+    Returns a boolean array of `shape` + (slots,) marking the slots covered by `intervals`,
+    a list of (*index, first_slot, last_slot) tuples with last_slot exclusive. Each interval
+    adds +1 at its first slot and -1 at its end; a running sum along the slot axis is then
+    positive exactly where some interval is in progress.
+    """
+    delta = np.zeros(tuple(shape) + (slots + 1,), dtype=np.int32)
+    if intervals:
+        columns = np.array(intervals, dtype=np.int64).T
+        index, first, last = tuple(columns[:-2]), columns[-2], columns[-1]
+        np.add.at(delta, index + (np.clip(first, 0, slots),), 1)
+        np.add.at(delta, index + (np.clip(last, 0, slots),), -1)
+    return np.cumsum(delta, axis=-1)[..., :slots] > 0
+
+@token_required
+def get_availability_grid():
+    """
+    Room x day x hour availability for an exam period (?period_id=) or a date range
+    (?start_date=&end_date=). Each room gets one integer per weekday in which bit i is
+    set when hour `hours[i]` is booked by an exam or a regular class. Responses carry an
+    ETag derived from the exams, exam_rooms, rooms and class_timetable tables, so
+    unchanged grids are answered with 304 Not Modified.
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    user_role = g.current_user.get('role')
+    if user_role not in ['SEF_GRUPA', 'SG']:
+        return jsonify({"error": "Only group leaders can access this endpoint"}), 403
+        
+    period_id = request.args.get('period_id')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if not period_id and not all([start_date, end_date]):
+        return jsonify({"error": "Either period_id or start_date and end_date are required"}), 400
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        period = None
+        if period_id:
+            cursor.execute(
+                "SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s",
+                (period_id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                return jsonify({"error": "Exam period not found"}), 404
+            period = {"id": row[0], "name": row[1]}
+            start, end = row[2], row[3]
+        else:
+            try:
+                start = datetime.strptime(start_date, '%Y-%m-%d').date()
+                end = datetime.strptime(end_date, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({"error": "Invalid date format"}), 400
+        if end < start:
+            return jsonify({"error": "End date must not be before start date"}), 400
+        if (end - start).days >= MAX_GRID_DAYS:
+            return jsonify({"error": f"Date range must not exceed {MAX_GRID_DAYS} days"}), 400
+            
+        # Any booking change bumps exams.updated_at or the row count; room edits and the
+        # extra rooms of multi-room exams change the digests, and every class timetable
+        # import replaces its rows (new ids)
+        cursor.execute(
+            """
+            SELECT (SELECT MAX(updated_at) FROM exams), (SELECT COUNT(*) FROM exams),
+                   (SELECT md5(string_agg(id || ':' || name || ':' || capacity, ',' ORDER BY id)) FROM rooms),
+                   (SELECT md5(string_agg(exam_id || ':' || room_id, ',' ORDER BY exam_id, room_id))
+                    FROM exam_rooms WHERE active),
+                   (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) FROM class_timetable)
+            """
+        )
+        version = cursor.fetchone()
+        etag = hashlib.sha1(f"{start}|{end}|{'|'.join(str(v) for v in version)}".encode()).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+            
+        cursor.execute("SELECT id, name, capacity FROM rooms ORDER BY name")
+        rooms = cursor.fetchall()
+        
+        # One range query for every active booking in the window, every room of multi-room
+        # exams included (exam_rooms holds the primary room too)
+        cursor.execute(
+            """
+            SELECT er.room_id, e.exam_day, e.start_hour, COALESCE(e.duration, 120)
+            FROM exams e JOIN exam_rooms er ON er.exam_id = e.id
+            WHERE e.exam_day BETWEEN %s AND %s
+            AND e.start_hour IS NOT NULL AND er.active
+            AND e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            """,
+            (start, end)
+        )
+        bookings = cursor.fetchall()
+        
+        # Regular classes recur weekly; a day holds those of its weekday and week parity
+        cursor.execute(
+            """SELECT room_id, weekday, start_minute, duration, parity, valid_from, valid_to
+            FROM class_timetable WHERE room_id IS NOT NULL"""
+        )
+        classes = cursor.fetchall()
+        
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        days = [day for day in days if day.weekday() < 5]
+        hours = list(range(DAY_START_HOUR, DAY_END_HOUR))
+        room_index = {room[0]: i for i, room in enumerate(rooms)}
+        day_index = {day: i for i, day in enumerate(days)}
+        
+        booked = [
+            (room_index[room_id], day_index[day], start_hour - DAY_START_HOUR,
+             -(-(start_hour * 60 + duration) // 60) - DAY_START_HOUR)
+            for room_id, day, start_hour, duration in bookings
+            if room_id in room_index and day in day_index
+        ]
+        for room_id, weekday, start_minute, duration, parity, valid_from, valid_to in classes:
+            if room_id not in room_index:
+                continue
+            first = start_minute // 60 - DAY_START_HOUR
+            last = -(-(start_minute + duration) // 60) - DAY_START_HOUR
+            booked += [
+                (room_index[room_id], d, first, last)
+                for d, day in enumerate(days)
+                if day.weekday() == weekday and parity in class_parities(day, valid_from, valid_to)
+            ]
+        busy = _sweep_busy((len(rooms), len(days)), len(hours), booked)
+        bitsets = (busy * (1 << np.arange(len(hours), dtype=np.int64))).sum(axis=2)
+        
+        response = jsonify({
+            "period": period,
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "days": [day.isoformat() for day in days],
+            "hours": hours,
+            "encoding": "bitset",
+            "rooms": [
+                {"id": room[0], "name": room[1], "capacity": room[2], "booked": bitsets[i].tolist()}
+                for i, room in enumerate(rooms)
+            ]
+        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        print(f"Error building availability grid: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
+
+
+# The exams table only accepts start hours up to 18 (see the start_hour CHECK)
+LATEST_START_HOUR = 18
+MAX_SLOT_RESULTS = 50
+
+@token_required
+def find_exam_slots(exam_id):
+    """
+    Earliest feasible (date, start_hour, room) for an exam within an exam period
+    (?period_id=, defaulting to the active period), from today onwards. A slot is feasible
+    when the room is free for the whole duration and holds the group, neither teacher is
+    busy, unavailable or teaching, and the group has no other exam that day nor a class at
+    that time. Every slot is reported once, with the
+    smallest room that fits; ?k= sets how many slots are returned (default 5).
+    """
+    if not DB_AVAILABLE:
+        return jsonify({"error": "Database not available"}), 500
+        
+    if g.current_user.get('role') != 'SEF_GRUPA':
+        return jsonify({"error": "Only group leaders can search exam slots"}), 403
+        
+    student_group = g.current_user.get('student_group')
+    if not student_group:
+        return jsonify({"error": "Group leader is not assigned to a student group"}), 400
+        
+    try:
+        k = int(request.args.get('k', 5))
+        if not (1 <= k <= MAX_SLOT_RESULTS):
+            return jsonify({"error": f"k must be between 1 and {MAX_SLOT_RESULTS}"}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid k"}), 400
+    period_id = request.args.get('period_id')
+        
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            """SELECT main_teacher_id, second_teacher_id, COALESCE(duration, 120)
+            FROM exams WHERE id = %s AND student_group = %s""",
+            (exam_id, student_group)
+        )
+        exam = cursor.fetchone()
+        if not exam:
+            return jsonify({"error": "Exam not found or does not belong to your group"}), 404
+        teacher_ids = {exam[0], exam[1]} - {None}
+        duration = exam[2]
+        
+        if period_id:
+            cursor.execute("SELECT id, name, start_date, end_date FROM exam_periods WHERE id = %s", (period_id,))
+        else:
+            cursor.execute(
+                "SELECT id, name, start_date, end_date FROM exam_periods WHERE is_active ORDER BY start_date DESC LIMIT 1"
+            )
+        period = cursor.fetchone()
+        if not period:
+            return jsonify({"error": "Exam period not found" if period_id else "No active exam period"}), 404
+        start, end = max(period[2], date.today()), period[3]
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        days = [day for day in days if day.weekday() < 5]
+        
+        result = {
+            "exam_id": exam_id,
+            "period": {"id": period[0], "name": period[1]},
+            "duration": duration,
+            "slots": [],
+        }
+        if not days:
+            return jsonify(result), 200
+            
+        group_headcounts.refresh_if_stale(get_db_connection)
+        group_size = group_headcounts.get(student_group)
+        result["group_size"] = group_size
+        
+        # Rooms come from the in-memory occupancy index; only the bookings of this exam's
+        # teachers and group are read from the database (idx_exams_main/second_teacher, idx_exams_student_group)
+        room_occupancy.refresh_if_stale(get_db_connection)
+        rooms, room_busy = room_occupancy.busy_slots(days, exclude_exam_id=exam_id)
+        cursor.execute(
+            """
+            SELECT exam_day - %s::date, start_hour, COALESCE(duration, 120),
+                   main_teacher_id = ANY(%s::varchar[]) OR second_teacher_id = ANY(%s::varchar[]),
+                   student_group = %s
+            FROM exams
+            WHERE (main_teacher_id = ANY(%s::varchar[]) OR second_teacher_id = ANY(%s::varchar[]) OR student_group = %s)
+            AND exam_day BETWEEN %s AND %s AND start_hour IS NOT NULL
+            AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            AND id != %s
+            """,
+            (days[0], list(teacher_ids), list(teacher_ids), student_group,
+             list(teacher_ids), list(teacher_ids), student_group, days[0], days[-1], exam_id)
+        )
+        
+        # Day offsets from the first day, mapped onto the weekday-only axis
+        offsets = np.full((days[-1] - days[0]).days + 1, -1)
+        offsets[[(day - days[0]).days for day in days]] = np.arange(len(days))
+        teacher_intervals = []
+        group_busy_day = np.zeros(len(days), dtype=bool)
+        for offset, hour, booking_duration, teacher_busy, group_busy in cursor.fetchall():
+            d = offsets[offset]
+            if d < 0:
+                continue
+            if teacher_busy:
+                first, last = slot_range(hour, booking_duration)
+                teacher_intervals.append((d, first, last))
+            if group_busy:
+                group_busy_day[d] = True
+                
+        # Candidate starts whose whole duration fits in the day
+        length = -(-duration // SLOT_MINUTES)
+        hours = np.arange(DAY_START_HOUR, LATEST_START_HOUR + 1)
+        first_slots = (hours - DAY_START_HOUR) * 60 // SLOT_MINUTES
+        fits = first_slots + length <= SLOTS_PER_DAY
+        hours, first_slots = hours[fits], first_slots[fits]
+        
+        def free_for_duration(busy):
+            # Prefix sums over the slot axis: a window is free when it covers no busy slot
+            covered = np.concatenate([np.zeros(busy.shape[:-1] + (1,), dtype=np.int32), np.cumsum(busy, axis=-1)], axis=-1)
+            return covered[..., first_slots + length] == covered[..., first_slots]
+            
+        # Smallest rooms first, so the first feasible room of a slot is the best fit
+        by_capacity = np.argsort([room['capacity'] or 0 for room in rooms], kind='stable')
+        rooms = [rooms[i] for i in by_capacity]
+        room_free = free_for_duration(room_busy[by_capacity])
+        teacher_availability.refresh_if_stale(get_db_connection)
+        teacher_busy = _sweep_busy((len(days),), SLOTS_PER_DAY, teacher_intervals)
+        teacher_busy |= teacher_availability.blocked_slots(teacher_ids, days)
+        class_timetable.refresh_if_stale(get_db_connection)
+        teacher_busy |= class_timetable.busy_slots(teacher_ids, student_group, days)
+        teachers_free = free_for_duration(teacher_busy)
+        capacity_ok = np.array([(room['capacity'] or 0) >= group_size for room in rooms], dtype=bool)
+        
+        feasible = (room_free
+                    & teachers_free[np.newaxis]
+                    & ~group_busy_day[np.newaxis, :, np.newaxis]
+                    & capacity_ok[:, np.newaxis, np.newaxis])
+        slot_ok = feasible.any(axis=0)
+        best_room = feasible.argmax(axis=0)
+        for flat in np.flatnonzero(slot_ok)[:k]:
+            d, h = np.unravel_index(flat, slot_ok.shape)
+            result["slots"].append({
+                "date": days[d].isoformat(),
+                "start_hour": int(hours[h]),
+                "room": rooms[best_room[d, h]],
+            })
+            
+        return jsonify(result), 200
+    except Exception as e:
+        print(f"Error searching exam slots: {e}")
+        return jsonify({"error": "An internal error occurred"}), 500
+    finally:
+        if conn:
+            cursor.close()
+            conn.close()
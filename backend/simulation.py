@@ -0,0 +1,357 @@
+"""
+What-if simulation of schedule changes, entirely in memory.
+
+A ScheduleModel is a read-only snapshot of the exams (DRAFT and active) and rooms of
+a date range. A Scenario layers copy-on-write overrides on top of it: an operation
+copies only the exams it touches, so evaluating a scenario never copies the whole
+schedule and never writes to the database. Snapshots are cached per date range and
+reused until the exams or rooms tables change.
+
+Supported operations (JSON objects with an "op" key):
+
+    move        exams matching a filter, to "date" or by "shift_days",
+                optionally to "start_hour" and/or "room_id_to" (the only room of
+                the exam afterwards, replacing all the rooms of multi-room exams)
+    close_room  "room_id" (or "room" name); its exams lose their rooms unless
+                "reassign" is true, in which case the smallest free room that holds
+                the group at the same time is used when there is one
+    cancel      exams matching a filter
+
+Filters: exam_ids, discipline_id, discipline (name), student_group, teacher_id, room_id
+(any of the rooms of the exam).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from conflicts import ConflictIndex, IntervalIndex, exam_interval, load_group_sizes, DEFAULT_DURATION
+from occupancy import DAY_START_HOUR, DAY_END_HOUR
+
+EARLIEST_START_HOUR = 8
+LATEST_START_HOUR = 18
+# Minutes a room can host exams on one weekday, for utilization figures
+ROOM_MINUTES_PER_DAY = (DAY_END_HOUR - DAY_START_HOUR) * 60
+MAX_OPERATIONS = 100
+MAX_SCENARIOS = 50
+CACHE_SIZE = 8
+
+
+class SimulationError(ValueError):
+    """Raised for malformed operations; the message is safe to return to the client."""
+
+
+class ScheduleModel:
+    """Immutable snapshot of the schedule of one date range."""
+
+    def __init__(self, start_date, end_date, exams, rooms, group_sizes):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.exams = exams  # id -> dict, never mutated after construction
+        self.order = sorted(exams)
+        self.rooms = rooms  # id -> dict(id, name, capacity)
+        self.room_names = {room['name'].lower(): room_id for room_id, room in rooms.items()}
+        self.group_sizes = group_sizes
+        weekdays = sum(1 for i in range((end_date - start_date).days + 1)
+                       if (start_date + timedelta(days=i)).weekday() < 5)
+        self.room_minutes = max(1, weekdays) * ROOM_MINUTES_PER_DAY
+        self.baseline = Scenario(self).evaluate()
+
+
+class Scenario:
+    """Copy-on-write view of a ScheduleModel with hypothetical changes applied."""
+
+    def __init__(self, model):
+        self.model = model
+        self._overrides = {}
+        self._closed_rooms = set()
+
+    # --- Copy-on-write access ---
+
+    def exam(self, exam_id):
+        return self._overrides.get(exam_id, self.model.exams[exam_id])
+
+    def exams(self):
+        for exam_id in self.model.order:
+            yield self.exam(exam_id)
+
+    def _writable(self, exam_id):
+        exam = self._overrides.get(exam_id)
+        if exam is None:
+            exam = dict(self.model.exams[exam_id])
+            self._overrides[exam_id] = exam
+        return exam
+
+    # --- Operations ---
+
+    def apply(self, operation):
+        if not isinstance(operation, dict):
+            raise SimulationError("Each operation must be an object")
+        handler = {
+            'move': self._move,
+            'close_room': self._close_room,
+            'cancel': self._cancel,
+        }.get(operation.get('op'))
+        if handler is None:
+            raise SimulationError(f"Unknown operation: {operation.get('op')!r}")
+        handler(operation)
+
+    def _select(self, operation):
+        filters = {key: operation[key] for key in
+                   ('exam_ids', 'discipline_id', 'discipline', 'student_group', 'teacher_id', 'room_id')
+                   if key in operation}
+        if not filters:
+            raise SimulationError(f"Operation {operation['op']!r} needs at least one exam filter")
+        exam_ids = set(filters.get('exam_ids') or [])
+        discipline = str(filters.get('discipline', '')).lower()
+
+        selected = []
+        for exam in self.exams():
+            if exam['status'] == 'CANCELLED':
+                continue
+            if 'exam_ids' in filters and exam['id'] not in exam_ids:
+                continue
+            if 'discipline_id' in filters and exam['discipline_id'] != filters['discipline_id']:
+                continue
+            if 'discipline' in filters and (exam['discipline_name'] or '').lower() != discipline:
+                continue
+            if 'student_group' in filters and exam['student_group'] != filters['student_group']:
+                continue
+            if 'teacher_id' in filters and filters['teacher_id'] not in (exam['main_teacher_id'], exam['second_teacher_id']):
+                continue
+            if 'room_id' in filters and filters['room_id'] not in exam['room_ids']:
+                continue
+            selected.append(exam['id'])
+        return selected
+
+    def _move(self, operation):
+        if not any(key in operation for key in ('date', 'shift_days', 'start_hour', 'room_id_to')):
+            raise SimulationError("move needs date, shift_days, start_hour or room_id_to")
+        try:
+            new_date = datetime.strptime(operation['date'], '%Y-%m-%d').date() if 'date' in operation else None
+            shift = timedelta(days=int(operation.get('shift_days', 0)))
+            start_hour = int(operation['start_hour']) if 'start_hour' in operation else None
+        except (TypeError, ValueError):
+            raise SimulationError("move has an invalid date, shift_days or start_hour")
+        room_id = operation.get('room_id_to')
+        if room_id is not None and room_id not in self.model.rooms:
+            raise SimulationError(f"Unknown room {room_id}")
+
+        for exam_id in self._select(operation):
+            exam = self._writable(exam_id)
+            if new_date is not None:
+                exam['day'] = new_date
+            elif exam['day'] is not None:
+                exam['day'] = exam['day'] + shift
+            if start_hour is not None:
+                exam['start_hour'] = start_hour
+            if room_id is not None:
+                exam['room_id'], exam['room_ids'] = room_id, [room_id]
+
+    def _close_room(self, operation):
+        room_id = operation.get('room_id')
+        if room_id is None and operation.get('room'):
+            room_id = self.model.room_names.get(str(operation['room']).lower())
+        if room_id not in self.model.rooms:
+            raise SimulationError("close_room needs an existing room_id or room name")
+        self._closed_rooms.add(room_id)
+
+        # A multi-room exam cannot sit in the remaining rooms alone: it loses all of them
+        displaced = [exam['id'] for exam in self.exams() if room_id in exam['room_ids'] and exam['status'] != 'CANCELLED']
+        for exam_id in displaced:
+            exam = self._writable(exam_id)
+            exam['room_id'], exam['room_ids'] = None, []
+        if operation.get('reassign'):
+            index = self._index()
+            for exam_id in displaced:
+                self._reassign(index, exam_id)
+
+    def _reassign(self, index, exam_id):
+        exam = self._writable(exam_id)
+        if exam['day'] is None or exam['start_hour'] is None or _valid_slot(exam):
+            return
+        start, end = exam_interval(exam['day'], exam['start_hour'], exam['duration'])
+        size = self.model.group_sizes.get(exam['student_group'], 0)
+        candidates = sorted(
+            (room for room in self.model.rooms.values()
+             if room['id'] not in self._closed_rooms and (room['capacity'] or 0) >= size),
+            key=lambda room: (room['capacity'] or 0, room['name'])
+        )
+        for room in candidates:
+            if not index.conflicts(start, end, room_id=room['id'], exclude_exam_id=exam_id):
+                exam['room_id'], exam['room_ids'] = room['id'], [room['id']]
+                index.rooms.setdefault(room['id'], IntervalIndex()).add(start, end, exam_id)
+                return
+
+    def _cancel(self, operation):
+        for exam_id in self._select(operation):
+            self._writable(exam_id)['status'] = 'CANCELLED'
+
+    # --- Evaluation ---
+
+    def _index(self):
+        index = ConflictIndex()
+        for exam in self.exams():
+            if _placed(exam) and _valid_slot(exam) is None and self._closed_rooms.isdisjoint(exam['room_ids']):
+                booking = dict(exam)
+                booking['start'], booking['end'] = exam_interval(exam['day'], exam['start_hour'], exam['duration'])
+                index.add(booking)
+        return index
+
+    def evaluate(self):
+        """Returns conflicts, unplaced exams and per-room booked minutes of the scenario."""
+        conflicts = self._index().all_conflicts()
+        unplaced = []
+        booked = {room_id: 0 for room_id in self.model.rooms}
+        for exam in self.exams():
+            if exam['status'] == 'CANCELLED':
+                continue
+            reason = 'not scheduled' if not _placed(exam) else _valid_slot(exam)
+            if reason is None and not self._closed_rooms.isdisjoint(exam['room_ids']):
+                reason = 'room closed'
+            if reason:
+                unplaced.append({'exam_id': exam['id'], 'discipline_name': exam['discipline_name'],
+                                 'student_group': exam['student_group'], 'reason': reason})
+                continue
+            # Multi-room exams seat the group across all their rooms
+            capacity = sum(self.model.rooms[room_id]['capacity'] or 0 for room_id in exam['room_ids'])
+            size = self.model.group_sizes.get(exam['student_group'], 0)
+            if capacity < size:
+                conflicts.append({'type': 'capacity', 'resource': exam['room_id'], 'exam_ids': [exam['id']],
+                                  'room_ids': exam['room_ids'], 'capacity': capacity, 'group_size': size})
+            for room_id in exam['room_ids']:
+                booked[room_id] += exam['duration']
+        return {'conflicts': conflicts, 'unplaced': unplaced, 'booked_minutes': booked}
+
+    def changes(self):
+        changed = []
+        for exam_id, exam in sorted(self._overrides.items()):
+            before = self.model.exams[exam_id]
+            fields = ('day', 'start_hour', 'room_ids', 'status')
+            if any(before[field] != exam[field] for field in fields):
+                changed.append({
+                    'exam_id': exam_id,
+                    'before': _slot_summary(before),
+                    'after': _slot_summary(exam),
+                })
+        return changed
+
+
+def _placed(exam):
+    return exam['day'] is not None and exam['start_hour'] is not None and exam['room_id'] is not None
+
+
+def _valid_slot(exam):
+    if exam['day'].weekday() >= 5:
+        return 'falls on a weekend'
+    if not (EARLIEST_START_HOUR <= exam['start_hour'] <= LATEST_START_HOUR):
+        return f'start hour must be between {EARLIEST_START_HOUR} and {LATEST_START_HOUR}'
+    return None
+
+
+def _slot_summary(exam):
+    return {
+        'date': exam['day'].isoformat() if exam['day'] else None,
+        'start_hour': exam['start_hour'],
+        'room_id': exam['room_id'],
+        'room_ids': exam['room_ids'],
+        'status': exam['status'],
+    }
+
+
+def _conflict_key(conflict):
+    return (conflict['type'], conflict['resource'], tuple(conflict['exam_ids']))
+
+
+def simulate(model, operations, name=None):
+    """Applies `operations` to a fresh scenario over `model` and reports the differences."""
+    started = time.perf_counter()
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        raise SimulationError(f"operations must be a list of at most {MAX_OPERATIONS} items")
+    scenario = Scenario(model)
+    for operation in operations:
+        scenario.apply(operation)
+    result = scenario.evaluate()
+    baseline = model.baseline
+
+    before = {_conflict_key(c) for c in baseline['conflicts']}
+    after = {_conflict_key(c) for c in result['conflicts']}
+    utilization = []
+    for room_id, room in model.rooms.items():
+        base_minutes = baseline['booked_minutes'][room_id]
+        minutes = result['booked_minutes'][room_id]
+        if base_minutes != minutes or room_id in scenario._closed_rooms:
+            utilization.append({
+                'room_id': room_id,
+                'room_name': room['name'],
+                'closed': room_id in scenario._closed_rooms,
+                'booked_minutes_before': base_minutes,
+                'booked_minutes_after': minutes,
+                'utilization_before': round(base_minutes / model.room_minutes, 4),
+                'utilization_after': round(minutes / model.room_minutes, 4),
+            })
+
+    return {
+        'name': name,
+        'changed_exams': scenario.changes(),
+        'conflicts': result['conflicts'],
+        'new_conflicts': len(after - before),
+        'resolved_conflicts': len(before - after),
+        'unplaced': result['unplaced'],
+        'unplaced_delta': len(result['unplaced']) - len(baseline['unplaced']),
+        'room_utilization': sorted(utilization, key=lambda u: u['room_name']),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def load_model(cursor, start_date, end_date):
+    """Returns the ScheduleModel of a date range, rebuilt only when exams or rooms changed."""
+    cursor.execute(
+        """
+        SELECT (SELECT MAX(updated_at) FROM exams), (SELECT COUNT(*) FROM exams),
+               (SELECT md5(string_agg(id || ':' || name || ':' || capacity, ',' ORDER BY id)) FROM rooms),
+               (SELECT md5(string_agg(exam_id || ':' || room_id, ',' ORDER BY exam_id, room_id))
+                FROM exam_rooms)
+        """
+    )
+    key = (start_date, end_date) + tuple(str(value) for value in cursor.fetchone())
+    with _cache_lock:
+        model = _cache.get(key)
+        if model is not None:
+            _cache.move_to_end(key)
+            return model
+
+    cursor.execute("SELECT id, name, capacity FROM rooms")
+    rooms = {row[0]: {'id': row[0], 'name': row[1], 'capacity': row[2]} for row in cursor.fetchall()}
+    group_sizes = load_group_sizes(cursor)
+    # DRAFT exams have no date yet and are always included, so that they can be placed hypothetically
+    cursor.execute(
+        """
+        SELECT e.id, e.discipline_id, d.name, e.student_group, e.main_teacher_id, e.second_teacher_id,
+               e.status, e.exam_day, e.start_hour, COALESCE(e.duration, %s), e.room_id,
+               ARRAY(SELECT er.room_id FROM exam_rooms er WHERE er.exam_id = e.id
+                     ORDER BY er.is_primary DESC, er.room_id) AS room_ids
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE e.status = 'DRAFT'
+        OR (e.status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED') AND e.exam_day BETWEEN %s AND %s)
+        """,
+        (DEFAULT_DURATION, start_date, end_date)
+    )
+    columns = ['id', 'discipline_id', 'discipline_name', 'student_group', 'main_teacher_id',
+               'second_teacher_id', 'status', 'day', 'start_hour', 'duration', 'room_id', 'room_ids']
+    exams = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+    for exam in exams.values():
+        # exam_rooms holds every room of an exam, the primary one included
+        exam['room_ids'] = list(exam['room_ids'] or []) or ([exam['room_id']] if exam['room_id'] is not None else [])
+
+    model = ScheduleModel(start_date, end_date, exams, rooms, group_sizes)
+    with _cache_lock:
+        _cache[key] = model
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return model
@@ -0,0 +1,295 @@
+"""
+Per-student conflict detection over the whole schedule.
+
+Students sit the exams of their own group and, through the enrollments table, the
+exams of other cohorts (a discipline they retake or an optional one, taken with the
+group named in the enrollment). Group-level checks miss the clashes these students
+have, so this module works per student, with scipy.sparse matrices instead of loops:
+
+    A = students x groups  @  groups x exams       (the group's own exams)
+      + students x cohorts @  cohorts x exams      (enrolled disciplines)
+    O = exams x exams, exams that overlap in time  (one sorted sweep)
+    P = A.T @ A, students shared by two exams
+
+O * P lists the exam pairs that overlap and share students, A @ (exam x day) counts
+every student's exams per day, and (A @ O) * A marks every (student, exam) that clashes.
+The students of each conflicting pair are the intersection of two CSC columns of A.
+20k students and 2k exams take a few hundred milliseconds.
+
+Usage:
+
+    python student_conflicts.py [--active] [--period ID] [--json]
+    python student_conflicts.py --benchmark 20000 2000
+"""
+
+import argparse
+import json
+import time
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
+from database import get_db_connection
+from occupancy import DEFAULT_DURATION
+
+MINUTES_PER_DAY = 24 * 60
+
+Roster = namedtuple('Roster', [
+    'exam_ids',       # int64[n]
+    'day',            # int32[n], days since first_day
+    'start',          # int64[n], minutes since first_day
+    'end',            # int64[n]
+    'exam_group',     # group name of each exam
+    'students',       # student ids
+    'incidence',      # CSR bool students x exams: the student sits the exam
+    'first_day',      # date of day 0, or None
+])
+
+
+def _index(values):
+    """Returns (sorted unique values, int codes) for a list of hashable values."""
+    names, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return names, codes.astype(np.int64)
+
+
+def _one_hot(rows, columns, shape):
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=shape)
+
+
+def build_roster(exam_ids, days, start_hours, durations, exam_groups, exam_disciplines,
+                 student_ids, student_groups, enrollments=(), first_day=None):
+    """
+    Builds a Roster from flat exam columns, the students' own groups and `enrollments`,
+    (student_id, discipline_id, student_group) tuples naming the cohort whose exams an
+    enrolled student sits.
+    """
+    n = len(exam_ids)
+    day = np.asarray(days, dtype=np.int32).reshape(n)
+    start = day.astype(np.int64) * MINUTES_PER_DAY + np.asarray(start_hours, dtype=np.int64).reshape(n) * 60
+    durations = np.array([duration or DEFAULT_DURATION for duration in durations], dtype=np.int64).reshape(n)
+    student_ids = list(student_ids)
+    student_index = {student_id: i for i, student_id in enumerate(student_ids)}
+
+    # Groups shared by exams and students
+    groups, codes = _index(list(exam_groups) + list(student_groups))
+    exam_group, student_group = codes[:n], codes[n:]
+    students_by_group = _one_hot(np.arange(len(student_ids)), student_group, (len(student_ids), len(groups)))
+    group_exams = _one_hot(exam_group, np.arange(n), (len(groups), n))
+    incidence = students_by_group @ group_exams
+
+    # Enrolled cohorts (discipline, group); enrollments without an exam add nothing
+    cohorts = [f"{discipline}\x00{group}" for discipline, group in zip(exam_disciplines, exam_groups)]
+    enrolled = [(student_index[s], f"{d}\x00{g}") for s, d, g in enrollments if s in student_index]
+    if enrolled and n:
+        names, codes = _index(cohorts + [cohort for _, cohort in enrolled])
+        exam_cohort, enrolled_cohort = codes[:n], codes[n:]
+        rows = np.array([student for student, _ in enrolled], dtype=np.int64)
+        student_cohorts = _one_hot(rows, enrolled_cohort, (len(student_ids), len(names)))
+        incidence = incidence + student_cohorts @ _one_hot(exam_cohort, np.arange(n), (len(names), n))
+
+    incidence = incidence.tocsr()
+    incidence.data[:] = 1
+    return Roster(
+        exam_ids=np.asarray(exam_ids, dtype=np.int64).reshape(n),
+        day=day,
+        start=start,
+        end=start + durations,
+        exam_group=list(exam_groups),
+        students=student_ids,
+        incidence=incidence.astype(bool),
+        first_day=first_day,
+    )
+
+
+def overlap_matrix(start, end):
+    """Symmetric CSR exams x exams with a 1 for every pair of exams that overlap in time."""
+    n = len(start)
+    order = np.argsort(start, kind='stable')
+    sorted_start, sorted_end = start[order], end[order]
+    # Exam k overlaps the later-starting exams k+1 .. stop[k]-1
+    stop = np.searchsorted(sorted_start, sorted_end, side='left')
+    counts = np.maximum(stop - np.arange(n) - 1, 0)
+    first = np.repeat(np.arange(n), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+    rows, columns = order[first], order[second]
+    upper = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=(n, n))
+    return upper + upper.T
+
+
+def check(roster):
+    """
+    Returns a report of every student with overlapping exams or several exams on one day:
+    a summary, the conflicting exam pairs (with their shared students) and, per student,
+    the pairs they are in.
+    """
+    started = time.perf_counter()
+    n = len(roster.exam_ids)
+    incidence = roster.incidence.astype(np.int32).tocsr()
+    overlaps = overlap_matrix(roster.start, roster.end)
+    days = int(roster.day.max()) + 1 if n else 0
+    exam_days = _one_hot(np.arange(n), roster.day, (n, days))
+
+    # Per-student flags, straight from the products
+    clashing = (incidence @ overlaps).multiply(incidence).tocsr()
+    per_day = (incidence @ exam_days).tocsr()
+    overlap_students = np.flatnonzero(np.diff(clashing.indptr))
+    day_rows = np.repeat(np.arange(per_day.shape[0]), np.diff(per_day.indptr))
+    same_day_students = np.unique(day_rows[per_day.data > 1])
+
+    # Exam pairs sharing students: overlapping ones, and same-day ones that do not overlap
+    shared = sparse.triu(incidence.T @ incidence, k=1).tocsr()
+    same_day = sparse.triu(exam_days @ exam_days.T, k=1).tocsr()
+    overlapping_pairs = shared.multiply(overlaps).tocoo()
+    same_day_pairs = shared.multiply(same_day)
+    same_day_pairs = (same_day_pairs - same_day_pairs.multiply(overlaps)).tocoo()
+
+    columns = incidence.tocsc()
+    pairs, by_student = [], {}
+    for kind, matrix in (('overlap', overlapping_pairs), ('same_day', same_day_pairs)):
+        keep = matrix.data > 0
+        for i, j in zip(matrix.row[keep], matrix.col[keep]):
+            students = np.intersect1d(
+                columns.indices[columns.indptr[i]:columns.indptr[i + 1]],
+                columns.indices[columns.indptr[j]:columns.indptr[j + 1]],
+                assume_unique=True,
+            )
+            exam_ids = sorted([int(roster.exam_ids[i]), int(roster.exam_ids[j])])
+            pairs.append({
+                'type': kind,
+                'exam_ids': exam_ids,
+                'across_groups': roster.exam_group[i] != roster.exam_group[j],
+                'students': len(students),
+            })
+            for s in students.tolist():
+                by_student.setdefault(s, {'overlap': [], 'same_day': []})[kind].append(exam_ids)
+
+    pairs.sort(key=lambda pair: (pair['type'] != 'overlap', -pair['students'], pair['exam_ids']))
+    students = [
+        {
+            'student_id': roster.students[s],
+            'overlapping': sorted(found['overlap']),
+            'same_day': sorted(found['same_day']),
+        }
+        for s, found in sorted(by_student.items(), key=lambda item: (-len(item[1]['overlap']), -len(item[1]['same_day']), item[0]))
+    ]
+    return {
+        'summary': {
+            'students': len(roster.students),
+            'exams': n,
+            'student_exams': int(incidence.nnz),
+            'students_with_overlaps': len(overlap_students),
+            'students_with_same_day_exams': len(same_day_students),
+            'overlapping_pairs': sum(1 for pair in pairs if pair['type'] == 'overlap'),
+            'same_day_pairs': sum(1 for pair in pairs if pair['type'] == 'same_day'),
+            'cross_group_pairs': sum(1 for pair in pairs if pair['across_groups']),
+        },
+        'pairs': pairs,
+        'students': students,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def load_roster(cursor, statuses=('CONFIRMED',), start_date=None, end_date=None):
+    """Loads the exams with the given statuses (optionally within a date range), the students and the enrollments."""
+    cursor.execute(
+        """
+        SELECT MIN(exam_day) FROM exams
+        WHERE status = ANY(%s) AND exam_day IS NOT NULL AND start_hour IS NOT NULL
+        AND exam_day BETWEEN COALESCE(%s::date, '-infinity') AND COALESCE(%s::date, 'infinity')
+        """,
+        (list(statuses), start_date, end_date)
+    )
+    first_day = cursor.fetchone()[0]
+    cursor.execute(
+        """
+        SELECT id, exam_day - %s::date, start_hour, COALESCE(duration, %s), student_group, discipline_id
+        FROM exams
+        WHERE status = ANY(%s) AND exam_day IS NOT NULL AND start_hour IS NOT NULL
+        AND exam_day BETWEEN COALESCE(%s::date, '-infinity') AND COALESCE(%s::date, 'infinity')
+        """,
+        (first_day, DEFAULT_DURATION, list(statuses), start_date, end_date)
+    )
+    rows = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 6
+    cursor.execute(
+        "SELECT id, COALESCE(student_group, '') FROM users WHERE role IN ('STUDENT', 'SEF_GRUPA') ORDER BY id"
+    )
+    students = cursor.fetchall()
+    cursor.execute("SELECT student_id, discipline_id, student_group FROM enrollments")
+    enrollments = cursor.fetchall()
+    return build_roster(
+        *columns,
+        student_ids=[row[0] for row in students],
+        student_groups=[row[1] for row in students],
+        enrollments=enrollments,
+        first_day=first_day,
+    )
+
+
+def synthetic_roster(students, exams, groups=None, days=20, enrolled_share=0.1, seed=0):
+    """A random schedule of `exams` exams for `students` students, for benchmarking check()."""
+    rng = np.random.default_rng(seed)
+    groups = groups or max(1, students // 25)
+    exam_groups = rng.integers(0, groups, exams)
+    disciplines = rng.integers(0, max(1, exams // 3), exams)
+    extra = int(students * enrolled_share)
+    picks = rng.integers(0, exams, extra)
+    return build_roster(
+        exam_ids=np.arange(exams),
+        days=rng.integers(0, days, exams),
+        start_hours=rng.integers(8, 19, exams),
+        durations=rng.choice([120, 180], exams),
+        exam_groups=[f'G{g}' for g in exam_groups],
+        exam_disciplines=[str(d) for d in disciplines],
+        student_ids=[f's{i}' for i in range(students)],
+        student_groups=[f'G{g}' for g in rng.integers(0, groups, students)],
+        enrollments=[(f's{s}', str(disciplines[e]), f'G{exam_groups[e]}')
+                     for s, e in zip(rng.integers(0, students, extra), picks)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--active', action='store_true', help='check PROPOSED and ACCEPTED exams too, not only CONFIRMED')
+    parser.add_argument('--period', type=int, help='only exams of this exam period')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    parser.add_argument('--benchmark', type=int, nargs=2, metavar=('STUDENTS', 'EXAMS'),
+                        help='check a random schedule instead of the database')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        started = time.perf_counter()
+        roster = synthetic_roster(*args.benchmark)
+        print(f"Built the roster in {(time.perf_counter() - started) * 1000:.0f} ms")
+    else:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            start_date = end_date = None
+            if args.period:
+                cursor.execute("SELECT start_date, end_date FROM exam_periods WHERE id = %s", (args.period,))
+                period = cursor.fetchone()
+                if not period:
+                    parser.error(f"exam period {args.period} not found")
+                start_date, end_date = period
+            statuses = ('PROPOSED', 'ACCEPTED', 'CONFIRMED') if args.active else ('CONFIRMED',)
+            roster = load_roster(cursor, statuses, start_date, end_date)
+        finally:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+
+    report = check(roster)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    summary = report['summary']
+    print(f"Students: {summary['students']}  exams: {summary['exams']}  ({report['elapsed_ms']} ms)")
+    print(", ".join(f"{k}={v}" for k, v in summary.items() if k not in ('students', 'exams')))
+    for pair in report['pairs'][:10]:
+        print(f"  {pair['type']}: exams {pair['exam_ids']}, {pair['students']} students"
+              + (" (across groups)" if pair['across_groups'] else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,9 @@ import psycopg2
 import traceback
 from flask import jsonify, g, request
 import logging
-from database import get_db_connection
-from auth import token_required
+from database import get_db_connection, after_commit
+from auth import token_required, invalidate_user_principal
+from room_ranking import group_headcounts
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -109,13 +110,16 @@ def update_student_info():
             UPDATE users 
             SET {', '.join(update_fields)} 
             WHERE id = %s
-            RETURNING student_group, year_of_study
+            RETURNING student_group, year_of_study, role
         """
         
         cursor.execute(query, tuple(params))
         result = cursor.fetchone()
         conn.commit()
         cursor.close()
+        after_commit(lambda: invalidate_user_principal(user_id))
+        if result:
+            after_commit(lambda: group_headcounts.set_member(user_id, result[2], result[0]))
         
         if result:
             updated_info = {
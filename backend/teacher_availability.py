@@ -0,0 +1,210 @@
+"""
+Hours in which teachers cannot supervise exams, declared per exam period.
+
+A teacher's blocked hours for one period are a bitset with one bit per (day, hour):
+bit (day - start_date) * HOURS_PER_DAY + (hour - DAY_START_HOUR), packed little-endian
+with np.packbits. The row keeps the start_date and the number of days it was built
+for, so the bits stay attached to calendar dates if the period is edited later. A
+three-week period takes 37 bytes per teacher.
+
+TeacherAvailability is a process-wide cache of every bitset, loaded with one query and
+kept current by the CD import through after_commit callbacks; is_blocked() reads at
+most one bit per hour of the exam, so propose and slot search check availability
+without touching the database. A full reload happens every AVAILABILITY_TTL seconds to
+pick up changes made outside this process.
+"""
+
+import math
+import os
+import threading
+import time
+from datetime import date, datetime
+import numpy as np
+from occupancy import DAY_START_HOUR, DAY_END_HOUR, SLOT_MINUTES, DEFAULT_DURATION
+
+HOURS_PER_DAY = DAY_END_HOUR - DAY_START_HOUR
+SLOTS_PER_HOUR = 60 // SLOT_MINUTES
+
+
+def pack(blocked):
+    """bool[days, HOURS_PER_DAY] -> bytes."""
+    return np.packbits(np.asarray(blocked, dtype=bool).ravel(), bitorder='little').tobytes()
+
+
+def unpack(data, days):
+    """bytes -> bool[days, HOURS_PER_DAY]."""
+    bits = np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8), bitorder='little', count=days * HOURS_PER_DAY)
+    return bits.astype(bool).reshape(days, HOURS_PER_DAY)
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def exam_hours(start_hour, duration=None):
+    """The hours of the day an exam touches, clipped to the bookable day."""
+    start_hour = int(start_hour)
+    end = start_hour + (duration or DEFAULT_DURATION) / 60
+    return range(max(start_hour, DAY_START_HOUR), min(math.ceil(end), DAY_END_HOUR))
+
+
+class TeacherAvailability:
+    """Thread-safe {teacher_id: {period_id: (start_date, days, bitset)}}."""
+
+    def __init__(self, ttl=300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._journal = None  # updates made while a reload is querying the database
+        self._blocked = {}
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, cursor):
+        with self._lock:
+            self._journal = []
+        try:
+            cursor.execute("SELECT teacher_id, period_id, start_date, days, blocked FROM teacher_availability")
+            blocked = {}
+            for teacher_id, period_id, start_date, days, bits in cursor.fetchall():
+                blocked.setdefault(teacher_id, {})[period_id] = (start_date, days, bytes(bits))
+            with self._lock:
+                self._blocked = blocked
+                journal, self._journal = self._journal, None
+                for args in journal:
+                    self._set(*args)
+                self._loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def refresh_if_stale(self, connection_factory):
+        if self.is_fresh():
+            return
+        conn = connection_factory()
+        cursor = conn.cursor()
+        try:
+            self.load(cursor)
+        finally:
+            cursor.close()
+            conn.close()
+
+    def set_blocked(self, teacher_id, period_id, start_date, days, bits):
+        """Records the committed bitset of a teacher for a period (None removes it)."""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((teacher_id, period_id, start_date, days, bits))
+            self._set(teacher_id, period_id, start_date, days, bits)
+
+    def _set(self, teacher_id, period_id, start_date, days, bits):
+        periods = self._blocked.setdefault(teacher_id, {})
+        if bits is None:
+            periods.pop(period_id, None)
+        else:
+            periods[period_id] = (start_date, days, bytes(bits))
+
+    def _periods(self, teacher_id):
+        with self._lock:
+            return list(self._blocked.get(teacher_id, {}).values())
+
+    def is_blocked(self, teacher_id, exam_date, start_hour, duration=None):
+        """True if the teacher blocked any hour of an exam at `exam_date`/`start_hour`."""
+        day = _day(exam_date)
+        for start_date, days, bits in self._periods(teacher_id):
+            offset = (day - start_date).days
+            if not 0 <= offset < days:
+                continue
+            for hour in exam_hours(start_hour, duration):
+                bit = offset * HOURS_PER_DAY + hour - DAY_START_HOUR
+                if bits[bit >> 3] >> (bit & 7) & 1:
+                    return True
+        return False
+
+    def blocked_slots(self, teacher_ids, days):
+        """bool[len(days), slots]: the slots in which any of `teacher_ids` is unavailable."""
+        blocked = np.zeros((len(days), HOURS_PER_DAY), dtype=bool)
+        if days:
+            for teacher_id in teacher_ids:
+                for start_date, count, bits in self._periods(teacher_id):
+                    hours = unpack(bits, count)
+                    for d, day in enumerate(days):
+                        offset = (day - start_date).days
+                        if 0 <= offset < count:
+                            blocked[d] |= hours[offset]
+        return np.repeat(blocked, SLOTS_PER_HOUR, axis=1)
+
+    def get(self, teacher_id, period_id):
+        """Returns (start_date, days, bool[days, HOURS_PER_DAY]) or None."""
+        with self._lock:
+            entry = self._blocked.get(teacher_id, {}).get(period_id)
+        if entry is None:
+            return None
+        start_date, days, bits = entry
+        return start_date, days, unpack(bits, days)
+
+
+def unavailable_teachers(exam, exam_date, start_hour):
+    """
+    Returns one conflict entry (type 'unavailable') per teacher of `exam` (a dict with id,
+    duration, main_teacher_id and second_teacher_id) who blocked an hour of the slot.
+    """
+    found = []
+    for teacher_id in dict.fromkeys([exam.get('main_teacher_id'), exam.get('second_teacher_id')]):
+        if teacher_id and teacher_availability.is_blocked(teacher_id, exam_date, start_hour, exam.get('duration')):
+            found.append({
+                'type': 'unavailable',
+                'resource': teacher_id,
+                'exam_id': exam.get('id'),
+                'date': _day(exam_date).isoformat(),
+                'start_hour': int(start_hour),
+                'duration': exam.get('duration') or DEFAULT_DURATION,
+            })
+    return found
+
+
+def parse_blocked(items, start_date, end_date):
+    """
+    Builds the bool[days, HOURS_PER_DAY] matrix of a period from import items: dicts with
+    a date and optionally start_hour/end_hour (the whole day when both are missing).
+    Raises ValueError with a message safe to return to the client.
+    """
+    days = (end_date - start_date).days + 1
+    blocked = np.zeros((days, HOURS_PER_DAY), dtype=bool)
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {i + 1} must be an object")
+        try:
+            day = date.fromisoformat(str(item.get('date')))
+            start_hour = int(item.get('start_hour', DAY_START_HOUR))
+            end_hour = int(item.get('end_hour', DAY_END_HOUR))
+        except (TypeError, ValueError):
+            raise ValueError(f"Item {i + 1}: invalid date or hour")
+        if not start_date <= day <= end_date:
+            raise ValueError(f"Item {i + 1}: {day.isoformat()} is outside the exam period")
+        if not DAY_START_HOUR <= start_hour < end_hour <= DAY_END_HOUR:
+            raise ValueError(f"Item {i + 1}: hours must satisfy {DAY_START_HOUR} <= start_hour < end_hour <= {DAY_END_HOUR}")
+        blocked[(day - start_date).days, start_hour - DAY_START_HOUR:end_hour - DAY_START_HOUR] = True
+    return blocked
+
+
+def blocked_ranges(start_date, blocked):
+    """The inverse of parse_blocked: one {date, start_hour, end_hour} per run of blocked hours."""
+    ranges = []
+    for offset, hours in enumerate(blocked):
+        if not hours.any():
+            continue
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], hours.astype(np.int8), [0]])))
+        day = date.fromordinal(start_date.toordinal() + offset).isoformat()
+        for first, last in zip(edges[0::2], edges[1::2]):
+            ranges.append({'date': day, 'start_hour': DAY_START_HOUR + int(first), 'end_hour': DAY_START_HOUR + int(last)})
+    return ranges
+
+
+teacher_availability = TeacherAvailability(ttl=float(os.environ.get('AVAILABILITY_TTL', 300)))
@@ -0,0 +1,78 @@
+import random
+from datetime import date, datetime, timedelta
+from conflicts import ConflictIndex, IntervalIndex, exam_interval
+
+DAY = date(2026, 11, 4)
+
+
+def _booking(exam_id, start_hour, duration=120, room_id=None, room_ids=None, teachers=(None, None), group=None):
+    start, end = exam_interval(DAY, start_hour, duration)
+    return {
+        'id': exam_id, 'room_id': room_id, 'room_ids': room_ids, 'start': start, 'end': end,
+        'main_teacher_id': teachers[0], 'second_teacher_id': teachers[1], 'student_group': group,
+    }
+
+
+def test_exam_interval_accepts_dates_strings_and_datetimes():
+    expected = (datetime(2026, 11, 4, 10), datetime(2026, 11, 4, 12))
+    assert exam_interval(DAY, 10) == expected
+    assert exam_interval('2026-11-04', '10', 120) == expected
+    assert exam_interval(datetime(2026, 11, 4, 15), 10, None) == expected
+
+
+def test_interval_index_is_half_open():
+    index = IntervalIndex()
+    index.add(*exam_interval(DAY, 10), key=1)
+    assert [entry[2] for entry in index.overlapping(*exam_interval(DAY, 12))] == []
+    assert [entry[2] for entry in index.overlapping(*exam_interval(DAY, 11))] == [1]
+    assert [entry[2] for entry in index.overlapping(*exam_interval(DAY, 8, 121))] == [1]
+
+
+def test_interval_index_matches_brute_force():
+    rng = random.Random(7)
+    base = datetime(2026, 11, 4, 8)
+    intervals = []
+    index = IntervalIndex()
+    for key in range(300):
+        start = base + timedelta(minutes=30 * rng.randrange(100))
+        end = start + timedelta(minutes=rng.choice([60, 120, 180, 600]))
+        intervals.append((start, end, key))
+        index.add(start, end, key)
+
+    for _ in range(50):
+        start = base + timedelta(minutes=15 * rng.randrange(200))
+        end = start + timedelta(minutes=rng.choice([30, 120]))
+        expected = {key for s, e, key in intervals if s < end and start < e}
+        assert {entry[2] for entry in index.overlapping(start, end)} == expected
+
+    expected_pairs = {frozenset((a[2], b[2])) for i, a in enumerate(intervals) for b in intervals[i + 1:]
+                      if a[0] < b[1] and b[0] < a[1]}
+    pairs = [frozenset((a[2], b[2])) for a, b in index.overlapping_pairs()]
+    assert len(pairs) == len(expected_pairs)
+    assert set(pairs) == expected_pairs
+
+
+def test_conflicts_cover_every_room_of_multi_room_exams():
+    index = ConflictIndex([_booking(1, 10, room_ids=[11, 12], group='3A')])
+    start, end = exam_interval(DAY, 11)
+    assert [(c['type'], c['resource']) for c in index.conflicts(start, end, room_id=12)] == [('room', 12)]
+    assert index.conflicts(start, end, room_id=13, room_ids=[14]) == []
+    assert [c['resource'] for c in index.conflicts(start, end, room_ids=[13, 11])] == [11]
+
+
+def test_conflicts_check_teachers_and_groups_and_skip_the_exam_itself():
+    index = ConflictIndex([_booking(1, 10, room_id=11, teachers=('t1', 't2'), group='3A')])
+    start, end = exam_interval(DAY, 10)
+    found = index.conflicts(start, end, room_id=12, teacher_ids=['t2', None], student_group='3A')
+    assert sorted((c['type'], c['resource']) for c in found) == [('group', '3A'), ('teacher', 't2')]
+    assert index.conflicts(start, end, room_id=11, teacher_ids=['t1'], student_group='3A', exclude_exam_id=1) == []
+
+
+def test_all_conflicts_reports_each_shared_resource():
+    index = ConflictIndex([
+        _booking(1, 10, room_ids=[11, 12], teachers=('t1', None), group='3A'),
+        _booking(2, 11, room_id=12, teachers=('t1', None), group='3B'),
+        _booking(3, 12, room_id=11, group='3A'),
+    ])
+    found = sorted((c['type'], c['resource'], tuple(c['exam_ids'])) for c in index.all_conflicts())
+    assert found == [('room', 12, (1, 2)), ('teacher', 't1', (1, 2))]
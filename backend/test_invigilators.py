@@ -0,0 +1,71 @@
+import numpy as np
+from invigilators import Problem, plan
+from occupancy import SLOTS_PER_DAY
+
+TEACHERS = [('t1', 'Ana'), ('t2', 'Bogdan'), ('t3', 'Cristina')]
+
+
+def _exam(exam_id, day, start_hour, main, second=None, discipline_id=100, duration=120):
+    return {
+        'id': exam_id, 'day': day, 'date': f'2026-11-0{day + 2}', 'start_hour': start_hour, 'duration': duration,
+        'main_teacher_id': main, 'second_teacher_id': second, 'discipline_id': discipline_id,
+        'discipline_name': f'D{discipline_id}', 'student_group': '3A',
+    }
+
+
+def _problem(exams, affinity=None, fixed_hours=None, days=2):
+    busy = np.zeros((len(TEACHERS), days, SLOTS_PER_DAY), dtype=bool)
+    return Problem(TEACHERS, exams, affinity or {}, fixed_hours or [0.0] * len(TEACHERS), busy)
+
+
+def _assigned(report, exams):
+    changed = {change['exam_id']: change['to_teacher_id'] for change in report['changes']}
+    return [changed.get(exam['id'], exam['second_teacher_id']) for exam in exams]
+
+
+def test_simultaneous_exams_get_distinct_teachers_other_than_their_main_teacher():
+    exams = [_exam(1, 0, 10, 't1'), _exam(2, 0, 10, 't2')]
+    report = plan(_problem(exams))
+    assigned = _assigned(report, exams)
+    assert assigned[0] != 't1' and assigned[1] != 't2'
+    assert len(set(assigned)) == 2
+    assert report['unassigned'] == []
+
+
+def test_workload_is_balanced_and_affinity_breaks_ties():
+    exams = [_exam(1, 0, 10, 't1', discipline_id=100)]
+    # t2 is idle but t3 teaches the discipline and has little work
+    report = plan(_problem(exams, affinity={100: {'t3'}}, fixed_hours=[0.0, 0.0, 0.5]))
+    assert _assigned(report, exams) == ['t3']
+    # Much more work outweighs the affinity bonus
+    report = plan(_problem(exams, affinity={100: {'t3'}}, fixed_hours=[0.0, 0.0, 10.0]))
+    assert _assigned(report, exams) == ['t2']
+    assert report['workload_after']['max_hours'] == 10.0
+
+
+def test_current_assignment_is_kept_when_equally_good():
+    exams = [_exam(1, 0, 10, 't1', second='t3')]
+    report = plan(_problem(exams))
+    assert report['changed'] == 0
+    assert _assigned(report, exams) == ['t3']
+
+
+def test_busy_teachers_are_skipped_and_exams_left_unassigned():
+    exams = [_exam(1, 0, 10, 't1'), _exam(2, 1, 10, 't1')]
+    problem = _problem(exams)
+    problem.busy[1, 0, :] = True
+    problem.busy[2, :, :] = True
+    report = plan(problem)
+    assert [change['exam_id'] for change in report['changes']] == [2]
+    assert report['changes'][0]['to_teacher_id'] == 't2'
+    assert [exam['exam_id'] for exam in report['unassigned']] == [1]
+
+
+def test_later_exams_see_earlier_assignments():
+    # Back-to-back exams of the same teachers: the second one must not reuse a busy teacher
+    exams = [_exam(1, 0, 10, 't1'), _exam(2, 0, 11, 't1', duration=60)]
+    problem = _problem(exams)
+    problem.busy[2, :, :] = True
+    report = plan(problem)
+    assert _assigned(report, exams)[0] == 't2'
+    assert [exam['exam_id'] for exam in report['unassigned']] == [2]
@@ -0,0 +1,97 @@
+from datetime import date
+from occupancy import RoomOccupancy, SLOTS_PER_DAY, class_parities, minute_slot_range, slot_range
+
+WEDNESDAY = date(2026, 11, 4)
+ROOMS = [
+    {'id': 1, 'name': 'C201', 'capacity': 60, 'building_name': 'C'},
+    {'id': 2, 'name': 'C202', 'capacity': 30, 'building_name': 'C'},
+    {'id': 3, 'name': 'E301', 'capacity': 120, 'building_name': 'E'},
+]
+
+
+def _occupancy(bookings=None, classes=(), class_window=(None, None)):
+    occupancy = RoomOccupancy()
+    occupancy._reset(ROOMS, bookings or {}, classes, class_window)
+    return occupancy
+
+
+def _free(occupancy, day, start_hour, duration=None, min_capacity=None):
+    return [room['name'] for room in occupancy.free_rooms(day, start_hour, duration, min_capacity)]
+
+
+def test_slot_range_clips_to_the_day():
+    assert slot_range(8) == (0, 4)
+    assert slot_range('10', 90) == (4, 7)
+    assert slot_range(21, 180) == (26, SLOTS_PER_DAY)
+    assert slot_range(7, 60) == (0, 0)
+    assert minute_slot_range(8 * 60 + 30, 90) == (1, 4)
+
+
+def test_class_parities_count_weeks_from_the_window_start():
+    start = date(2026, 10, 5)
+    assert class_parities(date(2026, 10, 7)) == (0, 1, 2)
+    assert class_parities(date(2026, 10, 7), start) == (0, 1)
+    assert class_parities(date(2026, 10, 14), start) == (0, 2)
+    assert class_parities(date(2026, 10, 21), start, date(2026, 10, 20)) == ()
+    assert class_parities(date(2026, 10, 1), start) == ()
+
+
+def test_multi_room_bookings_hold_every_room():
+    occupancy = _occupancy({10: ([1, 2], WEDNESDAY, 10, 120, '3A')})
+    assert _free(occupancy, WEDNESDAY, 11) == ['E301']
+    assert _free(occupancy, WEDNESDAY, 12) == ['C201', 'C202', 'E301']
+    assert _free(occupancy, '2026-11-05', 10) == ['C201', 'C202', 'E301']
+    assert _free(occupancy, WEDNESDAY, 12, min_capacity=50) == ['C201', 'E301']
+
+
+def test_set_booking_moves_and_remove_booking_frees():
+    occupancy = _occupancy()
+    occupancy._loaded_at = 0.0
+    occupancy.set_booking(10, 1, WEDNESDAY, 10)
+    assert _free(occupancy, WEDNESDAY, 10) == ['C202', 'E301']
+    occupancy.set_booking(10, [2, 3], WEDNESDAY, 10, 60, '3A')
+    assert _free(occupancy, WEDNESDAY, 10) == ['C201']
+    assert _free(occupancy, WEDNESDAY, 11) == ['C201', 'C202', 'E301']
+    occupancy.remove_booking(10)
+    assert _free(occupancy, WEDNESDAY, 10) == ['C201', 'C202', 'E301']
+    assert occupancy.stats()['bookings'] == 0
+
+
+def test_unknown_rooms_mark_the_index_stale():
+    occupancy = _occupancy()
+    occupancy._loaded_at = 0.0
+    occupancy.set_booking(10, [1, 99], WEDNESDAY, 10)
+    assert occupancy._loaded_at is None
+    assert _free(occupancy, WEDNESDAY, 10) == ['C202', 'E301']
+
+
+def test_classes_follow_weekday_and_parity():
+    # C202 every Wednesday 10:30-12:00, E301 on Wednesdays of odd weeks from 2026-11-02
+    classes = [(2, 2, 10 * 60 + 30, 90, 0), (3, 2, 8 * 60, 120, 1)]
+    occupancy = _occupancy(classes=classes, class_window=(date(2026, 11, 2), None))
+    assert _free(occupancy, WEDNESDAY, 11) == ['C201', 'E301']
+    assert _free(occupancy, WEDNESDAY, 8) == ['C201', 'C202']
+    assert _free(occupancy, date(2026, 11, 11), 8) == ['C201', 'C202', 'E301']
+    assert _free(occupancy, date(2026, 11, 5), 11) == ['C201', 'C202', 'E301']
+
+
+def test_busy_slots_ignore_the_excluded_exam():
+    occupancy = _occupancy({10: ([1], WEDNESDAY, 10, 120, '3A'), 11: ([1], WEDNESDAY, 14, 60, '3B')})
+    rooms, busy = occupancy.busy_slots([WEDNESDAY, date(2026, 11, 5)], exclude_exam_id=10)
+    assert [room['name'] for room in rooms] == ['C201', 'C202', 'E301']
+    assert busy.shape == (3, 2, SLOTS_PER_DAY)
+    assert busy[0, 0].nonzero()[0].tolist() == [12, 13]
+    assert not busy[:, 1].any()
+
+
+def test_stranded_slots_count_short_gaps_left_by_a_booking():
+    occupancy = _occupancy({10: ([1], WEDNESDAY, 8, 120, '3A')})
+    # 11:00-13:00 in C201 leaves 10:00-11:00 (two slots, shorter than an exam) unusable
+    assert occupancy.stranded_slots(WEDNESDAY, 11) == {1: 2, 2: 0, 3: 0}
+
+
+def test_group_buildings():
+    occupancy = _occupancy({10: ([1, 3], WEDNESDAY, 10, 120, '3A'), 11: ([2], WEDNESDAY, 14, 60, '3B')})
+    assert occupancy.group_buildings('3A') == ['C', 'E']
+    assert occupancy.group_buildings('3B') == ['C']
+    assert occupancy.group_buildings('4A') == []
@@ -0,0 +1,56 @@
+import pytest
+from room_allocation import AllocationError, allocate, split_seats
+
+
+def _rooms(*capacities):
+    return [{'id': i + 1, 'name': f'R{i + 1}', 'capacity': capacity} for i, capacity in enumerate(capacities)]
+
+
+def test_allocate_picks_the_smallest_room_that_holds_the_group():
+    allocation, method = allocate(_rooms(120, 60, 30), 45)
+    assert method == 'single'
+    assert allocation == [{'room_id': 2, 'room_name': 'R2', 'capacity': 60, 'seats': 45}]
+
+
+def test_allocate_exact_search_beats_first_fit_decreasing():
+    # First-fit-decreasing takes 50 + 30 (15 seats wasted); 35 + 30 wastes none
+    allocation, method = allocate(_rooms(50, 40, 35, 30), 65)
+    assert method == 'exact'
+    assert [share['room_id'] for share in allocation] == [3, 4]
+    assert sum(share['seats'] for share in allocation) == 65
+
+
+def test_allocate_uses_the_fewest_rooms():
+    allocation, _ = allocate(_rooms(10, 10, 10, 10, 100), 95)
+    assert [share['room_id'] for share in allocation] == [5]
+
+
+def test_allocate_ignores_rooms_without_capacity():
+    allocation, _ = allocate(_rooms(None, 0, 40), 30)
+    assert [share['room_id'] for share in allocation] == [3]
+
+
+def test_allocate_rejects_groups_that_do_not_fit():
+    with pytest.raises(AllocationError, match='70 of 100'):
+        allocate(_rooms(40, 30), 100)
+    with pytest.raises(AllocationError):
+        allocate(_rooms(40), 0)
+
+
+def test_split_seats_fills_the_largest_rooms_first():
+    allocation = split_seats(_rooms(30, 60), 75)
+    assert [(share['room_name'], share['seats']) for share in allocation] == [('R2', 60), ('R1', 15)]
+
+
+def test_split_seats_strict_rejects_short_or_idle_rooms():
+    with pytest.raises(AllocationError, match='90 of 100'):
+        split_seats(_rooms(60, 30), 100)
+    with pytest.raises(AllocationError, match='without R2'):
+        split_seats(_rooms(60, 30), 50)
+
+
+def test_split_seats_not_strict_leaves_the_rest_unseated():
+    allocation = split_seats(_rooms(60, 30), 100, strict=False)
+    assert [share['seats'] for share in allocation] == [60, 30]
+    allocation = split_seats(_rooms(60, 30), 50, strict=False)
+    assert [share['seats'] for share in allocation] == [50, 0]
@@ -0,0 +1,59 @@
+import numpy as np
+from student_conflicts import build_roster, check, overlap_matrix
+
+
+def test_overlap_matrix_matches_brute_force():
+    rng = np.random.default_rng(3)
+    start = rng.integers(0, 5000, 400).astype(np.int64)
+    end = start + rng.choice([60, 120, 180], 400)
+    expected = (start[:, None] < end[None, :]) & (start[None, :] < end[:, None])
+    np.fill_diagonal(expected, False)
+    assert np.array_equal(overlap_matrix(start, end).toarray() > 0, expected)
+
+
+def test_overlap_matrix_is_half_open():
+    matrix = overlap_matrix(np.array([0, 120, 60]), np.array([120, 240, 180]))
+    assert matrix.toarray().tolist() == [[0, 0, 1], [0, 0, 1], [1, 1, 0]]
+
+
+def _roster(enrollments=()):
+    # Exams 1 and 2 (3A and 3B) overlap on day 0, exam 3 (3A) is later the same day, exam 4 is on day 1
+    return build_roster(
+        exam_ids=[1, 2, 3, 4],
+        days=[0, 0, 0, 1],
+        start_hours=[10, 11, 14, 10],
+        durations=[120, 120, None, 120],
+        exam_groups=['3A', '3B', '3A', '3B'],
+        exam_disciplines=[100, 200, 300, 400],
+        student_ids=['a', 'b', 'c'],
+        student_groups=['3A', '3A', '3B'],
+        enrollments=enrollments,
+    )
+
+
+def test_build_roster_adds_enrolled_cohorts():
+    roster = _roster(enrollments=[('a', 200, '3B'), ('a', 999, '3B'), ('unknown', 200, '3B')])
+    assert roster.incidence.toarray().tolist() == [
+        [True, True, True, False],
+        [True, False, True, False],
+        [False, True, False, True],
+    ]
+    assert roster.end.tolist() == [720, 780, 960, 2160]
+
+
+def test_check_reports_cross_group_clashes_of_enrolled_students():
+    report = check(_roster(enrollments=[('a', 200, '3B')]))
+    summary = report['summary']
+    assert summary['students_with_overlaps'] == 1
+    assert summary['students_with_same_day_exams'] == 2
+    assert summary['cross_group_pairs'] == 2
+
+    pairs = [(pair['type'], pair['exam_ids'], pair['students']) for pair in report['pairs']]
+    assert pairs == [('overlap', [1, 2], 1), ('same_day', [1, 3], 2), ('same_day', [2, 3], 1)]
+    assert report['students'][0] == {'student_id': 'a', 'overlapping': [[1, 2]], 'same_day': [[1, 3], [2, 3]]}
+
+
+def test_check_without_enrollments_has_no_overlaps():
+    report = check(_roster())
+    assert report['summary']['students_with_overlaps'] == 0
+    assert [pair['exam_ids'] for pair in report['pairs']] == [[1, 3]]
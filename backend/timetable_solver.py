@@ -0,0 +1,461 @@
+"""
+Automatic timetabling of DRAFT exams.
+
+Given an exam period, the solver assigns every DRAFT exam a weekday, a start hour
+(8-18) and a room so that no room, teacher or student group is double-booked and
+every room holds its group. Among those assignments it prefers ones that keep a
+group's exams on different days and MIN_GAP_DAYS apart, and rooms that are not
+much larger than the group.
+
+Each run builds a greedy solution (most constrained exams first, cheapest slot each)
+and improves it with iterated local search: exams are moved to their cheapest
+feasible slot until no move helps, then a few exams are shaken loose and the search
+continues until the time limit. Independent runs with different seeds are spread
+over a process pool and the cheapest result wins.
+
+The solver itself is pure (NumPy in, plain dicts out); load_problem() and
+apply_solution() are the only functions that touch the database.
+"""
+
+import math
+import multiprocessing
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import numpy as np
+from occupancy import slot_range, DAY_START_HOUR, SLOT_MINUTES, SLOTS_PER_DAY
+from teacher_availability import teacher_availability
+from class_timetable import class_timetable
+from conflicts import load_group_sizes
+
+# The exams table only accepts start hours between 8 and 18
+LATEST_START_HOUR = 18
+
+SAME_DAY_PENALTY = 1000.0
+MIN_GAP_DAYS = 2
+GAP_PENALTY = 100.0  # per calendar day short of MIN_GAP_DAYS
+WASTE_PENALTY = 10.0  # times the fraction of the room's seats left empty
+UNPLACED_PENALTY = 1e6
+
+Problem = namedtuple('Problem', [
+    'days',          # weekdays of the period, as dates
+    'rooms',         # (id, name, capacity) tuples
+    'exams',         # dicts: id, student_group, teachers, duration, group_size, discipline_name
+    'room_busy',     # bool rooms x days x slots, from bookings outside the solver
+    'teacher_busy',  # teacher id -> bool days x slots
+    'group_busy',    # student group -> bool days x slots
+    'group_days',    # student group -> day indexes of its existing bookings
+])
+
+
+def _penalty_matrices(days):
+    ordinal = np.array([day.toordinal() for day in days])
+    distance = np.abs(ordinal[:, np.newaxis] - ordinal[np.newaxis, :])
+    same_day = np.where(distance == 0, SAME_DAY_PENALTY, 0.0)
+    spacing = np.where(distance > 0, np.maximum(0, MIN_GAP_DAYS - distance) * GAP_PENALTY, 0.0)
+    return same_day, spacing
+
+
+def _free_windows(busy, first_slots, length):
+    """busy[..., slots] -> bool[..., starts]: no busy slot in [first, first + length)."""
+    covered = np.concatenate(
+        [np.zeros(busy.shape[:-1] + (1,), dtype=np.int32), np.cumsum(busy, axis=-1, dtype=np.int32)], axis=-1
+    )
+    return covered[..., first_slots + length] == covered[..., first_slots]
+
+
+class _Search:
+    """Mutable state of one solver run."""
+
+    def __init__(self, problem, seed):
+        self.problem = problem
+        self.rng = random.Random(seed)
+        self.days = problem.days
+        self.same_day, self.spacing = _penalty_matrices(problem.days)
+        self.penalty = self.same_day + self.spacing
+        self.capacity = np.array([room[2] or 0 for room in problem.rooms], dtype=np.float64)
+
+        shape = (len(problem.days), SLOTS_PER_DAY)
+        self.room_occ = problem.room_busy.astype(np.int16)
+        self.teacher_occ = {}
+        self.group_occ = {}
+        self.group_days = {}
+        for exam in problem.exams:
+            for teacher in exam['teachers']:
+                if teacher not in self.teacher_occ:
+                    fixed = problem.teacher_busy.get(teacher)
+                    self.teacher_occ[teacher] = fixed.astype(np.int16) if fixed is not None else np.zeros(shape, np.int16)
+            group = exam['student_group']
+            if group not in self.group_occ:
+                fixed = problem.group_busy.get(group)
+                self.group_occ[group] = fixed.astype(np.int16) if fixed is not None else np.zeros(shape, np.int16)
+                self.group_days[group] = list(problem.group_days.get(group, []))
+
+        self.hours = np.arange(DAY_START_HOUR, LATEST_START_HOUR + 1)
+        self.first_slots = (self.hours - DAY_START_HOUR) * 60 // SLOT_MINUTES
+        self.placement = [None] * len(problem.exams)  # (day, hour index, room) per exam
+
+    # --- Occupancy bookkeeping ---
+
+    def _slots(self, exam, hour_index):
+        return slot_range(self.hours[hour_index], exam['duration'])
+
+    def _mark(self, i, placement, delta):
+        exam = self.problem.exams[i]
+        d, h, r = placement
+        first, last = self._slots(exam, h)
+        self.room_occ[r, d, first:last] += delta
+        for teacher in exam['teachers']:
+            self.teacher_occ[teacher][d, first:last] += delta
+        self.group_occ[exam['student_group']][d, first:last] += delta
+        if delta > 0:
+            self.group_days[exam['student_group']].append(d)
+        else:
+            self.group_days[exam['student_group']].remove(d)
+
+    def place(self, i, placement):
+        self.placement[i] = placement
+        self._mark(i, placement, 1)
+
+    def unplace(self, i):
+        placement, self.placement[i] = self.placement[i], None
+        if placement is not None:
+            self._mark(i, placement, -1)
+        return placement
+
+    # --- Costs ---
+
+    def _waste(self, exam):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            waste = np.where(self.capacity > 0, (self.capacity - exam['group_size']) / self.capacity, 1.0)
+        return WASTE_PENALTY * waste
+
+    def _day_costs(self, exam):
+        other_days = self.group_days[exam['student_group']]
+        if not other_days:
+            return np.zeros(len(self.days))
+        return self.penalty[:, other_days].sum(axis=1)
+
+    def candidates(self, i):
+        """Returns (feasible rooms x days x hours mask, cost of each cell) for exam i, ignoring its own booking."""
+        exam = self.problem.exams[i]
+        length = min(-(-exam['duration'] // SLOT_MINUTES), SLOTS_PER_DAY + 1)
+        fits = self.first_slots + length <= SLOTS_PER_DAY
+        first_slots = np.where(fits, self.first_slots, 0)
+        length = min(length, SLOTS_PER_DAY)
+
+        feasible = _free_windows(self.room_occ > 0, first_slots, length)
+        people = self.group_occ[exam['student_group']] > 0
+        for teacher in exam['teachers']:
+            people = people | (self.teacher_occ[teacher] > 0)
+        feasible &= _free_windows(people, first_slots, length)[np.newaxis]
+        feasible &= fits[np.newaxis, np.newaxis, :]
+        feasible &= (self.capacity >= exam['group_size'])[:, np.newaxis, np.newaxis]
+
+        cost = self._waste(exam)[:, np.newaxis, np.newaxis] + self._day_costs(exam)[np.newaxis, :, np.newaxis]
+        return feasible, np.broadcast_to(cost, feasible.shape)
+
+    def best_placement(self, i, noise=0.0):
+        feasible, cost = self.candidates(i)
+        if not feasible.any():
+            return None, UNPLACED_PENALTY
+        cost = np.where(feasible, cost, np.inf)
+        if noise:
+            cost = cost + np.random.default_rng(self.rng.getrandbits(32)).random(cost.shape) * noise
+        flat = int(np.argmin(cost))
+        r, d, h = np.unravel_index(flat, cost.shape)
+        return (int(d), int(h), int(r)), float(cost[r, d, h])
+
+    def exam_cost(self, i, placement):
+        """Cost of exam i at `placement`, against everything else currently placed."""
+        if placement is None:
+            return UNPLACED_PENALTY
+        exam = self.problem.exams[i]
+        d, _, r = placement
+        return float(self._waste(exam)[r] + self._day_costs(exam)[d])
+
+    def total_cost(self):
+        same_day = spacing = waste = 0.0
+        unplaced = 0
+        fixed_days = self.problem.group_days
+        by_group = {}
+        for i, placement in enumerate(self.placement):
+            if placement is None:
+                unplaced += 1
+                continue
+            exam = self.problem.exams[i]
+            waste += float(self._waste(exam)[placement[2]])
+            by_group.setdefault(exam['student_group'], []).append(placement[0])
+        for group, days in by_group.items():
+            fixed = fixed_days.get(group, [])
+            for k, d in enumerate(days):
+                others = days[k + 1:] + fixed
+                same_day += float(self.same_day[d, others].sum())
+                spacing += float(self.spacing[d, others].sum())
+        return {
+            'total': round(same_day + spacing + waste + unplaced * UNPLACED_PENALTY, 3),
+            'same_day': round(same_day, 3),
+            'spacing': round(spacing, 3),
+            'capacity_waste': round(waste, 3),
+            'unplaced': unplaced,
+        }
+
+    # --- Search ---
+
+    def greedy(self, noise):
+        exams = self.problem.exams
+        teacher_load, group_load = {}, {}
+        for exam in exams:
+            for teacher in exam['teachers']:
+                teacher_load[teacher] = teacher_load.get(teacher, 0) + 1
+            group_load[exam['student_group']] = group_load.get(exam['student_group'], 0) + 1
+
+        def difficulty(i):
+            exam = exams[i]
+            return (group_load[exam['student_group']] + sum(teacher_load[t] for t in exam['teachers']),
+                    exam['group_size'], exam['duration'], self.rng.random())
+
+        for i in sorted(range(len(exams)), key=difficulty, reverse=True):
+            placement, _ = self.best_placement(i, noise)
+            if placement is not None:
+                self.place(i, placement)
+
+    def local_search(self, deadline):
+        """Moves exams to their cheapest feasible slot until a full pass finds no improvement."""
+        order = list(range(len(self.problem.exams)))
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            self.rng.shuffle(order)
+            for i in order:
+                current = self.unplace(i)
+                current_cost = self.exam_cost(i, current)
+                candidate, candidate_cost = self.best_placement(i)
+                if candidate is not None and candidate_cost < current_cost - 1e-9:
+                    self.place(i, candidate)
+                    improved = True
+                elif current is not None:
+                    self.place(i, current)
+
+    def perturb(self, fraction, noise):
+        placed = [i for i, placement in enumerate(self.placement) if placement is not None]
+        if not placed:
+            return
+        shaken = self.rng.sample(placed, max(1, int(len(placed) * fraction)))
+        for i in shaken:
+            self.unplace(i)
+        for i in shaken:
+            placement, _ = self.best_placement(i, noise)
+            if placement is not None:
+                self.place(i, placement)
+
+
+def _solve_once(args):
+    problem, seed, time_limit = args
+    started = time.monotonic()
+    deadline = started + time_limit
+    search = _Search(problem, seed)
+    search.greedy(noise=1.0 if seed else 0.0)
+    search.local_search(deadline)
+
+    best_cost = search.total_cost()
+    best = list(search.placement)
+    rounds = 0
+    while time.monotonic() < deadline and len(problem.exams) > 1:
+        rounds += 1
+        search.perturb(fraction=0.1, noise=5.0)
+        search.local_search(deadline)
+        cost = search.total_cost()
+        if cost['total'] < best_cost['total']:
+            best_cost, best = cost, list(search.placement)
+        else:
+            # Restart the next round from the best solution found so far
+            for i in range(len(best)):
+                search.unplace(i)
+            for i, placement in enumerate(best):
+                if placement is not None:
+                    search.place(i, placement)
+
+    return {
+        'seed': seed,
+        'cost': best_cost,
+        'placement': best,
+        'rounds': rounds,
+        'elapsed_ms': int((time.monotonic() - started) * 1000),
+    }
+
+
+def solve(problem, restarts=4, workers=None, time_limit=5.0, seed=0):
+    """
+    Runs `restarts` independent searches (on a process pool when more than one worker is
+    available) and returns a report with the cheapest assignment. `time_limit` bounds the
+    whole call: runs that share a worker split it, so the searches end after about
+    `time_limit` seconds however many restarts there are.
+    """
+    started = time.monotonic()
+    workers = min(workers or multiprocessing.cpu_count(), restarts)
+    waves = math.ceil(restarts / max(workers, 1))
+    jobs = [(problem, seed + k, time_limit / waves) for k in range(restarts)]
+    if not problem.exams:
+        runs = []
+    elif workers <= 1:
+        runs = [_solve_once(job) for job in jobs]
+    else:
+        # Workers only run _solve_once on the pickled problem; they never touch the
+        # database connections or app state inherited from the parent
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            runs = list(pool.map(_solve_once, jobs))
+
+    best = min(runs, key=lambda run: run['cost']['total']) if runs else None
+    assignments, unplaced = [], []
+    for i, exam in enumerate(problem.exams):
+        placement = best['placement'][i] if best else None
+        if placement is None:
+            unplaced.append({
+                'exam_id': exam['id'],
+                'discipline_name': exam['discipline_name'],
+                'student_group': exam['student_group'],
+                'reason': 'No date, hour and room satisfies the room, teacher, group and capacity constraints',
+            })
+            continue
+        d, h, r = placement
+        room = problem.rooms[r]
+        assignments.append({
+            'exam_id': exam['id'],
+            'discipline_name': exam['discipline_name'],
+            'student_group': exam['student_group'],
+            'date': problem.days[d].isoformat(),
+            'start_hour': DAY_START_HOUR + h,
+            'duration': exam['duration'],
+            'room_id': room[0],
+            'room_name': room[1],
+            'room_capacity': room[2],
+            'group_size': exam['group_size'],
+        })
+    assignments.sort(key=lambda a: (a['date'], a['start_hour'], a['room_name']))
+
+    return {
+        'exams': len(problem.exams),
+        'placed': len(assignments),
+        'unplaced': unplaced,
+        'cost': best['cost'] if best else None,
+        'best_seed': best['seed'] if best else None,
+        'runs': [{k: run[k] for k in ('seed', 'cost', 'rounds', 'elapsed_ms')} for run in runs],
+        'elapsed_ms': int((time.monotonic() - started) * 1000),
+        'assignments': assignments,
+    }
+
+
+def load_problem(cursor, start_date, end_date):
+    """
+    Reads the DRAFT exams, rooms, group sizes, existing bookings, teacher availability and
+    regular classes (from the teacher_availability and class_timetable caches, which the
+    caller refreshes) for a date range.
+    """
+    start_date = max(start_date, date.today())
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    days = [day for day in days if day.weekday() < 5]
+
+    cursor.execute("SELECT id, name, capacity FROM rooms ORDER BY capacity, name")
+    rooms = [tuple(row) for row in cursor.fetchall()]
+
+    group_sizes = load_group_sizes(cursor)
+
+    cursor.execute(
+        """
+        SELECT e.id, e.student_group, e.main_teacher_id, e.second_teacher_id,
+               COALESCE(e.duration, 120), d.name
+        FROM exams e
+        LEFT JOIN disciplines d ON e.discipline_id = d.id
+        WHERE e.status = 'DRAFT'
+        ORDER BY e.id
+        """
+    )
+    exams = [
+        {
+            'id': exam_id,
+            'student_group': group,
+            'teachers': tuple(sorted({main, second} - {None})),
+            'duration': duration,
+            'group_size': group_sizes.get(group, 0),
+            'discipline_name': name,
+        }
+        for exam_id, group, main, second, duration, name in cursor.fetchall()
+    ]
+
+    shape = (len(days), SLOTS_PER_DAY)
+    room_busy = np.zeros((len(rooms),) + shape, dtype=bool)
+    teacher_busy, group_busy, group_days = {}, {}, {}
+    if days:
+        cursor.execute(
+            """
+            SELECT ARRAY(SELECT er.room_id FROM exam_rooms er WHERE er.exam_id = e.id),
+                   exam_day - %s::date, start_hour, COALESCE(duration, 120),
+                   main_teacher_id, second_teacher_id, student_group
+            FROM exams e
+            WHERE exam_day BETWEEN %s AND %s AND start_hour IS NOT NULL
+            AND status IN ('PROPOSED', 'ACCEPTED', 'CONFIRMED')
+            """,
+            (days[0], days[0], days[-1])
+        )
+        offsets = {(day - days[0]).days: i for i, day in enumerate(days)}
+        room_index = {room[0]: i for i, room in enumerate(rooms)}
+        for room_ids, offset, hour, duration, main, second, group in cursor.fetchall():
+            d = offsets.get(offset)
+            if d is None:
+                continue
+            first, last = slot_range(hour, duration)
+            for room_id in room_ids:
+                if room_id in room_index:
+                    room_busy[room_index[room_id], d, first:last] = True
+            for teacher in {main, second} - {None}:
+                teacher_busy.setdefault(teacher, np.zeros(shape, dtype=bool))[d, first:last] = True
+            if group:
+                group_busy.setdefault(group, np.zeros(shape, dtype=bool))[d, first:last] = True
+                group_days.setdefault(group, []).append(d)
+
+    # Hours the teachers blocked in their availability calendars count as busy, and so do
+    # the regular classes of rooms, teachers and groups
+    for teacher in {teacher for exam in exams for teacher in exam['teachers']}:
+        blocked = teacher_availability.blocked_slots([teacher], days) | class_timetable.busy_slots([teacher], None, days)
+        if blocked.any():
+            teacher_busy[teacher] = teacher_busy.get(teacher, np.zeros(shape, dtype=bool)) | blocked
+    for group in {exam['student_group'] for exam in exams}:
+        blocked = class_timetable.busy_slots([], group, days)
+        if blocked.any():
+            group_busy[group] = group_busy.get(group, np.zeros(shape, dtype=bool)) | blocked
+    for r, room in enumerate(rooms):
+        for d, day in enumerate(days):
+            for entry in class_timetable.classes_on('room', room[0], day):
+                room_busy[r, d, entry['slots'][0]:entry['slots'][1]] = True
+
+    return Problem(days, rooms, exams, room_busy, teacher_busy, group_busy, group_days)
+
+
+def apply_solution(cursor, assignments):
+    """
+    Writes the assignments as PROPOSED in one statement. Returns the ids of the exams that
+    were no longer DRAFT and therefore not updated; the caller decides whether to commit.
+    """
+    if not assignments:
+        return []
+    cursor.execute(
+        """
+        UPDATE exams e
+        SET exam_date = a.exam_date, start_hour = a.start_hour, room_id = a.room_id,
+            status = 'PROPOSED', updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::int[], %s::date[], %s::int[], %s::int[]) AS a(id, exam_date, start_hour, room_id)
+        WHERE e.id = a.id AND e.status = 'DRAFT'
+        RETURNING e.id
+        """,
+        (
+            [a['exam_id'] for a in assignments],
+            [a['date'] for a in assignments],
+            [a['start_hour'] for a in assignments],
+            [a['room_id'] for a in assignments],
+        )
+    )
+    updated = {row[0] for row in cursor.fetchall()}
+    return [a['exam_id'] for a in assignments if a['exam_id'] not in updated]